@@ -2,17 +2,24 @@ from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
 import joblib
 import pandas as pd
-import numpy as np
 import json
 import os
+import time
 from datetime import datetime
 import pickle
+from features import compute_features, bot_verdict, FEATURES, SIMPLE_MODEL_FEATURES
+from session_store import open_session_store
+from verdict_log import open_verdict_log
+from cascade import Cascade
+from mouse_codec import CONTENT_TYPE as COMPACT_MOUSE_CONTENT_TYPE, decode_mouse_payload, decode_mouse_payload_b64, decompress_body
+from event_collector import open_event_collector
+from drift_monitor import open_drift_monitor, DRIFT_REFERENCE_PATH
 
 app = Flask(__name__)
 CORS(app)
 
-# Load the trained model - using the correct simple test model
-model_path = 'model/simple_test_model.joblib'
+# Load the trained model - using the correct simple test model (BOT_MODEL_PATH serves another, e.g. a distilled student)
+model_path = os.environ.get('BOT_MODEL_PATH', 'model/simple_test_model.joblib')
 if os.path.exists(model_path):
     model = joblib.load(model_path)
     print("✅ Model loaded successfully")
@@ -20,12 +27,89 @@ else:
     print("❌ Model not found. Please run train_final_model.py first")
     model = None
 
-# Define feature names for the simple model
-feature_names = [
-    'total_session_duration', 'avg_time_between_moves', 'num_left_clicks',
-    'total_distance', 'avg_bytes_sent', 'avg_status_code', 'avg_speed',
-    'max_x', 'max_y', 'min_x', 'min_y'
-]
+# The simple model does not record the names it was fitted on, so fall back to its feature list
+feature_names = list(getattr(model, 'feature_names_in_', SIMPLE_MODEL_FEATURES))
+
+# Only the features the model reads are computed per request; unknown names are fed as 0
+computed_feature_names = [name for name in feature_names if name in FEATURES]
+if len(computed_feature_names) < len(feature_names):
+    print(f"⚠️ Model expects features with no extractor, using 0 for: {[n for n in feature_names if n not in FEATURES]}")
+
+# Per-session state (request count, latest verdict) shared by every worker process on this host
+session_store = open_session_store()
+
+# Optional write-behind log of every verdict with its features, for audit and retraining (BOT_VERDICT_LOG=1)
+verdict_log = open_verdict_log()
+
+# Cheap rule and lookup stages that settle obvious bots before the model (configure with BOT_CASCADE)
+cascade = Cascade()
+
+# Mouse activity streamed in chunks by static/collector.js, spooled per session where every worker can read it
+event_collector = open_event_collector()
+
+# Binned drift of scored features against the training reference written by train_final_model.py
+drift_monitor = open_drift_monitor(feature_names)
+
+def read_detect_request():
+    """
+    Parses a detection request body, inflating gzip/deflate Content-Encoding first. The body is either JSON or,
+    with Content-Type application/x-bot-mouse, a compact mouse payload alone (session_id in the query string).
+    JSON requests may carry the compact payload base64-encoded as 'mouse_events_b64' instead of 'mouse_movements'.
+    Compact payloads are decoded straight into arrays and stored under 'mouse_events'.
+    Raises ValueError for a body that cannot be inflated, parsed or decoded.
+    """
+    body = decompress_body(request.get_data(), request.headers.get('Content-Encoding'))
+    if request.mimetype == COMPACT_MOUSE_CONTENT_TYPE:
+        return {'session_id': request.args.get('session_id'), 'mouse_events': decode_mouse_payload(body)}
+    data = json.loads(body) if body else {}
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    if data.get('mouse_events_b64'):
+        if not isinstance(data['mouse_events_b64'], str):
+            raise ValueError("'mouse_events_b64' must be a base64 string")
+        data['mouse_events'] = decode_mouse_payload_b64(data['mouse_events_b64'])
+    return data
+
+def mouse_sources(data):
+    """compute_features() sources for the request's mouse data (decoded compact events are passed as 'events')."""
+    sources = {'mouse_data': data.get('mouse_movements', {})}
+    if data.get('mouse_events') is not None:
+        sources['events'] = data['mouse_events']
+    return sources
+
+def request_session_id(data):
+    """The session a detection request belongs to: an explicit session_id, else the one in its web logs."""
+    if data.get('session_id'):
+        return str(data['session_id'])
+    for log in data.get('web_logs', []):
+        if log.get('session_id'):
+            return str(log['session_id'])
+    return None
+
+def record_verdict(session_id, prediction, bot_probability):
+    def update(state):
+        state = state or {'requests': 0, 'first_seen': datetime.now().isoformat(timespec='seconds')}
+        state['requests'] += 1
+        state['prediction'] = prediction
+        state['bot_probability'] = round(bot_probability, 4)
+        return state
+    return session_store.update(session_id, update)
+
+def finish_detection(result, session_id, features):
+    """Records the verdict in the session store and the verdict log, and returns the response body."""
+    if session_id:
+        result['session'] = record_verdict(session_id, result['prediction'], result['bot_probability'])
+
+    if verdict_log is not None:
+        verdict_log.submit({
+            'timestamp': result['timestamp'],
+            'session_id': session_id,
+            'prediction': result['prediction'],
+            'bot_probability': result['bot_probability'],
+            'decided_by': result['decided_by'],
+            'features': features
+        })
+    return result
 
 @app.route('/')
 def index():
@@ -45,32 +129,58 @@ def detect_bot():
         return jsonify({'error': 'Model not loaded'}), 500
     
     try:
-        data = request.json
-        
-        # Extract features from the request
-        features = {}
-        
-        # Mouse movement features
-        mouse_data = data.get('mouse_movements', {})
-        features.update(extract_mouse_features(mouse_data))
-        
-        # Web log features
-        web_logs = data.get('web_logs', [])
-        features.update(extract_web_log_features(web_logs))
+        data = read_detect_request()
+    except ValueError as e:
+        # A corrupt body or a malformed payload is the client's error, not the server's
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        session_id = request_session_id(data)
+        if session_id and data.get('mouse_events') is None and not data.get('mouse_movements'):
+            # No mouse data in the request: use whatever the page's collector streamed for this session
+            data['mouse_events'] = event_collector.events(session_id)
+
+        # Obvious bots are decided by the cascade without feature extraction, inference or explanation
+        decision = cascade.decide({
+            'mouse_sources': mouse_sources(data),
+            'web_logs': data.get('web_logs', []),
+            'session_state': session_store.get(session_id) if session_id else None
+        })
+        if decision is not None:
+            stage_name, bot_probability = decision
+            result = {
+                'prediction': 1,
+                'prediction_label': 'Bot',
+                'confidence': bot_probability,
+                'bot_probability': bot_probability,
+                'human_probability': 1 - bot_probability,
+                'top_features': [],
+                'decided_by': stage_name,
+                'timestamp': datetime.now().isoformat()
+            }
+            return jsonify(finish_detection(result, session_id, None))
+
+        model_start = time.perf_counter()
+        # Extract only the features the model needs from the request
+        features = compute_features(computed_feature_names, web_logs=data.get('web_logs', []), **mouse_sources(data))
         
         # Create feature vector
         feature_vector = []
         for feature_name in feature_names:
             feature_vector.append(features.get(feature_name, 0))
         
-        # Make prediction
-        prediction = model.predict([feature_vector])[0]
+        if drift_monitor is not None:
+            drift_monitor.observe(feature_vector)
+        
+        # Make prediction; any class but human is a bot, so 3-class models and distilled students serve like the simple model
         probability = model.predict_proba([feature_vector])[0]
+        prediction, bot_probability = bot_verdict(model.classes_, probability)
+        predicted_index = int(probability.argmax())
         
         # Calculate feature importance for this specific prediction
         # Use SHAP-like approach or feature permutation importance
         feature_importances = {}
-        base_prob = model.predict_proba([feature_vector])[0][prediction]
+        base_prob = probability[predicted_index]
         
         for i, feature_name in enumerate(feature_names):
             # Create a modified feature vector with this feature set to 0
@@ -79,7 +189,7 @@ def detect_bot():
             modified_vector[i] = 0
             
             # Get prediction with modified feature
-            modified_prob = model.predict_proba([modified_vector])[0][prediction]
+            modified_prob = model.predict_proba([modified_vector])[0][predicted_index]
             
             # Importance is the difference in probability
             importance = abs(base_prob - modified_prob)
@@ -91,18 +201,63 @@ def detect_bot():
         result = {
             'prediction': int(prediction),
             'prediction_label': 'Bot' if prediction == 1 else 'Human',
-            'confidence': float(max(probability)),
-            'bot_probability': float(probability[1]),
-            'human_probability': float(probability[0]),
+            'confidence': bot_probability if prediction == 1 else 1 - bot_probability,
+            'bot_probability': bot_probability,
+            'human_probability': 1 - bot_probability,
             'top_features': [{'name': name, 'importance': float(importance)} for name, importance in top_features],
+            'decided_by': 'model',
             'timestamp': datetime.now().isoformat()
         }
-        
-        return jsonify(result)
+        cascade.record_model_cost(time.perf_counter() - model_start)
+
+        return jsonify(finish_detection(result, session_id, dict(zip(feature_names, feature_vector))))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/collect', methods=['POST'])
+def collect_events():
+    """Appends one collector chunk to its session. sendBeacon posts it as text/plain, so any type is read as JSON."""
+    try:
+        body = decompress_body(request.get_data(), request.headers.get('Content-Encoding'))
+        appended = event_collector.append(json.loads(body), len(body))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'appended': appended}), 202
+
+@app.route('/api/collect')
+def collect_stats():
+    session_id = request.args.get('session_id')
+    if session_id is None:
+        return jsonify(event_collector.stats())
+    stats = event_collector.session_stats(session_id)
+    if stats is None:
+        return jsonify({'error': 'No events collected for this session'}), 404
+    return jsonify({'session_id': session_id, **stats})
+
+@app.route('/api/drift')
+def drift_report():
+    if drift_monitor is None:
+        return jsonify({'enabled': False, 'reason': f"No drift reference for the served features at {DRIFT_REFERENCE_PATH}"})
+    return jsonify(drift_monitor.report())
+
+@app.route('/api/cascade')
+def cascade_stats():
+    return jsonify(cascade.report())
+
+@app.route('/api/verdict-log')
+def verdict_log_stats():
+    if verdict_log is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **verdict_log.stats()})
+
+@app.route('/api/session/<session_id>')
+def session_state(session_id):
+    state = session_store.get(session_id)
+    if state is None:
+        return jsonify({'error': 'Unknown or expired session'}), 404
+    return jsonify({'session_id': session_id, **state})
+
 @app.route('/api/model-info')
 def model_info():
     if model is None:
@@ -154,82 +309,6 @@ def sample_data():
         ]
     })
 
-def extract_mouse_features(mouse_data):
-    """Extract mouse movement features similar to client.py"""
-    features = {}
-    
-    total_behaviour = mouse_data.get('total_behaviour', [])
-    mousemove_times = mouse_data.get('mousemove_times', [])
-    mousemove_total_behaviour = mouse_data.get('mousemove_total_behaviour', [])
-
-    features['num_moves'] = total_behaviour.count('m')
-    features['num_left_clicks'] = total_behaviour.count('c(l)')
-    features['num_right_clicks'] = total_behaviour.count('c(r)')
-    features['num_middle_clicks'] = total_behaviour.count('c(m)')
-    features['total_actions'] = len(total_behaviour)
-
-    times_numeric = []
-    if mousemove_times:
-        times_numeric = [float(t.strip('()')) for t in mousemove_times if t.strip('()').replace('.', '', 1).isdigit()]
-
-    if len(times_numeric) > 1:
-        time_diffs = np.diff(times_numeric)
-        features['avg_time_between_moves'] = np.mean(time_diffs)
-        features['std_time_between_moves'] = np.std(time_diffs)
-        features['min_time_between_moves'] = np.min(time_diffs)
-        features['max_time_between_moves'] = np.max(time_diffs)
-        features['total_session_duration'] = times_numeric[-1] - times_numeric[0]
-    else:
-        features['avg_time_between_moves'] = 0
-        features['std_time_between_moves'] = 0
-        features['min_time_between_moves'] = 0
-        features['max_time_between_moves'] = 0
-        features['total_session_duration'] = 0
-
-    coords = []
-    if mousemove_total_behaviour:
-        for coord_str in mousemove_total_behaviour:
-            try:
-                x, y = map(int, coord_str.strip('()').split(','))
-                coords.append((x, y))
-            except ValueError:
-                continue
-
-    if len(coords) > 1:
-        x_coords = np.array([c[0] for c in coords])
-        y_coords = np.array([c[1] for c in coords])
-
-        x_diffs = np.diff(x_coords)
-        y_diffs = np.diff(y_coords)
-        distances = np.sqrt(x_diffs**2 + y_diffs**2)
-
-        features['total_distance'] = np.sum(distances)
-        features['avg_speed'] = features['total_distance'] / features['total_session_duration'] if features['total_session_duration'] > 0 else 0
-
-        features['min_x'] = np.min(x_coords)
-        features['max_x'] = np.max(x_coords)
-        features['min_y'] = np.min(y_coords)
-        features['max_y'] = np.max(y_coords)
-    else:
-        features['total_distance'] = 0
-        features['avg_speed'] = 0
-        features['min_x'], features['max_x'], features['min_y'], features['max_y'] = 0,0,0,0
-
-    return features
-
-def extract_web_log_features(web_logs_list):
-    """Extract web log features"""
-    features = {}
-    if not web_logs_list:
-        return {
-            'avg_bytes_sent': 0, 'avg_status_code': 0
-        }
-
-    features['avg_bytes_sent'] = np.mean([log['bytes_sent'] for log in web_logs_list])
-    features['avg_status_code'] = np.mean([log['status_code'] for log in web_logs_list])
-
-    return features
-
 if __name__ == '__main__':
     print("🚀 Starting Bot Detection API...")
     print("✅ Model loaded successfully")
@@ -0,0 +1,147 @@
+# bot-detector/cascade.py
+
+import os
+import time
+import threading
+from features import compute_features
+
+# Detection cascade: cheap rule and lookup stages look at a request before the model does, and return
+# a verdict early when they are confident. Only sessions no stage is sure about reach feature extraction,
+# inference and the explanation loop. Each stage is a function of the request context returning a bot
+# probability when it decides, or None to pass the session on. Stages run in CASCADE_STAGES order.
+
+# --- Configuration ---
+# Comma-separated stage names, or 'off' to send every request to the model
+CASCADE_STAGES = [name for name in os.environ.get(
+    'BOT_CASCADE', 'cached_verdict,known_bot_user_agent,http_1_0,empty_user_agent,missing_referer,no_mouse_events'
+).split(',') if name and name != 'off']
+
+MIN_REQUESTS_FOR_REFERER_RULE = 3 # Humans' first request has no referer either
+MIN_REQUESTS_FOR_MOUSE_RULE = 3   # Sessions this long with no mouse activity at all are scripted
+CACHED_VERDICT_MIN_PROBABILITY = 0.9 # A session already scored this bot-like keeps its verdict
+CACHED_VERDICT_MIN_REQUESTS = 3   # ...once it has been scored this many times
+RULE_BOT_PROBABILITY = 0.99       # Probability reported for rule hits
+
+KNOWN_BOT_USER_AGENT_TOKENS = frozenset([
+    'curl', 'wget', 'python-requests', 'python-urllib', 'scrapy', 'go-http-client', 'java', 'okhttp',
+    'headlesschrome', 'phantomjs', 'selenium', 'puppeteer', 'bot', 'crawler', 'spider'
+])
+
+STAGES = {} # name -> (kind, function)
+
+def stage(kind):
+    """Registers the decorated function as a cascade stage named after it ('rule' or 'lookup')."""
+    def register(fn):
+        STAGES[fn.__name__] = (kind, fn)
+        return fn
+    return register
+
+# --- Lookup stages ---
+
+@stage('lookup')
+def cached_verdict(context):
+    state = context.get('session_state')
+    if state and state.get('requests', 0) >= CACHED_VERDICT_MIN_REQUESTS and \
+            state.get('bot_probability', 0) >= CACHED_VERDICT_MIN_PROBABILITY:
+        return state['bot_probability']
+    return None
+
+@stage('lookup')
+def known_bot_user_agent(context):
+    for log in context['web_logs']:
+        tokens = (log.get('user_agent') or '').lower().replace('/', ' ').replace(';', ' ').replace('(', ' ').split()
+        if not KNOWN_BOT_USER_AGENT_TOKENS.isdisjoint(tokens):
+            return RULE_BOT_PROBABILITY
+    return None
+
+# --- Rule stages ---
+# Header rules only look at fields a log entry actually carries: a client posting partial entries without
+# user_agent or referer says nothing about those headers, while '-' is what the access log writes for an empty one.
+
+def header_is_empty(log, field):
+    return field in log and log[field] in ('-', '')
+
+@stage('rule')
+def http_1_0(context):
+    return RULE_BOT_PROBABILITY if any(log.get('http_version') == 'HTTP/1.0' for log in context['web_logs']) else None
+
+@stage('rule')
+def empty_user_agent(context):
+    return RULE_BOT_PROBABILITY if any(header_is_empty(log, 'user_agent') for log in context['web_logs']) else None
+
+@stage('rule')
+def missing_referer(context):
+    web_logs = context['web_logs']
+    if len(web_logs) >= MIN_REQUESTS_FOR_REFERER_RULE and all(header_is_empty(log, 'referer') for log in web_logs):
+        return RULE_BOT_PROBABILITY
+    return None
+
+@stage('rule')
+def no_mouse_events(context):
+    if len(context['web_logs']) < MIN_REQUESTS_FOR_MOUSE_RULE:
+        return None
+    if compute_features(['total_actions'], **context['mouse_sources'])['total_actions'] == 0:
+        return RULE_BOT_PROBABILITY
+    return None
+
+# --- Cascade ---
+
+class Cascade:
+    """Runs the configured stages and keeps per-stage hit and cost statistics."""
+
+    def __init__(self, stage_names=CASCADE_STAGES):
+        unknown = [name for name in stage_names if name not in STAGES]
+        if unknown:
+            raise ValueError(f"Unknown cascade stages: {unknown}")
+        self.stage_names = list(stage_names)
+        self._lock = threading.Lock()
+        self.stats = {name: {'evaluated': 0, 'hits': 0, 'seconds': 0.0} for name in self.stage_names}
+        self.model_requests = 0
+        self.model_seconds = 0.0
+
+    def decide(self, context):
+        """Returns (stage name, bot probability) of the first stage that decides, or None to use the model."""
+        for name in self.stage_names:
+            start = time.perf_counter()
+            bot_probability = STAGES[name][1](context)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage_stats = self.stats[name]
+                stage_stats['evaluated'] += 1
+                stage_stats['seconds'] += elapsed
+                if bot_probability is not None:
+                    stage_stats['hits'] += 1
+            if bot_probability is not None:
+                return name, bot_probability
+        return None
+
+    def record_model_cost(self, seconds):
+        """Records the time one request spent on the full model path (features, inference, explanation)."""
+        with self._lock:
+            self.model_requests += 1
+            self.model_seconds += seconds
+
+    def report(self):
+        """Per-stage hit rate, own cost and the model time its hits saved (at the average model-path cost)."""
+        with self._lock:
+            avg_model_ms = self.model_seconds / self.model_requests * 1000 if self.model_requests else None
+            total = self.stats[self.stage_names[0]]['evaluated'] if self.stage_names else self.model_requests
+            stages = []
+            for name in self.stage_names:
+                s = self.stats[name]
+                stages.append({
+                    'name': name,
+                    'kind': STAGES[name][0],
+                    'evaluated': s['evaluated'],
+                    'hits': s['hits'],
+                    'hit_rate': s['hits'] / s['evaluated'] if s['evaluated'] else 0.0,
+                    'avg_cost_ms': s['seconds'] / s['evaluated'] * 1000 if s['evaluated'] else 0.0,
+                    'saved_ms': s['hits'] * avg_model_ms if avg_model_ms is not None else None
+                })
+            return {
+                'requests': total,
+                'model_requests': self.model_requests,
+                'short_circuit_rate': 1 - self.model_requests / total if total else 0.0,
+                'avg_model_ms': avg_model_ms,
+                'stages': stages
+            }
@@ -9,19 +9,48 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, accuracy_score
 from tqdm import tqdm
 import pickle
+import hashlib
 from cryptography.fernet import Fernet # For symmetric encryption
 from xgboost import XGBClassifier
+from trajectory_store import Trajectory, open_trajectory_store
+from features import compute_features, summarize_web_logs, PHASE1_FEATURES, ALL_FEATURES
+from json_stream import iter_json_records
+from log_ingest import ingest_log_files, summarize_session_runs
+from tracing import span, set_context as set_trace_context
+from secure_agg import (SECURE_AGG_ENABLED, MASKED_UPDATE_SUFFIX, RECOVERY_SUFFIX, create_keypair, mask_update,
+                        save_masked_update, recovery_vector)
 # --- Configuration ---
 BASE_PARTITION_DIR = 'dataset/partition'
 PHASE = 'phase1'
+# Written by `scripts/fed_split.py --manifest`; when present, client data is read from the shared
+# dataset tree through it instead of from the physical copies under BASE_PARTITION_DIR.
+PARTITION_MANIFEST_PATH = 'dataset/partition_manifest.json'
+ANNOTATION_SUBFOLDERS = ['humans_and_advanced_bots', 'humans_and_moderate_bots']
+WEB_LOG_SUBFOLDERS = ['bots', 'humans']
+# Built by `python trajectory_store.py`; when present, mouse movements are read from it instead of per-session JSON
+TRAJECTORY_STORE_PATH = 'dataset/phase1_trajectories.bin'
+# Per-client web log ingestion checkpoints (see log_ingest.py); delete to force a full rescan
+LOG_INGEST_DIR = 'dataset/log_ingest'
+EMPTY_WEB_LOG_SUMMARY = summarize_web_logs([])
+SPLIT_TYPES = ['train', 'test'] # Annotation files per scenario folder
+LABEL_MAPPING = {'human': 0, 'moderate_bot': 1, 'advanced_bot': 2}
+# Modules whose code decides feature values; cached feature matrices (see feature_cache_key) are rebuilt when one changes
+FEATURE_CODE_MODULES = ['features.py', 'mouse_decoder.py', 'client.py', 'log_ingest.py', 'trajectory_store.py', 'json_stream.py']
 
 CLIENT_UPDATES_DIR = 'client_updates'
 
 # --- Encryption Key (IMPORTANT: In a real system, this key should be securely shared/managed) ---
 # You MUST replace this with the key generated by running scripts/key.py
 # Example: b'jR8oXfDmf9JOV2PzXzCL_0tPr8YzUwg-9Akem3CpuAc='
+# Not used in secure aggregation mode (FL_SECURE_AGG=1), where updates are masked instead (see secure_agg.py)
 ENCRYPTION_KEY = b'BxvBWlI4M2KYqy_q0ituuVCxq-sibLYhCyYFJlxYuRc=' # Placeholder, replace with your actual key
 
+# Threads for local training; scripts/run.py sets this to the client's share of the CPU budget (unset: all cores)
+CLIENT_N_JOBS_ENV = 'FL_CLIENT_N_JOBS'
+CLIENT_N_JOBS = int(os.environ.get(CLIENT_N_JOBS_ENV, 0)) or None
+# Comma-separated cores scripts/run.py pins the client to (FL_PIN_CLIENT_CORES=1); the client pins itself at startup
+CLIENT_CORES_ENV = 'FL_CLIENT_CORES'
+
 # --- Differential Privacy Configuration ---
 DP_NOISE_SCALE = 0.1 # Adjust this value: higher means more privacy, but less utility
 
@@ -41,237 +70,405 @@ def parse_web_log_entry(log_entry):
             'status_code': int(status),
             'bytes_sent': int(bytes_sent) if bytes_sent.isdigit() else 0,
             'referer': referer,
-            'user_agent': user_agent
+            'user_agent': user_agent,
+            'http_version': http_version
         }
     return None
 
-def extract_mouse_movement_features(mouse_data):
-    """Extracts features from the mouse movement JSON data (phase1 structure)."""
-    features = {}
-    total_behaviour = mouse_data.get('total_behaviour', [])
-    mousemove_times = mouse_data.get('mousemove_times', [])
-    mousemove_total_behaviour = mouse_data.get('mousemove_total_behaviour', [])
-
-    features['num_moves'] = total_behaviour.count('m')
-    features['num_left_clicks'] = total_behaviour.count('c(l)')
-    features['num_right_clicks'] = total_behaviour.count('c(r)')
-    features['num_middle_clicks'] = total_behaviour.count('c(m)')
-    features['total_actions'] = len(total_behaviour)
-
-    times_numeric = []
-    if mousemove_times:
-        times_numeric = [float(t.strip('()')) for t in mousemove_times if t.strip('()').replace('.', '', 1).isdigit()]
-
-    if len(times_numeric) > 1:
-        time_diffs = np.diff(times_numeric)
-        features['avg_time_between_moves'] = np.mean(time_diffs)
-        features['std_time_between_moves'] = np.std(time_diffs)
-        features['min_time_between_moves'] = np.min(time_diffs)
-        features['max_time_between_moves'] = np.max(time_diffs)
-        features['total_session_duration'] = times_numeric[-1] - times_numeric[0]
+def session_feature_sources(mouse_data, web_logs=None, web_log_summary=None):
+    """
+    Returns the compute_features() sources for a session; a packed-store Trajectory is passed as the decoded events.
+    The session's web logs are given either as parsed entries or as an already built web log summary.
+    """
+    sources = {'web_log_summary': web_log_summary} if web_log_summary is not None else {'web_logs': web_logs or []}
+    if isinstance(mouse_data, Trajectory):
+        # Store times are relative to the first move, which leaves every difference-based feature unchanged
+        sources['events'] = mouse_data
     else:
-        features['avg_time_between_moves'] = 0
-        features['std_time_between_moves'] = 0
-        features['min_time_between_moves'] = 0
-        features['max_time_between_moves'] = 0
-        features['total_session_duration'] = 0
-
-    coords = []
-    if mousemove_total_behaviour:
-        for coord_str in mousemove_total_behaviour:
-            try:
-                x, y = map(int, coord_str.strip('()').split(','))
-                coords.append((x, y))
-            except ValueError:
-                continue
+        sources['mouse_data'] = mouse_data
+    return sources
+
+# --- Client Data Sources ---
 
-    if len(coords) > 1:
-        x_coords = np.array([c[0] for c in coords])
-        y_coords = np.array([c[1] for c in coords])
+def load_partition_manifest():
+    """Returns the virtual partition manifest, or None when clients use physical partition folders."""
+    if not os.path.exists(PARTITION_MANIFEST_PATH):
+        return None
+    with open(PARTITION_MANIFEST_PATH, 'r') as f:
+        return json.load(f)
 
-        x_diffs = np.diff(x_coords)
-        y_diffs = np.diff(y_coords)
-        distances = np.sqrt(x_diffs**2 + y_diffs**2)
+def load_client_annotations(client_id, annotation_split_type, manifest=None):
+    """Returns the client's annotation DataFrames (one per scenario) for the given split."""
+    annotations_dfs = []
+    if manifest is not None:
+        client_manifest = manifest['clients'].get(client_id, {})
+        for current_subfolder in ANNOTATION_SUBFOLDERS:
+            rows = client_manifest.get('annotations', {}).get(current_subfolder, {}).get(annotation_split_type)
+            if rows:
+                annotations_dfs.append(pd.DataFrame(rows, columns=['session_id', 'label']))
+        return annotations_dfs
 
-        features['total_distance'] = np.sum(distances)
-        features['avg_speed'] = features['total_distance'] / features['total_session_duration'] if features['total_session_duration'] > 0 else 0
-        if len(time_diffs) > 0 and (distances / time_diffs).size > 0:
-            features['std_speed'] = np.std(distances / time_diffs)
+    client_base_path = os.path.join(BASE_PARTITION_DIR, client_id, PHASE)
+    for current_subfolder in ANNOTATION_SUBFOLDERS:
+        annotation_path = os.path.join(client_base_path, 'annotations', current_subfolder, annotation_split_type)
+        if os.path.exists(annotation_path):
+            annotations_dfs.append(pd.read_csv(annotation_path, sep=' ', header=None, names=['session_id', 'label']))
+    return annotations_dfs
+
+def iter_client_web_log_lines(client_id, manifest=None):
+    """Yields every raw web log line belonging to the client."""
+    if manifest is not None:
+        client_manifest = manifest['clients'].get(client_id, {})
+        web_log_root = os.path.join(manifest['base_path'], 'data', 'web_logs')
+        for relative_log_path, ranges in tqdm(client_manifest.get('web_logs', {}).items(), desc=f"[{client_id}] Reading Web Logs (manifest)"):
+            with open(os.path.join(web_log_root, relative_log_path), 'rb') as f:
+                for start, end in ranges:
+                    f.seek(start)
+                    for raw_line in f.read(end - start).splitlines():
+                        yield raw_line.decode('utf-8', errors='replace')
+        return
+
+    for log_path in tqdm(client_web_log_paths(client_id), desc=f"[{client_id}] Reading Web Logs"):
+        with open(log_path, 'r') as f:
+            for line in f:
+                yield line
+
+def client_web_log_paths(client_id):
+    """Returns the web log files in the client's partition folder, in the order they are read."""
+    log_paths = []
+    web_log_base_path = os.path.join(BASE_PARTITION_DIR, client_id, PHASE, 'data', 'web_logs')
+    for subfolder in WEB_LOG_SUBFOLDERS:
+        current_log_path = os.path.join(web_log_base_path, subfolder)
+        if os.path.exists(current_log_path):
+            log_paths.extend(os.path.join(current_log_path, f) for f in os.listdir(current_log_path) if f.endswith('.log'))
         else:
-            features['std_speed'] = 0
+            print(f"[{client_id}] Web logs directory not found: {current_log_path}")
+    return log_paths
 
-        features['straightness'] = np.sqrt((x_coords[-1] - x_coords[0])**2 + (y_coords[-1] - y_coords[0])**2) / features['total_distance'] if features['total_distance'] > 0 else 0
+def load_client_web_log_summaries(client_id, manifest=None):
+    """
+    Returns {session_id: web log summary} for every session in the client's web logs. Partition folder logs are
+    ingested incrementally, so only lines appended since the client's last run are parsed. Manifest byte ranges
+    are fixed slices of the shared logs and are summarized directly.
+    """
+    if manifest is not None:
+        parsed_logs = (parse_web_log_entry(line.strip()) for line in iter_client_web_log_lines(client_id, manifest))
+        return summarize_session_runs(parsed_log for parsed_log in parsed_logs if parsed_log)
+
+    checkpoint_path = os.path.join(LOG_INGEST_DIR, f"{client_id}_{PHASE}.pkl")
+    summaries, stats = ingest_log_files(client_web_log_paths(client_id), checkpoint_path, parse_web_log_entry)
+    rescanned = f", rescanned {len(stats['rescanned_files'])} rotated/truncated" if stats['rescanned_files'] else ""
+    print(f"[{client_id}] Ingested {stats['new_lines']} new web log lines from {stats['files']} files{rescanned}.")
+    return summaries
+
+def iter_client_mouse_movement_files(client_id, session_ids, manifest=None):
+    """Yields (mouse_movement_type, session_id, json_file_path) for the client's sessions in session_ids."""
+    if manifest is not None:
+        client_manifest = manifest['clients'].get(client_id, {})
+        mouse_movement_data_base_path = os.path.join(manifest['base_path'], 'data', 'mouse_movements')
+        for current_mm_type in ANNOTATION_SUBFOLDERS:
+            for session_id in client_manifest.get('mouse_movements', {}).get(current_mm_type, []):
+                if session_id in session_ids:
+                    yield current_mm_type, session_id, os.path.join(mouse_movement_data_base_path, current_mm_type, session_id, 'mouse_movements.json')
+        return
+
+    mouse_movement_data_base_path = os.path.join(BASE_PARTITION_DIR, client_id, PHASE, 'data', 'mouse_movements')
+    for current_mm_type in ANNOTATION_SUBFOLDERS:
+        mouse_movement_path = os.path.join(mouse_movement_data_base_path, current_mm_type)
+        if os.path.exists(mouse_movement_path):
+            session_folders = [d for d in os.listdir(mouse_movement_path) if os.path.isdir(os.path.join(mouse_movement_path, d))]
+            for session_folder in tqdm(session_folders, desc=f"[{client_id}] Reading {current_mm_type} Mouse Movements"):
+                if session_folder in session_ids:
+                    yield current_mm_type, session_folder, os.path.join(mouse_movement_path, session_folder, 'mouse_movements.json')
+        else:
+            print(f"[{client_id}] Mouse movements directory not found: {mouse_movement_path}")
 
-        features['min_x'] = np.min(x_coords)
-        features['max_x'] = np.max(x_coords)
-        features['min_y'] = np.min(y_coords)
-        features['max_y'] = np.max(y_coords)
-        features['std_x'] = np.std(x_coords)
-        features['std_y'] = np.std(y_coords)
+def iter_client_mouse_movements(client_id, session_ids, manifest=None):
+    """
+    Yields (session_id, mouse data) once for each of the client's sessions in session_ids that has mouse data,
+    one session at a time. Sessions are taken from the packed trajectory store when one has been built (as
+    zero-copy Trajectory views), otherwise from their JSON files.
+    """
+    trajectory_store = open_trajectory_store(TRAJECTORY_STORE_PATH)
+    if trajectory_store is not None:
+        num_read = 0
+        for session_id in session_ids:
+            trajectory = trajectory_store.get(session_id)
+            if trajectory is not None:
+                num_read += 1
+                yield session_id, trajectory
+        print(f"[{client_id}] Read {num_read} sessions from trajectory store {TRAJECTORY_STORE_PATH}")
+        return
+
+    # A session found under two scenario folders yields its last readable copy once, as the original per-session
+    # dict overwrite kept; only the file paths are collected up front
+    copies = {}
+    for current_mm_type, session_id, json_file_path in iter_client_mouse_movement_files(client_id, session_ids, manifest):
+        copies.setdefault(session_id, []).append((current_mm_type, json_file_path))
+    for session_id, session_copies in copies.items():
+        for current_mm_type, json_file_path in reversed(session_copies):
+            if not os.path.exists(json_file_path):
+                print(f"[{client_id}] Warning: mouse_movements.json not found for session {session_id} in {current_mm_type}")
+                continue
+            with open(json_file_path, 'r') as f:
+                try:
+                    mouse_data = json.load(f)
+                except json.JSONDecodeError:
+                    print(f"[{client_id}] Error decoding JSON for session {session_id} in {current_mm_type}")
+                    continue
+            yield session_id, mouse_data
+            break
+
+def iter_session_features(client_id, session_ids, feature_names, web_log_summaries, manifest=None):
+    """
+    Yields (session_id, feature dict) once for every session in session_ids. Each session's mouse data is turned into
+    its feature row as soon as it has been read and is dropped right after, so only one raw session is held at
+    a time. Sessions without mouse data follow at the end, featurized from their web logs alone.
+    """
+    def featurize(session_id, mouse_data):
+        return compute_features(feature_names, **session_feature_sources(
+            mouse_data, web_log_summary=web_log_summaries.get(session_id, EMPTY_WEB_LOG_SUMMARY)))
+
+    seen = set()
+    for session_id, mouse_data in iter_client_mouse_movements(client_id, session_ids, manifest):
+        seen.add(session_id)
+        yield session_id, featurize(session_id, mouse_data)
+    for session_id in session_ids:
+        if session_id not in seen:
+            yield session_id, featurize(session_id, {})
+
+# --- Feature Caches ---
+
+def path_state(path):
+    """Returns [(path, size, mtime)] for a file, or for every file under a directory; empty when it does not exist."""
+    if os.path.isfile(path):
+        file_paths = [path]
     else:
-        features['total_distance'] = 0
-        features['avg_speed'] = 0
-        features['std_speed'] = 0
-        features['straightness'] = 0
-        features['min_x'], features['max_x'], features['min_y'], features['max_y'], features['std_x'], features['std_y'] = 0,0,0,0,0,0
-
-    return features
-
-def extract_web_log_features(web_logs_list):
-    """Extracts features from a list of parsed web log entries for a session."""
-    features = {}
-    if not web_logs_list:
-        return {
-            'num_requests': 0, 'num_get': 0, 'num_post': 0,
-            'unique_paths': 0, 'avg_status_code': 0, 'avg_bytes_sent': 0,
-            'num_200_ok': 0, 'num_404_not_found': 0, 'num_redirects': 0,
-            'session_duration_web_logs': 0, 'user_agent_diversity': 0
-        }
+        file_paths = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    states = []
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        states.append((file_path, stat.st_size, stat.st_mtime_ns))
+    return states
+
+def feature_cache_key(feature_names, client_ids=(), data_paths=()):
+    """
+    Returns a digest of everything a cached feature matrix depends on: the feature list, the source of the
+    modules that compute features, the clients' data (the partition manifest and the tree it points into, or
+    their partition folders), the trajectory store and any other data_paths. Scripts store it with their
+    cache and re-extract features when it no longer matches.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(list(feature_names)).encode('utf-8'))
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in FEATURE_CODE_MODULES:
+        with open(os.path.join(code_dir, module), 'rb') as f:
+            digest.update(f.read())
+
+    paths = [TRAJECTORY_STORE_PATH] + list(data_paths)
+    if client_ids:
+        digest.update(repr(list(client_ids)).encode('utf-8'))
+        manifest = load_partition_manifest()
+        if manifest is not None:
+            paths += [PARTITION_MANIFEST_PATH, manifest['base_path']]
+        else:
+            paths += [os.path.join(BASE_PARTITION_DIR, client_id, PHASE) for client_id in client_ids]
+    for path in paths:
+        digest.update(repr((path, path_state(path))).encode('utf-8'))
+    return digest.hexdigest()
 
-    num_requests = len(web_logs_list)
-    features['num_requests'] = num_requests
-    features['num_get'] = sum(1 for log in web_logs_list if log['method'] == 'GET')
-    features['num_post'] = sum(1 for log in web_logs_list if log['method'] == 'POST')
-    features['unique_paths'] = len(set(log['path'] for log in web_logs_list))
-    features['avg_status_code'] = np.mean([log['status_code'] for log in web_logs_list])
-    features['avg_bytes_sent'] = np.mean([log['bytes_sent'] for log in web_logs_list])
-    features['num_200_ok'] = sum(1 for log in web_logs_list if log['status_code'] == 200)
-    features['num_404_not_found'] = sum(1 for log in web_logs_list if log['status_code'] == 404)
-    features['num_redirects'] = sum(1 for log in web_logs_list if log['status_code'] >= 300 and log['status_code'] < 400)
-
-    timestamps = []
-    for log in web_logs_list:
-        try:
-            timestamps.append(pd.to_datetime(log['timestamp_str'], format='%d/%b/%Y:%H:%M:%S %z'))
-        except ValueError:
-            pass
-
-    if len(timestamps) > 1:
-        features['session_duration_web_logs'] = (timestamps[-1] - timestamps[0]).total_seconds()
-    else:
-        features['session_duration_web_logs'] = 0
+# --- Client Logic ---
 
-    features['user_agent_diversity'] = len(set(log['user_agent'] for log in web_logs_list))
+def build_feature_matrix(features_list, labels_list):
+    """Turns per-session feature dicts (with 'session_id') and their labels into (X, y, feature names, label mapping)."""
+    client_data_df = pd.DataFrame(features_list)
+    client_data_df['label'] = labels_list
 
-    return features
+    label_mapping = dict(LABEL_MAPPING)
+    client_data_df['label_encoded'] = client_data_df['label'].map(label_mapping)
 
-# --- Client Logic ---
+    X = client_data_df.drop(columns=['session_id', 'label', 'label_encoded'])
+    y = client_data_df['label_encoded']
+
+    X = X.fillna(0)
+    for col in X.columns:
+        if X[col].dtype == 'object':
+            try:
+                X[col] = pd.to_numeric(X[col])
+            except ValueError:
+                X = X.drop(columns=[col])
+
+    return X, y, list(X.columns), label_mapping # Return label_mapping as well
+
+def load_partition_splits(client_id, split_types=SPLIT_TYPES, feature_names=PHASE1_FEATURES):
+    """
+    Loads and preprocesses a client's data for several annotation splits at once, returning
+    {split: (X, y, feature names, label mapping)}. The web logs and the mouse movements of every requested
+    split's sessions are read in a single pass, and a session annotated in more than one split is
+    featurized once. Split membership and labels are dict lookups keyed by session ID.
+    Mouse movements are streamed through feature extraction (see iter_session_features), so memory grows
+    with the number of sessions times features rather than with the raw data.
+    Data is read through the partition manifest when one exists, otherwise from the client's partition folder.
+    """
+    unknown = [split for split in split_types if split not in SPLIT_TYPES]
+    if unknown:
+        raise ValueError(f"annotation split types must be among {SPLIT_TYPES}, got {unknown}")
+
+    manifest = load_partition_manifest()
+    split_label = '+'.join(split_types)
+
+    with span('load', split=split_label):
+        # --- Step 1: Load Session IDs and labels from Annotation Files (these define the splits) ---
+        split_labels = {}
+        for split in split_types:
+            annotations_dfs = load_client_annotations(client_id, split, manifest)
+            if not annotations_dfs:
+                print(f"[{client_id}] No '{split}' annotation files found. Cannot load data.")
+                continue
+            annotations_df = pd.concat(annotations_dfs).drop_duplicates(subset=['session_id'])
+            split_labels[split] = dict(zip(annotations_df['session_id'], annotations_df['label']))
+            print(f"[{client_id}] Loaded {len(split_labels[split])} unique sessions from '{split}' annotations.")
+
+        session_ids_to_process = set().union(*split_labels.values())
+        # --- Step 2: Load per-session Web Log summaries (looked up by session ID below) ---
+        web_log_summaries = load_client_web_log_summaries(client_id, manifest) if session_ids_to_process else {}
+
+    with span('features', split=split_label):
+        # --- Step 3: Stream Mouse Movements through Feature Engineering, one session at a time ---
+        # Only feature rows are kept; a session under two scenario folders is featurized once, from its last copy
+        print(f"[{client_id}] Extracting features for {split_label} sessions...")
+        session_features = {}
+        for session_id, features in tqdm(iter_session_features(client_id, session_ids_to_process, feature_names, web_log_summaries, manifest),
+                                         total=len(session_ids_to_process), desc=f"[{client_id}] Extracting {split_label} Features"):
+            session_features[session_id] = features
+
+        # --- Step 4: Group the feature rows by split, in annotation order ---
+        splits = {}
+        for split in split_types:
+            if split not in split_labels:
+                splits[split] = (pd.DataFrame(), pd.Series(), [], {}) # Empty data and empty label_mapping
+                continue
+            features_list = [{'session_id': session_id, **session_features[session_id]} for session_id in split_labels[split]]
+            splits[split] = build_feature_matrix(features_list, list(split_labels[split].values()))
+
+    return splits
+
+def iter_partition_rows(client_id, annotation_split_type='train', feature_names=PHASE1_FEATURES):
+    """
+    Yields (session_id, feature dict, encoded label) for one split of a client's data, one session at a time in
+    the order its mouse movements are read. Nothing is accumulated beyond the web log summaries, so callers
+    writing rows to fixed-size batches hold one batch however large the client is. A session whose mouse data
+    is found twice is yielded once, from its last copy, as in load_partition_splits; a label outside
+    LABEL_MAPPING is yielded as None.
+    """
+    manifest = load_partition_manifest()
+    annotations_dfs = load_client_annotations(client_id, annotation_split_type, manifest)
+    if not annotations_dfs:
+        print(f"[{client_id}] No '{annotation_split_type}' annotation files found. Cannot load data.")
+        return
+    annotations_df = pd.concat(annotations_dfs).drop_duplicates(subset=['session_id'])
+    session_labels = dict(zip(annotations_df['session_id'], annotations_df['label']))
+    print(f"[{client_id}] Loaded {len(session_labels)} unique sessions from '{annotation_split_type}' annotations.")
+
+    web_log_summaries = load_client_web_log_summaries(client_id, manifest)
+    for session_id, features in iter_session_features(client_id, session_labels, feature_names, web_log_summaries, manifest):
+        yield session_id, features, LABEL_MAPPING.get(session_labels[session_id])
 
 def load_partition_data(client_id, annotation_split_type='train'):
     """
     Loads and preprocesses data for a single client, based on a specified annotation split type ('train' or 'test').
-    This function ensures that only raw data (web logs and mouse movements) corresponding to the
-    selected annotation_split_type's session IDs are loaded and processed.
+    Only raw data belonging to that split's sessions is processed; callers needing several splits of the same
+    client should use load_partition_splits() so the client's data is read once.
     """
-    if annotation_split_type not in ['train', 'test']:
-        raise ValueError("annotation_split_type must be 'train' or 'test'")
+    return load_partition_splits(client_id, [annotation_split_type])[annotation_split_type]
 
-    client_base_path = os.path.join(BASE_PARTITION_DIR, client_id, PHASE)
+def load_phase2_data_for_evaluation(phase_type='phase2', feature_names=ALL_FEATURES):
+    """
+    Loads and preprocesses the entire Phase 2 dataset for global evaluation.
+    This assumes Phase 2 data is directly under dataset/phase2/ (not client-partitioned).
+    It loads ALL annotations and corresponding raw data from Phase 2. Shared by the evaluation scripts, so
+    they featurize Phase 2 exactly like each other and like the client loaders.
+    Web logs are folded into per-session summaries line by line, and mouse movement files (a JSON array, or
+    NDJSON, of many sessions each) are streamed one session at a time, each annotated session featurized as soon
+    as it is read, so memory does not grow with the size of either.
+    """
+    base_path = os.path.join('dataset', phase_type)
 
-    # --- Step 1: Load Session IDs from Annotation Files (This defines the 'split') ---
-    annotations_dfs = []
-    annotation_subfolders = ['humans_and_advanced_bots', 'humans_and_moderate_bots']
+    all_annotations_dfs = [] # Initialize annotations_dfs
+
+    annotation_subfolders = ['humans_and_advanced_bots', 'humans_and_moderate_and_advanced_bots']
 
     for current_subfolder in annotation_subfolders:
-        annotation_path = os.path.join(client_base_path, 'annotations', current_subfolder, annotation_split_type)
+        annotation_path = os.path.join(base_path, 'annotations', current_subfolder, current_subfolder)
         if os.path.exists(annotation_path):
-            annotations_dfs.append(pd.read_csv(annotation_path, sep=' ', header=None, names=['session_id', 'label']))
+            all_annotations_dfs.append(pd.read_csv(annotation_path, sep=' ', header=None, names=['session_id', 'label']))
     
-    if not annotations_dfs:
-        print(f"[{client_id}] No '{annotation_split_type}' annotation files found. Cannot load data.")
-        return pd.DataFrame(), pd.Series(), [], {} # Return empty data and empty label_mapping
+    if not all_annotations_dfs:
+        print(f"No annotations found for {phase_type}. Cannot load data.")
+        return pd.DataFrame(), pd.Series(), [], {}
 
-    annotations_df_selected_split = pd.concat(annotations_dfs).drop_duplicates(subset=['session_id'])
-    # This list now contains ONLY the session IDs for the chosen 'train' or 'test' split.
-    session_ids_to_process = annotations_df_selected_split['session_id'].tolist()
+    annotations_df_all_phase2 = pd.concat(all_annotations_dfs).drop_duplicates(subset=['session_id'])
+    session_labels = dict(zip(annotations_df_all_phase2['session_id'], annotations_df_all_phase2['label']))
 
-    print(f"[{client_id}] Loaded {len(session_ids_to_process)} unique sessions from '{annotation_split_type}' annotations.")
+    print(f"Loaded {len(session_labels)} unique sessions from {phase_type} annotations.")
 
-    # --- Step 2: Load Web Logs (and filter by 'session_ids_to_process') ---
-    all_web_logs = {}
-    web_log_base_path = os.path.join(client_base_path, 'data', 'web_logs')
+    # Web log lines are folded into one summary per session as they are read (only the current run of a
+    # session's lines is buffered, see log_ingest.summarize_session_runs), before the mouse movement files are streamed
+    web_log_summaries = {}
+    web_log_base_path = os.path.join(base_path, 'data', 'web_logs')
     log_subfolders = ['bots', 'humans']
     for subfolder in log_subfolders:
         current_log_path = os.path.join(web_log_base_path, subfolder)
         if os.path.exists(current_log_path):
             log_files = [f for f in os.listdir(current_log_path) if f.endswith('.log')]
-            for log_file in tqdm(log_files, desc=f"[{client_id}] Reading {subfolder} Web Logs"):
+            for log_file in tqdm(log_files, desc=f"Reading {phase_type} {subfolder} Web Logs"):
                 file_path = os.path.join(current_log_path, log_file)
                 with open(file_path, 'r') as f:
-                    for line in f:
-                        parsed_log = parse_web_log_entry(line.strip())
-                        # This 'if' condition is the filter: only process logs for selected session IDs
-                        if parsed_log and parsed_log['session_id'] in session_ids_to_process:
-                            if parsed_log['session_id'] not in all_web_logs:
-                                all_web_logs[parsed_log['session_id']] = []
-                            all_web_logs[parsed_log['session_id']].append(parsed_log)
+                    parsed_logs = (parse_web_log_entry(line.strip()) for line in f)
+                    summarize_session_runs((parsed_log for parsed_log in parsed_logs
+                                            if parsed_log and parsed_log['session_id'] in session_labels), web_log_summaries)
         else:
-            print(f"[{client_id}] Web logs directory not found: {current_log_path}")
+            print(f"Web logs directory not found for {phase_type}: {current_log_path}")
 
-    # --- Step 3: Load Mouse Movements (and filter by 'session_ids_to_process') ---
-    all_mouse_movements = {}
-    mouse_movement_data_base_path = os.path.join(client_base_path, 'data', 'mouse_movements')
-    for current_mm_type in annotation_subfolders:
-        mouse_movement_path = os.path.join(mouse_movement_data_base_path, current_mm_type)
-        if os.path.exists(mouse_movement_path):
-            session_folders = [d for d in os.listdir(mouse_movement_path) if os.path.isdir(os.path.join(mouse_movement_path, d))]
-            for session_folder in tqdm(session_folders, desc=f"[{client_id}] Reading {current_mm_type} Mouse Movements"):
-                session_id = session_folder
-                # This 'if' condition is the filter: only process mouse movements for selected session IDs
-                if session_id in session_ids_to_process:
-                    json_file_path = os.path.join(mouse_movement_path, session_folder, 'mouse_movements.json')
-                    if os.path.exists(json_file_path):
-                        with open(json_file_path, 'r') as f:
-                            try:
-                                mouse_data = json.load(f)
-                                all_mouse_movements[session_id] = mouse_data
-                            except json.JSONDecodeError:
-                                print(f"[{client_id}] Error decoding JSON for session {session_id} in {current_mm_type}")
-                    else:
-                        print(f"[{client_id}] Warning: mouse_movements.json not found for session {session_id} in {current_mm_type}")
-        else:
-            print(f"[{client_id}] Mouse movements directory not found: {mouse_movement_path}")
-
-    # --- Step 4: Feature Engineering and Merging for the selected split data ---
     features_list = []
     labels_list = []
+    featurized = set()
 
-    print(f"[{client_id}] Extracting features for '{annotation_split_type}' sessions...")
-    for session_id in tqdm(list(session_ids_to_process), desc=f"[{client_id}] Extracting Features"):
-        mouse_feats = extract_mouse_movement_features(all_mouse_movements.get(session_id, {}))
-        web_log_feats = extract_web_log_features(all_web_logs.get(session_id, []))
-
-        label_row = annotations_df_selected_split[annotations_df_selected_split['session_id'] == session_id]
-        if label_row.empty:
-            continue
-
-        label = label_row['label'].iloc[0]
-
+    def add_session(session_id, mouse_data):
         combined_features = {'session_id': session_id}
-        combined_features.update(mouse_feats)
-        combined_features.update(web_log_feats)
-
+        combined_features.update(compute_features(feature_names, **session_feature_sources(
+            mouse_data, web_log_summary=web_log_summaries.get(session_id, EMPTY_WEB_LOG_SUMMARY))))
         features_list.append(combined_features)
-        labels_list.append(label)
-
-    client_data_df = pd.DataFrame(features_list)
-    client_data_df['label'] = labels_list
-
-    label_mapping = {'human': 0, 'moderate_bot': 1, 'advanced_bot': 2}
-    client_data_df['label_encoded'] = client_data_df['label'].map(label_mapping)
-
-    X = client_data_df.drop(columns=['session_id', 'label', 'label_encoded'])
-    y = client_data_df['label_encoded']
+        labels_list.append(session_labels[session_id])
+        featurized.add(session_id)
+
+    def is_pending(item):
+        # Only the first record of an annotated session is kept; repeats and unannotated sessions are dropped once decoded
+        return isinstance(item, dict) and item.get('session_id') in session_labels and item['session_id'] not in featurized
+
+    print(f"Extracting features for {phase_type} sessions...")
+    mouse_movement_data_base_path = os.path.join(base_path, 'data', 'mouse_movements')
+    mm_subfolders = ['bots', 'humans']
+    for subfolder in mm_subfolders:
+        current_mm_path = os.path.join(mouse_movement_data_base_path, subfolder)
+        if os.path.exists(current_mm_path):
+            json_files = [f for f in os.listdir(current_mm_path) if f.endswith(('.json', '.ndjson', '.jsonl'))]
+            for json_file in json_files:
+                file_path = os.path.join(current_mm_path, json_file)
+                try:
+                    for item in tqdm(iter_json_records(file_path, keep=is_pending), desc=f"Streaming {phase_type} {subfolder}/{json_file}"):
+                        add_session(item['session_id'], item)
+                except ValueError as e:
+                    print(f"Error decoding JSON for {file_path}, keeping the sessions read before it: {e}")
+        else:
+            print(f"Mouse movements directory not found for {phase_type}: {current_mm_path}")
 
-    X = X.fillna(0)
-    for col in X.columns:
-        if X[col].dtype == 'object':
-            try:
-                X[col] = pd.to_numeric(X[col])
-            except ValueError:
-                X = X.drop(columns=[col])
+    # Annotated sessions with no mouse movement record are featurized from their web logs alone
+    for session_id in session_labels:
+        if session_id not in featurized:
+            add_session(session_id, {})
 
-    return X, y, list(X.columns), label_mapping # Return label_mapping as well
+    return build_feature_matrix(features_list, labels_list)
 
 def apply_differential_privacy(data_array, noise_scale):
     """
@@ -310,16 +507,22 @@ def run_client_training(client_id, round_num, global_model_params=None):
                 X[feat] = 0
         X = X[expected_features]
         feature_names = expected_features
+    elif SECURE_AGG_ENABLED:
+        # Masked vectors are summed position by position, so every client must use the same layout
+        X = X.reindex(columns=PHASE1_FEATURES, fill_value=0)
+        feature_names = list(PHASE1_FEATURES)
 
     print(f"[{client_id}] Training local model...")
     # X_val here is a split of the local training data (which is from original 'train' annotations)
-    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=42) # Removed stratify=y
-
-    model = XGBClassifier(n_estimators=100, learning_rate=0.1, max_depth=5, use_label_encoder=False, eval_metric='mlogloss', random_state=42)
-    model.fit(X_train, y_train)
+    with span('split'):
+        X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=42) # Removed stratify=y
 
+    model = XGBClassifier(n_estimators=100, learning_rate=0.1, max_depth=5, use_label_encoder=False, eval_metric='mlogloss', random_state=42, n_jobs=CLIENT_N_JOBS)
+    with span('fit', num_samples=len(X_train)):
+        model.fit(X_train, y_train)
 
-    y_pred = model.predict(X_val)
+    with span('validate'):
+        y_pred = model.predict(X_val)
     print(f"[{client_id}] Local Model Performance (Round {round_num}):")
     print(f"Accuracy: {accuracy_score(y_val, y_pred):.4f}")
 
@@ -330,7 +533,8 @@ def run_client_training(client_id, round_num, global_model_params=None):
 
 
     original_importances = np.array(model.feature_importances_)
-    noisy_importances = apply_differential_privacy(original_importances, DP_NOISE_SCALE)
+    with span('dp_noise'):
+        noisy_importances = apply_differential_privacy(original_importances, DP_NOISE_SCALE)
     print(f"[{client_id}] Applied differential privacy (noise scale: {DP_NOISE_SCALE}).")
 
     model_update_payload = {
@@ -340,25 +544,54 @@ def run_client_training(client_id, round_num, global_model_params=None):
         'feature_names': feature_names
     }
 
-    encrypted_update = encrypt_data(model_update_payload, ENCRYPTION_KEY)
+    os.makedirs(CLIENT_UPDATES_DIR, exist_ok=True)
+    if SECURE_AGG_ENABLED:
+        with span('mask'):
+            masked_update = mask_update(client_id, round_num, noisy_importances, len(X_train))
+        update_filename = os.path.join(CLIENT_UPDATES_DIR, f"client_update_{client_id}_round_{round_num}{MASKED_UPDATE_SUFFIX}")
+        with span('write'):
+            save_masked_update(update_filename, masked_update, feature_names)
+        print(f"[{client_id}] Masked model update saved to {update_filename}")
+        return model_update_payload
+
+    with span('encrypt'):
+        encrypted_update = encrypt_data(model_update_payload, ENCRYPTION_KEY)
     print(f"[{client_id}] Encrypted model update.")
 
-    os.makedirs(CLIENT_UPDATES_DIR, exist_ok=True)
     update_filename = os.path.join(CLIENT_UPDATES_DIR, f"client_update_{client_id}_round_{round_num}.enc")
-    with open(update_filename, 'wb') as f:
+    with span('write'), open(update_filename, 'wb') as f:
         f.write(encrypted_update)
     print(f"[{client_id}] Encrypted model update saved to {update_filename}")
 
     return model_update_payload
 
+def write_recovery_update(client_id, round_num, dropped_ids):
+    """Secure aggregation dropout recovery: reveals this client's masks with the dropped clients for the round."""
+    masked_path = os.path.join(CLIENT_UPDATES_DIR, f"client_update_{client_id}_round_{round_num}{MASKED_UPDATE_SUFFIX}")
+    with np.load(masked_path) as masked:
+        length = len(masked['masked'])
+    recovery_path = os.path.join(CLIENT_UPDATES_DIR, f"client_update_{client_id}_round_{round_num}{RECOVERY_SUFFIX}")
+    np.save(recovery_path, recovery_vector(client_id, round_num, dropped_ids, length))
+    print(f"[{client_id}] Recovery masks for dropped clients {dropped_ids} saved to {recovery_path}")
+
 if __name__ == "__main__":
     import sys
+    if os.environ.get(CLIENT_CORES_ENV) and hasattr(os, 'sched_setaffinity'):
+        # Before any training thread pool starts, so every thread inherits the mask
+        os.sched_setaffinity(0, [int(core) for core in os.environ[CLIENT_CORES_ENV].split(',')])
     if len(sys.argv) < 2:
-        print("Usage: python client.py <client_id> [round_num]")
+        print("Usage: python client.py <client_id> [round_num] | <client_id> --setup-keys | <client_id> <round_num> --recover <id,id,...>")
         sys.exit(1)
 
     client_id = sys.argv[1]
+    if '--setup-keys' in sys.argv:
+        print(f"[{client_id}] Secure aggregation key pair ready at {create_keypair(client_id)}")
+        sys.exit(0)
     round_num = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    set_trace_context(client_id, round_num)
+    if '--recover' in sys.argv:
+        write_recovery_update(client_id, round_num, sys.argv[sys.argv.index('--recover') + 1].split(','))
+        sys.exit(0)
 
     global_params_path = os.path.join('global_models', f"global_model_params_round_{round_num-1}.pkl") if round_num > 1 else None
     global_params = None
@@ -0,0 +1,184 @@
+# bot-detector/drift_monitor.py
+
+import os
+import json
+import threading
+import numpy as np
+
+# Feature drift monitoring for the serving path. train_final_model.py summarizes every training feature as an
+# equi-depth histogram: NUM_BINS - 1 bin edges at the training quantiles and the share of training rows in each
+# bin. The app bins every feature vector it scores against those same edges and only keeps the bin counts, so
+# memory is one small integer matrix however much traffic is scored, and an update is one vectorized compare.
+# Drift per feature is the population stability index (PSI) and the largest gap between the binned CDFs.
+#
+# Live counts are kept for two consecutive windows of WINDOW_REQUESTS requests; scores are computed over the
+# current and the previous window, so they follow recent traffic instead of everything since startup.
+# Each worker process monitors the requests it serves.
+
+# --- Configuration ---
+DRIFT_REFERENCE_PATH = os.environ.get('BOT_DRIFT_REFERENCE', 'model/drift_reference.json')
+REFERENCE_VERSION = 1
+NUM_BINS = 20                  # Equi-depth bins per feature (fewer when a feature has few distinct values)
+REFERENCE_SAMPLE_ROWS = 200000 # Training rows sampled to place the bin edges; every row is counted
+WINDOW_REQUESTS = 10000        # Requests per live window
+MIN_REQUESTS = 200             # Scores are reported as insufficient below this many requests
+PSI_EPSILON = 1e-4             # Smoothing for empty bins
+PSI_MODERATE = 0.1             # Conventional PSI thresholds: below 0.1 stable, above 0.25 significant drift
+PSI_SIGNIFICANT = 0.25
+
+FLOAT_MAX = np.finfo(np.float64).max
+
+def sanitize(X):
+    """Maps NaN to 0 (as the training loaders' fillna(0) does) and infinities to the largest finite floats."""
+    return np.nan_to_num(np.asarray(X, dtype=np.float64), nan=0.0)
+
+# --- Reference ---
+
+def padded_edges(edges_per_feature):
+    """Stacks per-feature edge lists into one matrix as wide as the longest, padding with +inf."""
+    width = max([len(edges) for edges in edges_per_feature] + [1])
+    matrix = np.full((len(edges_per_feature), width), np.inf)
+    for i, edges in enumerate(edges_per_feature):
+        matrix[i, :len(edges)] = edges
+    return matrix
+
+def bin_counts(X, edges):
+    """Counts the rows of X (rows x features) per bin of each feature; returns (features, bins) int64."""
+    counts = np.zeros((edges.shape[0], edges.shape[1] + 1), dtype=np.int64)
+    for i in range(edges.shape[0]):
+        bins = np.searchsorted(edges[i], X[:, i], side='right')
+        counts[i] += np.bincount(bins, minlength=counts.shape[1])
+    return counts
+
+def build_drift_reference(batches, feature_names, num_bins=NUM_BINS, sample_rows=REFERENCE_SAMPLE_ROWS):
+    """
+    Builds the reference histograms from training feature batches (2-D arrays, columns in feature_names order;
+    memory-mapped batches are fine). Edges come from an evenly spaced row sample, counts from every row.
+    """
+    num_rows = sum(len(batch) for batch in batches)
+    if num_rows == 0:
+        raise ValueError("No training rows to build a drift reference from")
+    step = max(1, -(-num_rows // sample_rows))
+    sample = sanitize(np.concatenate([np.asarray(batch[::step]) for batch in batches]))
+    quantiles = np.quantile(sample, np.linspace(0, 1, num_bins + 1)[1:-1], axis=0)
+    edges_per_feature = [np.unique(quantiles[:, i]) for i in range(len(feature_names))]
+
+    edges = padded_edges(edges_per_feature)
+    counts = np.zeros((len(feature_names), edges.shape[1] + 1), dtype=np.int64)
+    for batch in batches:
+        counts += bin_counts(sanitize(batch), edges)
+    return {
+        'version': REFERENCE_VERSION,
+        'num_rows': num_rows,
+        'features': {
+            name: {'edges': edges_per_feature[i].tolist(),
+                   'proportions': (counts[i, :len(edges_per_feature[i]) + 1] / num_rows).tolist()}
+            for i, name in enumerate(feature_names)
+        }
+    }
+
+def save_drift_reference(reference, path=DRIFT_REFERENCE_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(reference, f)
+
+def load_drift_reference(path=DRIFT_REFERENCE_PATH):
+    """Returns the saved reference, or None if there is none (or it was written by another version)."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        reference = json.load(f)
+    return reference if reference.get('version') == REFERENCE_VERSION else None
+
+# --- Scores ---
+
+def drift_scores(live_counts, reference_proportions):
+    """Per-feature (PSI, binned KS distance) between live bin counts and reference proportions (features x bins)."""
+    live = live_counts / np.maximum(live_counts.sum(axis=1, keepdims=True), 1)
+    p = np.maximum(live, PSI_EPSILON)
+    q = np.maximum(reference_proportions, PSI_EPSILON)
+    psi = np.sum((p - q) * np.log(p / q), axis=1)
+    ks = np.max(np.abs(np.cumsum(live, axis=1) - np.cumsum(reference_proportions, axis=1)), axis=1)
+    return psi, ks
+
+def drift_status(psi):
+    if psi >= PSI_SIGNIFICANT:
+        return 'significant'
+    return 'moderate' if psi >= PSI_MODERATE else 'stable'
+
+# --- Live Monitor ---
+
+class DriftMonitor:
+    """Bins each scored feature vector against the reference edges and reports per-feature drift."""
+
+    def __init__(self, reference, feature_names, window_requests=WINDOW_REQUESTS):
+        # Only the served features the reference knows are monitored, picked out of each vector by position
+        monitored = [(i, name) for i, name in enumerate(feature_names) if name in reference['features']]
+        if not monitored:
+            raise ValueError("None of the served features are in the drift reference")
+        self.index = np.array([i for i, _ in monitored])
+        self.feature_names = [name for _, name in monitored]
+        self.unmonitored = [name for name in feature_names if name not in reference['features']]
+        self.edges = padded_edges([reference['features'][name]['edges'] for name in self.feature_names])
+        self.reference_proportions = np.zeros((len(self.feature_names), self.edges.shape[1] + 1))
+        for i, name in enumerate(self.feature_names):
+            proportions = reference['features'][name]['proportions']
+            self.reference_proportions[i, :len(proportions)] = proportions
+        self.reference_rows = reference['num_rows']
+        self.window_requests = window_requests
+
+        self._offsets = np.arange(len(self.feature_names)) * self.reference_proportions.shape[1] # Row starts in the flat counts
+        self._current = np.zeros(self.reference_proportions.shape, dtype=np.int64)
+        self._previous = np.zeros_like(self._current)
+        self._current_requests = 0
+        self._previous_requests = 0
+        self.total_requests = 0
+        self._lock = threading.Lock()
+
+    def observe(self, feature_vector):
+        """Adds one scored feature vector (in the served feature_names order) to the current window."""
+        # Same mapping as sanitize(), without np.nan_to_num's per-call overhead
+        x = np.asarray(feature_vector, dtype=np.float64)[self.index]
+        x[x != x] = 0.0
+        np.minimum(x, FLOAT_MAX, out=x)
+        flat_bins = self._offsets + (self.edges <= x[:, None]).sum(axis=1)
+        with self._lock:
+            if self._current_requests >= self.window_requests:
+                self._previous, self._current = self._current, self._previous
+                self._current[:] = 0
+                self._previous_requests, self._current_requests = self._current_requests, 0
+            self._current.ravel()[flat_bins] += 1
+            self._current_requests += 1
+            self.total_requests += 1
+
+    def report(self):
+        with self._lock:
+            counts = self._current + self._previous
+            window = self._current_requests + self._previous_requests
+            total = self.total_requests
+        report = {'enabled': True, 'requests_scored': total, 'window_requests': window,
+                  'reference_rows': self.reference_rows, 'unmonitored_features': self.unmonitored}
+        if window < MIN_REQUESTS:
+            return {**report, 'status': 'insufficient_data', 'min_requests': MIN_REQUESTS, 'features': []}
+
+        psi, ks = drift_scores(counts, self.reference_proportions)
+        features = sorted(({'name': name, 'psi': float(psi[i]), 'ks': float(ks[i]), 'status': drift_status(psi[i])}
+                           for i, name in enumerate(self.feature_names)), key=lambda row: row['psi'], reverse=True)
+        return {**report, 'status': drift_status(float(psi.max())), 'max_psi': float(psi.max()),
+                'drifted_features': [row['name'] for row in features if row['status'] != 'stable'], 'features': features}
+
+_drift_monitor = None
+
+def open_drift_monitor(feature_names):
+    """Returns this process's DriftMonitor for the served features, or None when no reference has been built."""
+    global _drift_monitor
+    if _drift_monitor is None:
+        reference = load_drift_reference()
+        if reference is None:
+            return None
+        try:
+            _drift_monitor = DriftMonitor(reference, feature_names)
+        except ValueError as e:
+            print(f"⚠️ Drift monitoring disabled: {e}")
+            return None
+    return _drift_monitor
@@ -0,0 +1,289 @@
+# bot-detector/event_collector.py
+
+import os
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+try:
+    import fcntl
+except ImportError: # Windows: spool files are only locked against this process's threads (see open_event_collector)
+    fcntl = None
+from mouse_decoder import MouseEvents, EVENT_OTHER
+
+# Server side of static/collector.js. The page streams its mouse activity in small chunks instead of
+# posting the whole session at once; each chunk is appended to its session's spool file, and /api/detect
+# reads the spool when a request names the session but carries no mouse data of its own.
+#
+# A chunk is one JSON object:
+#   {"s": session id, "q": sequence number, "k": [event kind, ...], "m": [dx, dy, dt, dx, dy, dt, ...]}
+# with one kind per event (mouse_decoder.EVENT_*) and one (dx, dy, dt) triple per move. Deltas are taken
+# from the previous move in the same chunk, the first one from 0, so a lost chunk never shifts the others.
+# Times are milliseconds since the page's session started and are kept in milliseconds, the unit of the
+# mousemove_times in the raw session files the model is trained on. Chunks arriving twice (a beacon racing the
+# interval flush) or late are dropped by sequence number.
+#
+# The spool is a directory shared by every API worker process on the host (in /dev/shm by default, like the
+# session store), so a session's chunks may be posted to any worker and /api/detect on any other sees all of
+# them. Each session has one file, named by a digest of its id: a header (last sequence number and counters)
+# followed by one record per chunk. Appends hold an exclusive flock on the file and reads a shared one; every
+# call opens its own descriptor, so the lock also orders threads of the same process. Files are accessed with
+# seek/read/write rather than pread/pwrite, which Windows lacks; there fcntl is missing too, so the files are
+# only locked against this process's threads and the app must run a single worker.
+
+# --- Configuration ---
+EVENT_SPOOL_DIR = os.environ.get('BOT_EVENT_SPOOL', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'bot_detector_events'))
+MAX_SESSIONS = 10000            # Least recently active sessions are evicted beyond this, once per SWEEP_INTERVAL
+MAX_SPOOL_BYTES = 256 * 2**20   # ...and beyond this many bytes of spool files in total
+SESSION_IDLE_TIMEOUT = 1800.0   # Sessions not appended to for this many seconds are expired by the sweep
+MAX_EVENTS_PER_SESSION = 20000  # Oldest chunks are dropped once a session holds more events than this
+MAX_EVENTS_PER_CHUNK = 5000     # Larger chunks are rejected outright
+MAX_SESSION_ID_LENGTH = 128
+SWEEP_INTERVAL = 10.0           # Seconds between one worker's eviction sweeps of the spool directory
+
+SPOOL_MAGIC = b'BOTEVTS1'
+SPOOL_SUFFIX = '.events'
+FILE_HEADER = struct.Struct('<8sqQQQ')   # magic, last sequence number, chunks appended, events held, bytes received
+CHUNK_HEADER = struct.Struct('<QII')     # sequence number, number of kinds, number of moves
+MOVE_BYTES = 3 * 8                       # x, y, t as int64
+
+EMPTY_INTS = np.array([], dtype=np.int64)
+OPEN_BINARY = getattr(os, 'O_BINARY', 0) # Windows would otherwise translate newlines in the spool files
+
+def read_at(fd, size, offset):
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+def write_at(fd, data, offset):
+    os.lseek(fd, offset, os.SEEK_SET)
+    os.write(fd, data)
+
+def decode_chunk(chunk):
+    """Validates a chunk and returns (session id, sequence number, kinds, x, y, t in milliseconds)."""
+    if not isinstance(chunk, dict):
+        raise ValueError("Chunk must be a JSON object")
+    session_id = chunk.get('s')
+    if not isinstance(session_id, str) or not 0 < len(session_id) <= MAX_SESSION_ID_LENGTH:
+        raise ValueError("Chunk needs a session id 's'")
+    sequence = chunk.get('q')
+    if not isinstance(sequence, int) or not 0 <= sequence < 2**63:
+        raise ValueError("Chunk needs a non-negative sequence number 'q'")
+
+    try:
+        kinds = np.asarray(chunk.get('k', []), dtype=np.int64)
+        moves = np.asarray(chunk.get('m', []), dtype=np.int64)
+    except (OverflowError, TypeError) as e:
+        # Integers beyond int64, or values that are not numbers, are a malformed chunk like any other
+        raise ValueError(f"Chunk 'k' and 'm' must hold integers: {e}")
+    if kinds.ndim != 1 or moves.ndim != 1 or len(moves) % 3:
+        raise ValueError("Chunk 'k' must be a flat list of kinds and 'm' a flat list of (dx, dy, dt) triples")
+    if len(kinds) > MAX_EVENTS_PER_CHUNK or len(moves) > 3 * MAX_EVENTS_PER_CHUNK:
+        raise ValueError(f"Chunk holds more than {MAX_EVENTS_PER_CHUNK} events")
+    if len(kinds) and (kinds.min() < 0 or kinds.max() > EVENT_OTHER):
+        raise ValueError("Unknown event kind in chunk")
+
+    x, y, t = np.cumsum(moves.reshape(-1, 3), axis=0).T if len(moves) else (EMPTY_INTS,) * 3
+    return session_id, sequence, kinds.astype(np.int8), x, y, t
+
+def encode_record(sequence, kinds, x, y, t):
+    moves = np.column_stack([x, y, t]).astype(np.int64) if len(x) else np.empty((0, 3), dtype=np.int64)
+    return CHUNK_HEADER.pack(sequence, len(kinds), len(moves)) + kinds.tobytes() + moves.tobytes()
+
+def read_records(data):
+    """
+    Splits a spool file into (offset, kinds, moves) per chunk, with moves an (n, 3) array of x, y, t.
+    A record cut short by a crash mid-append ends the list.
+    """
+    records = []
+    offset = FILE_HEADER.size
+    while offset + CHUNK_HEADER.size <= len(data):
+        _, num_kinds, num_moves = CHUNK_HEADER.unpack_from(data, offset)
+        kinds_at = offset + CHUNK_HEADER.size
+        moves_at = kinds_at + num_kinds
+        end = moves_at + num_moves * MOVE_BYTES
+        if end > len(data):
+            break
+        records.append((offset,
+                        np.frombuffer(data, dtype=np.int8, count=num_kinds, offset=kinds_at),
+                        np.frombuffer(data, dtype=np.int64, count=3 * num_moves, offset=moves_at).reshape(-1, 3)))
+        offset = end
+    return records
+
+class EventCollector:
+    """
+    Per-session spools of streamed mouse events, shared across worker processes and bounded in sessions,
+    events, total bytes and idle time.
+    """
+
+    def __init__(self, spool_dir=EVENT_SPOOL_DIR, max_sessions=MAX_SESSIONS, max_events=MAX_EVENTS_PER_SESSION,
+                 max_bytes=MAX_SPOOL_BYTES, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.spool_dir = spool_dir
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.max_events = max_events
+        os.makedirs(spool_dir, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock() # Only used without fcntl
+        self._last_sweep = 0.0
+        # Counters of this worker's requests; the sessions themselves are shared
+        self.metrics = {'chunks': 0, 'duplicate_chunks': 0, 'events': 0, 'bytes': 0, 'evicted_sessions': 0, 'expired_sessions': 0}
+
+    def _path(self, session_id):
+        # Session ids come from the page, so they are never used as file names directly
+        digest = hashlib.blake2b(session_id.encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.spool_dir, digest + SPOOL_SUFFIX)
+
+    @contextmanager
+    def _locked(self, fd, exclusive):
+        if fcntl is None:
+            with self._spool_lock:
+                yield
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) # Released when fd is closed
+            yield
+
+    def _count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self.metrics[name] += amount
+
+    @staticmethod
+    def _read_header(fd):
+        """Returns (last sequence, chunks appended, events held, bytes received), or None for a new file."""
+        header = read_at(fd, FILE_HEADER.size, 0)
+        if len(header) < FILE_HEADER.size:
+            return None
+        magic, *fields = FILE_HEADER.unpack(header)
+        if magic != SPOOL_MAGIC:
+            raise ValueError("Event spool file is corrupt")
+        return tuple(fields)
+
+    def _trim(self, fd, num_events):
+        """Drops the session's oldest chunks until it holds at most max_events, always keeping the newest one."""
+        data = read_at(fd, os.fstat(fd).st_size, 0)
+        records = read_records(data)
+        drop = 0
+        while num_events > self.max_events and drop < len(records) - 1:
+            num_events -= len(records[drop][1])
+            drop += 1
+        if drop:
+            body = data[records[drop][0]:]
+            write_at(fd, body, FILE_HEADER.size)
+            os.ftruncate(fd, FILE_HEADER.size + len(body))
+        return num_events
+
+    def _sweep(self):
+        """
+        Expires sessions idle for longer than idle_timeout, then evicts the sessions appended to least recently
+        until at most max_sessions remain holding at most max_bytes, at most once per SWEEP_INTERVAL.
+        Idleness is judged by the spool file's mtime, so it is shared by every worker.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sweep < SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        sessions = []
+        with os.scandir(self.spool_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(SPOOL_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue # Evicted by another worker's sweep
+                    sessions.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        sessions.sort()
+        idle_before = time.time_ns() - int(self.idle_timeout * 1e9)
+        total_bytes = sum(size for _, size, _ in sessions)
+        expired = evicted = 0
+        for index, (mtime_ns, size, path) in enumerate(sessions):
+            idle = mtime_ns < idle_before
+            if not idle and len(sessions) - index <= self.max_sessions and total_bytes <= self.max_bytes:
+                break # Sessions are sorted oldest first, so every later one is within the limits too
+            try:
+                os.unlink(path)
+            except OSError:
+                continue # Already evicted, or (on Windows) open in another request
+            total_bytes -= size
+            if idle:
+                expired += 1
+            else:
+                evicted += 1
+        self._count(expired_sessions=expired, evicted_sessions=evicted)
+
+    def append(self, chunk, num_bytes=0):
+        """Appends a decoded chunk to its session's spool; returns False if it was a duplicate or late."""
+        session_id, sequence, kinds, x, y, t = decode_chunk(chunk)
+        record = encode_record(sequence, kinds, x, y, t)
+        fd = os.open(self._path(session_id), os.O_RDWR | os.O_CREAT | OPEN_BINARY, 0o600)
+        try:
+            with self._locked(fd, exclusive=True):
+                header = self._read_header(fd)
+                last_sequence, num_chunks, num_events, received = header if header is not None else (-1, 0, 0, 0)
+                if sequence <= last_sequence:
+                    self._count(duplicate_chunks=1)
+                    return False
+
+                write_at(fd, record, max(os.fstat(fd).st_size, FILE_HEADER.size))
+                num_events += len(kinds)
+                if num_events > self.max_events:
+                    num_events = self._trim(fd, num_events)
+                # The header goes last, so a crash mid-append leaves the previous sequence number in place
+                write_at(fd, FILE_HEADER.pack(SPOOL_MAGIC, sequence, num_chunks + 1, num_events, received + num_bytes), 0)
+        finally:
+            os.close(fd)
+        self._count(chunks=1, events=len(kinds), bytes=num_bytes)
+        self._sweep()
+        return True
+
+    def _read(self, session_id, header_only=False):
+        try:
+            fd = os.open(self._path(session_id), os.O_RDONLY | OPEN_BINARY)
+        except FileNotFoundError:
+            return None, b''
+        try:
+            with self._locked(fd, exclusive=False):
+                header = self._read_header(fd)
+                data = b'' if header_only or header is None else read_at(fd, os.fstat(fd).st_size, 0)
+        finally:
+            os.close(fd)
+        return header, data
+
+    def events(self, session_id):
+        """The session's spooled events as one MouseEvents, or None if nothing was collected for it."""
+        header, data = self._read(session_id)
+        records = read_records(data) if header is not None else []
+        if not records:
+            return None
+        _, kinds, moves = zip(*records)
+        x, y, t = np.concatenate(moves).T
+        return MouseEvents(event_kind=np.concatenate(kinds), x=x, y=y, t=t)
+
+    def session_stats(self, session_id):
+        header, _ = self._read(session_id, header_only=True)
+        if header is None:
+            return None
+        last_sequence, num_chunks, num_events, received = header
+        return {'chunks': num_chunks, 'events': num_events, 'bytes': received, 'last_sequence': last_sequence}
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+        sessions = sum(1 for name in os.listdir(self.spool_dir) if name.endswith(SPOOL_SUFFIX))
+        return {**metrics, 'sessions': sessions, 'spool_dir': self.spool_dir}
+
+_event_collector = None
+
+def open_event_collector():
+    """Returns this process's EventCollector over the shared spool directory, created on first use."""
+    global _event_collector
+    if _event_collector is None:
+        if fcntl is None:
+            print("⚠️ fcntl is unavailable: collected events are only locked per process, run a single API worker.")
+        _event_collector = EventCollector()
+    return _event_collector
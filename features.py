@@ -0,0 +1,275 @@
+# bot-detector/features.py
+
+import numpy as np
+import pandas as pd
+from mouse_decoder import (decode_mouse_events, EVENT_MOVE, EVENT_LEFT_CLICK, EVENT_RIGHT_CLICK,
+                           EVENT_MIDDLE_CLICK, EVENT_OTHER)
+
+# Shared feature registry used for training (client.py), evaluation (scripts/) and serving (app.py).
+# Every feature and intermediate declares the inputs it is computed from. compute_features() resolves
+# only what the requested features need, computing each intermediate (decoded events, time diffs,
+# distances, status codes, parsed timestamps) once per session and skipping everything else.
+
+# --- Configuration ---
+WEB_LOG_TIMESTAMP_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+# Raw inputs a session is described by, and their value when a caller does not supply them
+SOURCE_DEFAULTS = {
+    'mouse_data': {},  # mouse_movements.json document (any format mouse_decoder accepts)
+    'web_logs': [],    # parsed web log entries (see client.parse_web_log_entry)
+}
+
+INTERMEDIATES = {} # name -> (input names, function)
+FEATURES = {}      # name -> (input names, function)
+
+def intermediate(*inputs):
+    """Registers the decorated function as an intermediate named after it."""
+    def register(fn):
+        INTERMEDIATES[fn.__name__] = (inputs, fn)
+        return fn
+    return register
+
+def register_feature(name, inputs, fn):
+    FEATURES[name] = (tuple(inputs), fn)
+
+# --- Mouse movement intermediates ---
+
+@intermediate('mouse_data')
+def events(mouse_data):
+    # Callers holding a Trajectory from the packed store pass it directly as 'events'
+    return decode_mouse_events(mouse_data)
+
+@intermediate('events')
+def kind_counts(events):
+    return np.bincount(events.event_kind, minlength=EVENT_OTHER + 1)
+
+@intermediate('events')
+def times(events):
+    return events.t.astype(np.float64)
+
+@intermediate('times')
+def time_diffs(times):
+    return np.diff(times) if len(times) > 1 else np.array([])
+
+@intermediate('events')
+def x_coords(events):
+    return events.x.astype(np.int64)
+
+@intermediate('events')
+def y_coords(events):
+    return events.y.astype(np.int64)
+
+@intermediate('x_coords', 'y_coords')
+def distances(x_coords, y_coords):
+    return np.sqrt(np.diff(x_coords)**2 + np.diff(y_coords)**2) if len(x_coords) > 1 else np.array([])
+
+@intermediate('mouse_data')
+def client_sizes(mouse_data):
+    return np.asarray(mouse_data.get('mousemove_client_height_width', []), dtype=np.float64).reshape(-1, 2)
+
+# --- Web log intermediates ---
+# Raw entries are read with .get(), so entries missing a field (e.g. a request posting only status codes)
+# count towards the features that need that field as absent. Each field is reduced only when a requested
+# feature reads it.
+
+def parse_web_log_timestamps(web_logs):
+    """Parses every entry's timestamp in one call, dropping the ones that are missing or do not parse."""
+    timestamp_strs = [log.get('timestamp_str') for log in web_logs]
+    if not any(timestamp_strs):
+        return pd.Series([], dtype='datetime64[ns, UTC]')
+    # utc=True: one session's entries may carry different offsets (a DST change, logs posted by a client)
+    parsed = pd.to_datetime(pd.Series(timestamp_strs, dtype=object), format=WEB_LOG_TIMESTAMP_FORMAT, errors='coerce', utc=True)
+    return parsed.dropna()
+
+@intermediate('web_logs')
+def status_codes(web_logs):
+    return np.array([log.get('status_code', 0) for log in web_logs], dtype=np.int64)
+
+@intermediate('status_codes')
+def status_code_sum(status_codes):
+    return int(status_codes.sum())
+
+@intermediate('web_logs')
+def bytes_sent_sum(web_logs):
+    return sum(log.get('bytes_sent', 0) for log in web_logs)
+
+@intermediate('web_logs')
+def paths(web_logs):
+    return {log['path'] for log in web_logs if 'path' in log}
+
+@intermediate('web_logs')
+def user_agents(web_logs):
+    return {log['user_agent'] for log in web_logs if 'user_agent' in log}
+
+@intermediate('web_logs')
+def web_log_timestamps(web_logs):
+    return parse_web_log_timestamps(web_logs)
+
+@intermediate('web_log_timestamps')
+def first_timestamp(web_log_timestamps):
+    return web_log_timestamps.iloc[0] if len(web_log_timestamps) else None
+
+@intermediate('web_log_timestamps')
+def last_timestamp(web_log_timestamps):
+    return web_log_timestamps.iloc[-1] if len(web_log_timestamps) else None
+
+# --- Mouse movement features ---
+
+for _name, _kind in [('num_moves', EVENT_MOVE), ('num_left_clicks', EVENT_LEFT_CLICK),
+                     ('num_right_clicks', EVENT_RIGHT_CLICK), ('num_middle_clicks', EVENT_MIDDLE_CLICK)]:
+    register_feature(_name, ['kind_counts'], lambda kind_counts, _kind=_kind: int(kind_counts[_kind]))
+register_feature('total_actions', ['events'], lambda events: len(events.event_kind))
+
+register_feature('avg_time_between_moves', ['time_diffs'], lambda d: np.mean(d) if len(d) else 0)
+register_feature('std_time_between_moves', ['time_diffs'], lambda d: np.std(d) if len(d) else 0)
+register_feature('min_time_between_moves', ['time_diffs'], lambda d: np.min(d) if len(d) else 0)
+register_feature('max_time_between_moves', ['time_diffs'], lambda d: np.max(d) if len(d) else 0)
+register_feature('total_session_duration', ['times'], lambda t: t[-1] - t[0] if len(t) > 1 else 0)
+
+register_feature('total_distance', ['distances'], lambda d: np.sum(d) if len(d) else 0)
+register_feature('avg_speed', ['total_distance', 'total_session_duration'],
+                 lambda distance, duration: distance / duration if duration > 0 else 0)
+
+def std_speed(distances, time_diffs):
+    # As in the original per-session code, a single distance or time difference is broadcast against the other
+    if len(distances) > 0 and len(time_diffs) > 0 and (len(distances) == len(time_diffs) or 1 in (len(distances), len(time_diffs))):
+        return np.std(distances / time_diffs)
+    return 0
+register_feature('std_speed', ['distances', 'time_diffs'], std_speed)
+
+def straightness(x_coords, y_coords, total_distance):
+    if len(x_coords) > 1 and total_distance > 0:
+        return np.sqrt((x_coords[-1] - x_coords[0])**2 + (y_coords[-1] - y_coords[0])**2) / total_distance
+    return 0
+register_feature('straightness', ['x_coords', 'y_coords', 'total_distance'], straightness)
+
+for _axis in ['x', 'y']:
+    register_feature(f'min_{_axis}', [f'{_axis}_coords'], lambda c: np.min(c) if len(c) > 1 else 0)
+    register_feature(f'max_{_axis}', [f'{_axis}_coords'], lambda c: np.max(c) if len(c) > 1 else 0)
+    register_feature(f'std_{_axis}', [f'{_axis}_coords'], lambda c: np.std(c) if len(c) > 1 else 0)
+
+# --- Phase 2 mouse movement features (0 for Phase 1 data) ---
+
+for _name, _column, _stat in [('avg_client_height', 0, np.mean), ('avg_client_width', 1, np.mean),
+                              ('std_client_height', 0, np.std), ('std_client_width', 1, np.std)]:
+    register_feature(_name, ['client_sizes'], lambda s, _column=_column, _stat=_stat: _stat(s[:, _column]) if len(s) else 0)
+register_feature('unique_client_sizes', ['client_sizes'], lambda s: len(set(map(tuple, s))))
+register_feature('unique_visited_urls_mm', ['mouse_data'], lambda m: len(set(m.get('mousemove_visited_urls', []))))
+
+# --- Web log features ---
+
+register_feature('num_requests', ['web_logs'], len)
+register_feature('num_get', ['web_logs'], lambda logs: sum(1 for log in logs if log.get('method') == 'GET'))
+register_feature('num_post', ['web_logs'], lambda logs: sum(1 for log in logs if log.get('method') == 'POST'))
+register_feature('unique_paths', ['paths'], len)
+register_feature('avg_status_code', ['status_code_sum', 'num_requests'], lambda total, n: total / n if n else 0)
+register_feature('avg_bytes_sent', ['bytes_sent_sum', 'num_requests'], lambda total, n: total / n if n else 0)
+register_feature('num_200_ok', ['status_codes'], lambda codes: int(np.sum(codes == 200)))
+register_feature('num_404_not_found', ['status_codes'], lambda codes: int(np.sum(codes == 404)))
+register_feature('num_redirects', ['status_codes'], lambda codes: int(np.sum((codes >= 300) & (codes < 400))))
+
+def session_duration_web_logs(first_timestamp, last_timestamp):
+    if first_timestamp is None or last_timestamp is None:
+        return 0
+    return (last_timestamp - first_timestamp).total_seconds()
+register_feature('session_duration_web_logs', ['first_timestamp', 'last_timestamp'], session_duration_web_logs)
+register_feature('user_agent_diversity', ['user_agents'], len)
+
+# --- Web log summaries ---
+# A summary holds the web log features and intermediates that combine across chunks of a session's log.
+# Callers that keep one up to date (log_ingest.py, log_scorer.py) pass it as 'web_log_summary' and every
+# web log feature is read from it; otherwise each feature reduces only the raw entry fields it needs.
+
+WEB_LOG_SUMMARY_FIELDS = [
+    'num_requests', 'num_get', 'num_post', 'paths', 'user_agents', 'status_code_sum', 'bytes_sent_sum',
+    'num_200_ok', 'num_404_not_found', 'num_redirects', 'first_timestamp', 'last_timestamp'
+]
+
+def summarize_web_logs(web_logs):
+    """
+    Reduces a session's parsed web log entries (in log order) to a summary, which the web log features can be
+    computed from. Summaries of consecutive chunks of a session's log combine with merge_web_log_summaries(),
+    which is how log_ingest.py keeps them up to date without re-reading old lines.
+    """
+    return compute_features(WEB_LOG_SUMMARY_FIELDS, web_logs=web_logs)
+
+def merge_web_log_summaries(earlier, later):
+    """Combines the summaries of two consecutive chunks of a session's log (earlier lines first)."""
+    merged = {name: earlier[name] + later[name] for name in earlier
+              if name not in ('paths', 'user_agents', 'first_timestamp', 'last_timestamp')}
+    merged['paths'] = earlier['paths'] | later['paths']
+    merged['user_agents'] = earlier['user_agents'] | later['user_agents']
+    merged['first_timestamp'] = earlier['first_timestamp'] if earlier['first_timestamp'] is not None else later['first_timestamp']
+    merged['last_timestamp'] = later['last_timestamp'] if later['last_timestamp'] is not None else earlier['last_timestamp']
+    return merged
+
+# --- Feature sets ---
+
+MOUSE_FEATURES = [
+    'num_moves', 'num_left_clicks', 'num_right_clicks', 'num_middle_clicks', 'total_actions',
+    'avg_time_between_moves', 'std_time_between_moves', 'min_time_between_moves', 'max_time_between_moves',
+    'total_session_duration', 'total_distance', 'avg_speed', 'std_speed', 'straightness',
+    'min_x', 'max_x', 'min_y', 'max_y', 'std_x', 'std_y'
+]
+PHASE2_MOUSE_FEATURES = [
+    'avg_client_height', 'avg_client_width', 'std_client_height', 'std_client_width',
+    'unique_client_sizes', 'unique_visited_urls_mm'
+]
+WEB_LOG_FEATURES = [
+    'num_requests', 'num_get', 'num_post', 'unique_paths', 'avg_status_code', 'avg_bytes_sent',
+    'num_200_ok', 'num_404_not_found', 'num_redirects', 'session_duration_web_logs', 'user_agent_diversity'
+]
+# The 11 features model/simple_test_model.joblib was fitted on (it does not record feature names itself)
+SIMPLE_MODEL_FEATURES = [
+    'total_session_duration', 'avg_time_between_moves', 'num_left_clicks',
+    'total_distance', 'avg_bytes_sent', 'avg_status_code', 'avg_speed',
+    'max_x', 'max_y', 'min_x', 'min_y'
+]
+PHASE1_FEATURES = MOUSE_FEATURES + WEB_LOG_FEATURES
+ALL_FEATURES = MOUSE_FEATURES + PHASE2_MOUSE_FEATURES + WEB_LOG_FEATURES
+
+# --- Computation ---
+
+def compute_features(names, **sources):
+    """
+    Computes the named features for one session and returns them as a dict in the order requested.
+    sources holds the raw inputs (mouse_data, web_logs) and may also supply any intermediate directly,
+    e.g. events=<Trajectory from the packed store>; supplied values are used instead of being recomputed.
+    A web_log_summary (see summarize_web_logs) supplies every field it holds this way.
+    """
+    values = dict(sources)
+    values.update(values.pop('web_log_summary', None) or {})
+    return {name: resolve(name, values) for name in names}
+
+def resolve(name, values):
+    """Returns the named feature or intermediate, computing it (and its inputs) into values when missing."""
+    # Module-level rather than a closure in compute_features: a self-referencing closure forms a reference
+    # cycle that would keep every session's raw data and intermediates alive until the next gc pass
+    if name in values:
+        return values[name]
+    if name in FEATURES:
+        inputs, fn = FEATURES[name]
+    elif name in INTERMEDIATES:
+        inputs, fn = INTERMEDIATES[name]
+    elif name in SOURCE_DEFAULTS:
+        values[name] = SOURCE_DEFAULTS[name]
+        return values[name]
+    else:
+        raise KeyError(f"Unknown feature or feature input '{name}'")
+    values[name] = fn(*[resolve(i, values) for i in inputs])
+    return values[name]
+
+# --- Verdicts ---
+
+HUMAN_CLASS = 0 # Every other class of a model is a kind of bot (moderate_bot, advanced_bot, or just bot)
+
+def bot_verdict(classes, probability):
+    """
+    Returns (prediction, bot_probability) for one predict_proba row of a model with the given classes_:
+    prediction is 1 when the most likely class is any bot class, and bot_probability is 1 - P(human), so a
+    3-class model (or a student distilled from one) is reported like the binary simple model.
+    """
+    classes = list(classes)
+    human_probability = float(probability[classes.index(HUMAN_CLASS)])
+    predicted_class = classes[int(np.argmax(probability))]
+    return int(predicted_class != HUMAN_CLASS), 1.0 - human_probability
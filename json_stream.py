@@ -0,0 +1,77 @@
+# bot-detector/json_stream.py
+
+import json
+
+# Incremental reader for large JSON record files: either one top-level array of records (the phase2 mouse
+# movement files) or a stream of records separated by whitespace (NDJSON). The file is read in fixed-size
+# chunks and each record is decoded with JSONDecoder.raw_decode as soon as it is complete, so only the
+# current record and one chunk are in memory however large the file is.
+
+# --- Configuration ---
+READ_CHUNK_CHARS = 1 << 20 # Characters read per refill; larger records take several refills
+
+WHITESPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+def iter_json_records(path, keep=None, chunk_chars=READ_CHUNK_CHARS):
+    """
+    Yields the records of a top-level JSON array or NDJSON file one at a time. With keep, records for which
+    keep(record) is false are discarded as soon as they are decoded.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        position = 0
+        consumed = 0 # Characters dropped from the front of the buffer so far
+        eof = False
+
+        def refill():
+            # Reads at least as much as is still buffered, so a record spanning many chunks is re-parsed
+            # a logarithmic rather than linear number of times
+            nonlocal buffer, position, consumed, eof
+            chunk = f.read(max(chunk_chars, len(buffer) - position))
+            eof = not chunk
+            consumed += position
+            buffer = buffer[position:] + chunk
+            position = 0
+            return not eof
+
+        def skip(separators):
+            """Advances past separator characters; returns the next character, or '' at end of file."""
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position] in separators:
+                    position += 1
+                if position < len(buffer):
+                    return buffer[position]
+                if not refill():
+                    return ''
+
+        in_array = skip(WHITESPACE) == '['
+        if in_array:
+            position += 1
+        separators = WHITESPACE + ',' if in_array else WHITESPACE
+
+        while True:
+            char = skip(separators)
+            if char == '':
+                if in_array:
+                    raise ValueError(f"{path}: unterminated top-level JSON array")
+                return
+            if in_array and char == ']':
+                return
+
+            while True:
+                try:
+                    record, end = _decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    record, end = None, None
+                # A value reaching the end of the buffer may continue in the next chunk (e.g. a number)
+                if end is not None and (end < len(buffer) or eof):
+                    break
+                if not refill():
+                    if end is None:
+                        raise ValueError(f"{path}: malformed or truncated JSON record at character {consumed + position}")
+            position = end
+            if keep is None or keep(record):
+                yield record
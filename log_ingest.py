@@ -0,0 +1,138 @@
+# bot-detector/log_ingest.py
+
+import os
+import pickle
+import hashlib
+from features import summarize_web_logs, merge_web_log_summaries
+
+# Incremental web log ingestion. Access logs are append-only, so a checkpoint records for every log file
+# its inode, the byte offset up to which it has been processed and a hash of the last processed line,
+# together with the per-session web log summaries (see features.summarize_web_logs) built from it.
+# Each run parses only the bytes appended since, and merges them into the stored summaries. A file
+# whose inode changed (rotated), that shrank below the offset (truncated) or whose last processed line
+# no longer matches (rewritten in place) is rescanned from the start instead.
+
+# --- Configuration ---
+CHECKPOINT_VERSION = 1 # Bump when the summary layout changes, so old checkpoints are rebuilt
+READ_CHUNK_BYTES = 8 * 1024 * 1024
+MAX_RUN_ENTRIES = 1000 # Parsed lines of one session buffered before they are folded into its summary
+
+def line_hash(raw_line):
+    return hashlib.blake2b(raw_line, digest_size=16).hexdigest()
+
+def load_checkpoint(checkpoint_path):
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if checkpoint.get('version') == CHECKPOINT_VERSION:
+            return checkpoint
+    return {'version': CHECKPOINT_VERSION, 'files': {}}
+
+def save_checkpoint(checkpoint, checkpoint_path):
+    """Writes the checkpoint atomically, so an interrupted run leaves the previous one intact."""
+    os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, checkpoint_path)
+
+def resume_offset(f, file_state, stat):
+    """Returns the offset to resume the open file from: its checkpointed offset, or 0 when it has to be rescanned."""
+    if file_state is None or file_state['inode'] != stat.st_ino or stat.st_size < file_state['offset']:
+        return 0
+    if file_state['offset'] > 0:
+        f.seek(file_state['offset'] - file_state['last_line_length'])
+        if line_hash(f.read(file_state['last_line_length'])) != file_state['last_line_hash']:
+            return 0
+    return file_state['offset']
+
+def iter_complete_lines(f, offset):
+    """Yields (raw line, end offset) for every newline-terminated line after offset; a partial last line is left for the next run."""
+    f.seek(offset)
+    pending = b''
+    while True:
+        chunk = f.read(READ_CHUNK_BYTES)
+        if not chunk:
+            return
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for raw_line in lines:
+            offset += len(raw_line) + 1
+            yield raw_line + b'\n', offset
+
+def fold_run(summaries, session_id, run):
+    if run:
+        summary = summarize_web_logs(run)
+        summaries[session_id] = merge_web_log_summaries(summaries[session_id], summary) if session_id in summaries else summary
+
+def summarize_session_runs(entries, summaries=None):
+    """
+    Folds parsed entries (in log order) into {session_id: web log summary}, updating summaries when given.
+    Access logs hold a session's requests in contiguous runs, so only the current run is buffered (at most
+    MAX_RUN_ENTRIES lines); a session whose lines interleave with others just has several runs merged.
+    """
+    summaries = {} if summaries is None else summaries
+    run_session_id, run = None, []
+    for entry in entries:
+        if entry['session_id'] != run_session_id or len(run) >= MAX_RUN_ENTRIES:
+            fold_run(summaries, run_session_id, run)
+            run_session_id, run = entry['session_id'], []
+        run.append(entry)
+    fold_run(summaries, run_session_id, run)
+    return summaries
+
+def ingest_log_file(path, file_state, parse_line):
+    """
+    Brings one file's state up to date and returns (new state, number of lines parsed, whether it was rescanned).
+    parse_line turns a decoded line into a parsed entry with a 'session_id', or None to skip it.
+    """
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        offset = resume_offset(f, file_state, stat)
+        rescanned = file_state is not None and offset == 0
+        sessions = {} if offset == 0 else file_state['sessions']
+        new_state = {'inode': stat.st_ino, 'offset': offset, 'sessions': sessions,
+                     'last_line_hash': file_state['last_line_hash'] if offset else None,
+                     'last_line_length': file_state['last_line_length'] if offset else 0}
+
+        num_lines = 0
+
+        def parsed_entries():
+            nonlocal num_lines
+            for raw_line, end_offset in iter_complete_lines(f, offset):
+                num_lines += 1
+                parsed = parse_line(raw_line.decode('utf-8', errors='replace').strip())
+                if parsed:
+                    yield parsed
+                new_state['offset'] = end_offset
+                new_state['last_line_hash'] = line_hash(raw_line)
+                new_state['last_line_length'] = len(raw_line)
+
+        summarize_session_runs(parsed_entries(), sessions)
+    return new_state, num_lines, rescanned
+
+def ingest_log_files(log_paths, checkpoint_path, parse_line):
+    """
+    Updates the checkpoint at checkpoint_path with whatever was appended to log_paths since the last run and
+    returns ({session_id: web log summary} merged over the files in the given order, ingestion stats).
+    Files no longer in log_paths are dropped from the checkpoint.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    files = {}
+    stats = {'files': len(log_paths), 'new_lines': 0, 'rescanned_files': []}
+    for path in log_paths:
+        files[path], num_lines, rescanned = ingest_log_file(path, checkpoint['files'].get(path), parse_line)
+        stats['new_lines'] += num_lines
+        if rescanned:
+            stats['rescanned_files'].append(path)
+    checkpoint['files'] = files
+    save_checkpoint(checkpoint, checkpoint_path)
+
+    session_summaries = {}
+    for path in log_paths:
+        for session_id, summary in files[path]['sessions'].items():
+            if session_id in session_summaries:
+                session_summaries[session_id] = merge_web_log_summaries(session_summaries[session_id], summary)
+            else:
+                session_summaries[session_id] = summary
+    return session_summaries, stats
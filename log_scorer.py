@@ -0,0 +1,211 @@
+# bot-detector/log_scorer.py
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import OrderedDict
+from datetime import datetime
+import joblib
+import numpy as np
+from client import parse_web_log_entry
+from features import compute_features, summarize_web_logs, merge_web_log_summaries, bot_verdict, FEATURES, SIMPLE_MODEL_FEATURES
+
+# Live scorer: follows access logs as they are written, keeps a web log summary per session and scores
+# sessions without an HTTP round trip. A session is (re)scored when it has gained RESCORE_REQUESTS requests
+# since its last verdict, when RESCORE_INTERVAL seconds have passed with new traffic, and one last time when
+# it expires after IDLE_TIMEOUT seconds without traffic. Verdicts are written as NDJSON.
+#
+#   python log_scorer.py /var/log/apache2/access.log --output verdicts.ndjson
+
+# --- Configuration ---
+MODEL_PATH = 'model/simple_test_model.joblib'
+POLL_INTERVAL = 0.5       # Seconds to sleep when no log has new lines
+READ_CHUNK_BYTES = 1024 * 1024 # Bytes read per file per batch
+RESCORE_REQUESTS = 20     # New requests that trigger an immediate re-score
+RESCORE_INTERVAL = 30.0   # Seconds after which a session with new requests is re-scored anyway
+IDLE_TIMEOUT = 1800.0     # Seconds without traffic after which a session is scored a final time and dropped
+MAX_SESSIONS = 100000     # Hard cap on tracked sessions; the least recently active are expired first
+
+# --- Following Logs ---
+
+class LogFollower:
+    """Reads the complete lines appended to a log file, reopening it when it is rotated or truncated."""
+
+    def __init__(self, path, from_start=False):
+        self.path = path
+        self.file = None
+        self.inode = None
+        self.pending = b''
+        self.at_eof = False # Whether the last read_lines() found nothing more to read
+        self.open(from_start)
+
+    def open(self, from_start=True):
+        if self.file is not None:
+            self.file.close()
+        self.file, self.inode, self.pending = None, None, b''
+        if os.path.exists(self.path):
+            self.file = open(self.path, 'rb')
+            self.inode = os.fstat(self.file.fileno()).st_ino
+            if not from_start:
+                self.file.seek(0, os.SEEK_END)
+
+    def read_lines(self):
+        """Returns the complete lines appended since the last call (a partial last line is kept until it is finished)."""
+        if self.file is None:
+            self.open() # The file did not exist yet
+            if self.file is None:
+                self.at_eof = True
+                return []
+        chunk = self.file.read(READ_CHUNK_BYTES)
+        self.at_eof = not chunk
+        if not chunk:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return [] # Rotated away and not recreated yet; keep the old file until it is
+            if stat.st_ino != self.inode:
+                self.open() # Rotated: the old file is drained (read returned nothing), continue with the new one
+            elif stat.st_size < self.file.tell():
+                self.file.seek(0) # Truncated in place (copytruncate)
+                self.pending = b''
+            return []
+        lines = (self.pending + chunk).split(b'\n')
+        self.pending = lines.pop()
+        return [line.decode('utf-8', errors='replace') for line in lines]
+
+    def flush_pending(self):
+        """Returns the unterminated last line as a line of its own (for a final pass over a file that lacks a trailing newline)."""
+        line, self.pending = self.pending, b''
+        return [line.decode('utf-8', errors='replace')] if line else []
+
+# --- Session State ---
+
+def update_sessions(sessions, lines, now):
+    """Parses a batch of lines and merges them into the per-session state; returns the number of parsed entries."""
+    new_entries = {}
+    for line in lines:
+        parsed = parse_web_log_entry(line.strip())
+        if parsed:
+            new_entries.setdefault(parsed['session_id'], []).append(parsed)
+    for session_id, entries in new_entries.items():
+        summary = summarize_web_logs(entries)
+        state = sessions.pop(session_id, None) # Re-inserted at the end: sessions stays ordered by last activity
+        if state is None:
+            state = {'summary': summary, 'scored_requests': 0, 'last_scored': now}
+        else:
+            state['summary'] = merge_web_log_summaries(state['summary'], summary)
+        state['last_seen'] = now
+        sessions[session_id] = state
+    return sum(len(entries) for entries in new_entries.values())
+
+def due_sessions(sessions, now, rescore_requests, rescore_interval):
+    """Returns [(session_id, reason)] for sessions whose verdict is stale."""
+    due = []
+    for session_id, state in sessions.items():
+        new_requests = state['summary']['num_requests'] - state['scored_requests']
+        if new_requests >= rescore_requests:
+            due.append((session_id, 'threshold'))
+        elif new_requests > 0 and now - state['last_scored'] >= rescore_interval:
+            due.append((session_id, 'schedule'))
+    return due
+
+def expire_sessions(sessions, now, idle_timeout, max_sessions):
+    """Removes idle sessions (and the least recently active beyond max_sessions); returns [(session_id, state)]."""
+    expired = []
+    while sessions:
+        session_id, state = next(iter(sessions.items()))
+        if now - state['last_seen'] < idle_timeout and len(sessions) <= max_sessions:
+            break
+        expired.append((session_id, sessions.pop(session_id)))
+    return expired
+
+# --- Scoring ---
+
+def score_sessions(model, feature_names, items, output, now):
+    """Scores [(session_id, state, reason)] with one batched prediction and writes one NDJSON verdict per session."""
+    if not items:
+        return
+    computed = [name for name in feature_names if name in FEATURES]
+    vectors = []
+    for _, state, _ in items:
+        features = compute_features(computed, web_log_summary=state['summary'])
+        vectors.append([features.get(name, 0) for name in feature_names])
+    probabilities = model.predict_proba(np.array(vectors, dtype=np.float64))
+    timestamp = datetime.now().isoformat()
+    for (session_id, state, reason), probability in zip(items, probabilities):
+        # Any class but human is a bot, so 3-class models and their distilled students report like the simple model
+        prediction, bot_probability = bot_verdict(model.classes_, probability)
+        output.write(json.dumps({
+            'session_id': session_id,
+            'prediction': prediction,
+            'prediction_label': 'Bot' if prediction == 1 else 'Human',
+            'bot_probability': bot_probability,
+            'num_requests': state['summary']['num_requests'],
+            'reason': reason,
+            'timestamp': timestamp
+        }) + '\n')
+        state['scored_requests'] = state['summary']['num_requests']
+        state['last_scored'] = now
+    output.flush()
+
+def run_scorer(log_paths, output, model_path=MODEL_PATH, from_start=False, rescore_requests=RESCORE_REQUESTS,
+               rescore_interval=RESCORE_INTERVAL, idle_timeout=IDLE_TIMEOUT, max_sessions=MAX_SESSIONS, run_once=False):
+    """
+    Main loop; with run_once it processes what is currently in the logs, scores every session and returns.
+    A run_once pass always reads the logs from the beginning, since there are no new lines to wait for.
+    """
+    model = joblib.load(model_path)
+    feature_names = list(getattr(model, 'feature_names_in_', SIMPLE_MODEL_FEATURES))
+    followers = [LogFollower(path, from_start or run_once) for path in log_paths]
+    sessions = OrderedDict()
+    print(f"✅ Scoring sessions from {len(followers)} log(s) with {model_path}", file=sys.stderr)
+
+    while True:
+        lines = [line for follower in followers for line in follower.read_lines()]
+        # A read can end mid-line, so only a pass where every follower hit end of file has drained the logs
+        drained = all(follower.at_eof for follower in followers)
+        if run_once and drained:
+            # Nothing will finish a last line written without its newline, so it is taken as it is
+            lines += [line for follower in followers for line in follower.flush_pending()]
+        now = time.monotonic()
+        if lines:
+            update_sessions(sessions, lines, now)
+
+        due = due_sessions(sessions, now, rescore_requests, rescore_interval)
+        score_sessions(model, feature_names, [(sid, sessions[sid], reason) for sid, reason in due], output, now)
+        if run_once and drained:
+            expired = list(sessions.items())
+            sessions.clear()
+        else:
+            expired = expire_sessions(sessions, now, idle_timeout, max_sessions)
+        score_sessions(model, feature_names, [(sid, state, 'expired') for sid, state in expired
+                                              if state['summary']['num_requests'] > state['scored_requests']], output, now)
+        if run_once and drained:
+            return
+        if drained:
+            time.sleep(POLL_INTERVAL)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow access logs and score sessions as traffic arrives.")
+    parser.add_argument('log_files', nargs='+', help="Access logs to follow (rotation and truncation are handled)")
+    parser.add_argument('--output', default='-', help="NDJSON verdict file to append to ('-' for stdout)")
+    parser.add_argument('--model', default=MODEL_PATH, help="Model to score with")
+    parser.add_argument('--from-start', action='store_true', help="Read the logs from the beginning instead of only new lines")
+    parser.add_argument('--rescore-requests', type=int, default=RESCORE_REQUESTS, help="New requests that trigger a re-score")
+    parser.add_argument('--rescore-interval', type=float, default=RESCORE_INTERVAL, help="Seconds before a session with new requests is re-scored")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT, help="Seconds without traffic before a session expires")
+    parser.add_argument('--max-sessions', type=int, default=MAX_SESSIONS, help="Maximum sessions kept in memory")
+    parser.add_argument('--once', action='store_true', help="Score what the logs currently hold (from the start) and exit")
+    args = parser.parse_args()
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'a')
+    try:
+        run_scorer(args.log_files, output, args.model, args.from_start, args.rescore_requests, args.rescore_interval,
+                   args.idle_timeout, args.max_sessions, run_once=args.once)
+    except KeyboardInterrupt:
+        print("Stopped.", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
@@ -0,0 +1,159 @@
+# bot-detector/mouse_codec.py
+
+import zlib
+import base64
+import struct
+import numpy as np
+from mouse_decoder import MouseEvents, EVENT_OTHER
+
+# Compact binary encoding of a session's mouse events, accepted by /api/detect next to the JSON string lists.
+#
+#   magic 'BM', version (1 byte), time decimals (1 byte)
+#   varint event count, then one byte per event kind (mouse_decoder.EVENT_*)
+#   varint point count, then x and y as zigzag varint deltas (first value relative to 0)
+#   varint time count, then times * 10**decimals as zigzag varint deltas
+#
+# Kinds above EVENT_OTHER, more than MAX_TIME_DECIMALS decimals, or a time count other than the point count
+# make a payload malformed: every move carries one point and one time.
+#
+# Deltas between consecutive mouse samples are small, so most take one or two bytes instead of the
+# ~10 characters of "(123,456)". Decoding is vectorized end to end: varints are split on their terminal
+# bytes, reassembled with one reduceat and turned back into absolute values with cumsum.
+
+# --- Configuration ---
+CODEC_MAGIC = b'BM'
+CODEC_VERSION = 1
+CONTENT_TYPE = 'application/x-bot-mouse'
+MAX_TIME_DECIMALS = 6
+MAX_DECOMPRESSED_BYTES = 32 * 1024 * 1024 # Request bodies inflating beyond this are rejected
+
+HEADER = struct.Struct('<2sBB')
+
+# --- Varints ---
+
+def encode_varints(values):
+    """LEB128-encodes an array of non-negative integers (vectorized)."""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b''
+    bit_length = np.floor(np.log2(np.maximum(values, 1).astype(np.float64))).astype(np.int64) + 1
+    num_bytes = np.maximum(1, -(-bit_length // 7))
+    num_bytes = np.where(values >= np.uint64(1) << np.uint64(63), 10, num_bytes) # float64 log2 rounds near 2**64
+    width = int(num_bytes.max())
+    shifts = (np.arange(width, dtype=np.uint64) * np.uint64(7))
+    groups = ((values[:, None] >> shifts[None, :]) & np.uint64(0x7f)).astype(np.uint8)
+    positions = np.arange(width)[None, :]
+    groups[positions < (num_bytes[:, None] - 1)] |= 0x80
+    return groups[positions < num_bytes[:, None]].tobytes()
+
+def decode_varints(buf, offset, count):
+    """Decodes count LEB128 varints from buf at offset; returns (uint64 array, offset after them)."""
+    if count == 0:
+        return np.array([], dtype=np.uint64), offset
+    data = np.frombuffer(buf, dtype=np.uint8, offset=offset)
+    ends = np.flatnonzero(data < 0x80)[:count]
+    if len(ends) < count:
+        raise ValueError("Truncated mouse payload")
+    used = int(ends[-1]) + 1
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    if lengths.max() > 10:
+        raise ValueError("Malformed varint in mouse payload")
+    shifts = (np.arange(used) - np.repeat(starts, lengths)).astype(np.uint64) * np.uint64(7)
+    values = np.add.reduceat((data[:used] & 0x7f).astype(np.uint64) << shifts, starts)
+    return values, offset + used
+
+def zigzag_encode(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+def zigzag_decode(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+def encode_deltas(values):
+    values = np.asarray(values, dtype=np.int64)
+    return encode_varints(zigzag_encode(np.diff(values, prepend=0)))
+
+def decode_deltas(buf, offset, count):
+    deltas, offset = decode_varints(buf, offset, count)
+    return np.cumsum(zigzag_decode(deltas)), offset
+
+# --- Mouse Events ---
+
+def time_decimals(t):
+    """The fewest decimals (up to MAX_TIME_DECIMALS) that represent every time exactly."""
+    for decimals in range(MAX_TIME_DECIMALS + 1):
+        scaled = t * 10 ** decimals
+        if np.allclose(scaled, np.round(scaled), rtol=0, atol=1e-6):
+            return decimals
+    return MAX_TIME_DECIMALS
+
+def encode_mouse_events(events):
+    """Encodes a MouseEvents (as returned by mouse_decoder.decode_mouse_events) into the compact format."""
+    event_kind, x, y, t = (np.asarray(a) for a in events)
+    if len(t) != len(x):
+        raise ValueError(f"Cannot encode {len(x)} points with {len(t)} times")
+    t = t.astype(np.float64)
+    decimals = time_decimals(t) if len(t) else 0
+    return b''.join([
+        HEADER.pack(CODEC_MAGIC, CODEC_VERSION, decimals),
+        encode_varints([len(event_kind)]), event_kind.astype(np.uint8).tobytes(),
+        encode_varints([len(x)]), encode_deltas(x), encode_deltas(y),
+        encode_varints([len(t)]), encode_deltas(np.round(t * 10 ** decimals)),
+    ])
+
+def decode_mouse_payload(buf):
+    """Decodes the compact format straight into MouseEvents arrays."""
+    if len(buf) < HEADER.size:
+        raise ValueError("Truncated mouse payload")
+    magic, version, decimals = HEADER.unpack_from(buf, 0)
+    if magic != CODEC_MAGIC or version != CODEC_VERSION:
+        raise ValueError("Not a compact mouse payload (bad magic or version)")
+    if decimals > MAX_TIME_DECIMALS:
+        raise ValueError(f"Mouse payload times have more than {MAX_TIME_DECIMALS} decimals")
+    offset = HEADER.size
+
+    (num_events,), offset = decode_varints(buf, offset, 1)
+    event_kind = np.frombuffer(buf, dtype=np.uint8, count=int(num_events), offset=offset)
+    if len(event_kind) and event_kind.max() > EVENT_OTHER:
+        raise ValueError("Unknown event kind in mouse payload")
+    offset += int(num_events)
+    (num_points,), offset = decode_varints(buf, offset, 1)
+    x, offset = decode_deltas(buf, offset, int(num_points))
+    y, offset = decode_deltas(buf, offset, int(num_points))
+    (num_times,), offset = decode_varints(buf, offset, 1)
+    if num_times != num_points:
+        raise ValueError(f"Mouse payload has {int(num_points)} points but {int(num_times)} times")
+    t, offset = decode_deltas(buf, offset, int(num_times))
+    return MouseEvents(event_kind, x, y, t / 10 ** decimals if decimals else t.astype(np.float64))
+
+def decode_mouse_payload_b64(text):
+    return decode_mouse_payload(base64.b64decode(text, validate=True))
+
+# --- Request Bodies ---
+
+def decompress_body(body, content_encoding):
+    """
+    Inflates a gzip or deflate request body (anything else is returned as is), refusing oversized output.
+    Raises ValueError for an unsupported encoding, a corrupt body or one inflating beyond MAX_DECOMPRESSED_BYTES.
+    """
+    content_encoding = (content_encoding or '').strip().lower()
+    if content_encoding in ('', 'identity'):
+        return body
+    if content_encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == 'deflate':
+        # Per RFC 9110 deflate is zlib-wrapped, but raw deflate streams are common; the header tells them apart
+        raw = len(body) < 2 or (body[0] & 0x0f) != 8 or ((body[0] << 8) | body[1]) % 31 != 0
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS if raw else zlib.MAX_WBITS)
+    else:
+        raise ValueError(f"Unsupported Content-Encoding '{content_encoding}'")
+    try:
+        data = decompressor.decompress(body, MAX_DECOMPRESSED_BYTES)
+    except zlib.error as e:
+        # A corrupt body is the client's error like any other malformed request
+        raise ValueError(f"Request body is not valid {content_encoding} data: {e}")
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"Request body inflates beyond {MAX_DECOMPRESSED_BYTES} bytes")
+    return data
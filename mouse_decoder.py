@@ -0,0 +1,131 @@
+# bot-detector/mouse_decoder.py
+
+import re
+from collections import namedtuple
+import numpy as np
+
+# Event kinds, one per total_behaviour entry
+EVENT_MOVE = 0
+EVENT_LEFT_CLICK = 1
+EVENT_RIGHT_CLICK = 2
+EVENT_MIDDLE_CLICK = 3
+EVENT_SCROLL = 4
+EVENT_OTHER = 5
+
+# A decoded event stream: one kind per total_behaviour entry, plus the move coordinates and move times.
+# Coordinates and times are decoded independently, so a malformed entry only drops that one value.
+MouseEvents = namedtuple('MouseEvents', ['event_kind', 'x', 'y', 't'])
+
+# The mouse fields come in three shapes:
+#   phase1 request/list format:  ['m', 'c(l)'], ['(0.1)', '(0.3)'], ['(100,200)', '(150,250)']
+#   raw session files:           '[m(6,7)][c(l)][s(270)]', '624433306,624433314,', '[6,7][14,15]'
+#   phase2 records:              the whole stream packed in total_behaviour as '[m(8,6)][m(16,14)]...'
+# Well-formed strings are validated with one regex match and converted by NumPy's C parser in a single
+# call; anything else falls back to a regex pass that skips malformed entries, as the per-item parsers did.
+
+# A time is valid when, after stripping parentheses, it is digits with at most one '.'
+TIME_PATTERN = re.compile(r'(?:^|,)[()]*(\d+\.?\d*|\.\d+)[()]*(?=,|$)')
+TIME_TOKEN_PATTERN = re.compile(r'[()]*(\d+\.?\d*|\.\d+)[()]*')
+# A coordinate is valid when it is exactly two integers separated by a comma
+COORD_LIST_PATTERN = re.compile(r'[()]*\s*([+-]?\d+)\s*,\s*([+-]?\d+)\s*[()]*')
+COORD_STRING_PATTERN = re.compile(r'\[\s*([+-]?\d+)\s*,\s*([+-]?\d+)\s*\]')
+BEHAVIOUR_TOKEN_PATTERN = re.compile(r'\[([^\]\[]*)\]')
+WELL_FORMED_TIMES_PATTERN = re.compile(r'(?:\d+(?:\.\d*)?,)*(?:\d+(?:\.\d*)?)?')
+WELL_FORMED_COORDS_PATTERN = re.compile(r'(?:\[-?\d+,-?\d+\])*')
+MOVE_TOKEN_PATTERN = re.compile(r'\[m\(\s*([+-]?\d+)\s*,\s*([+-]?\d+)\s*\)\]')
+
+EVENT_KINDS = {'m': EVENT_MOVE, 'c(l)': EVENT_LEFT_CLICK, 'c(r)': EVENT_RIGHT_CLICK, 'c(m)': EVENT_MIDDLE_CLICK}
+
+EMPTY_INTS = np.array([], dtype=np.int64)
+EMPTY_FLOATS = np.array([], dtype=np.float64)
+
+def event_kind_of(token):
+    kind = EVENT_KINDS.get(token)
+    if kind is not None:
+        return kind
+    if token.startswith('m('):
+        return EVENT_MOVE
+    if token.startswith('s'):
+        return EVENT_SCROLL
+    return EVENT_OTHER
+
+def decode_event_kinds(total_behaviour):
+    """Returns one event kind per total_behaviour entry."""
+    if not isinstance(total_behaviour, str):
+        return np.fromiter((event_kind_of(token) for token in total_behaviour), dtype=np.int8, count=len(total_behaviour))
+
+    # Classify every '[..]' entry from the bytes that follow its opening bracket, without splitting the string
+    raw = np.frombuffer(total_behaviour.encode('utf-8') + b'\0' * 5, dtype=np.uint8)
+    starts = np.flatnonzero(raw == ord('[')) + 1
+    first = raw[starts]
+    kinds = np.full(len(starts), EVENT_OTHER, dtype=np.int8)
+    kinds[first == ord('m')] = EVENT_MOVE
+    kinds[first == ord('s')] = EVENT_SCROLL
+    is_click = (first == ord('c')) & (raw[starts + 1] == ord('(')) & (raw[starts + 3] == ord(')')) & (raw[starts + 4] == ord(']'))
+    button = raw[starts + 2]
+    kinds[is_click & (button == ord('l'))] = EVENT_LEFT_CLICK
+    kinds[is_click & (button == ord('r'))] = EVENT_RIGHT_CLICK
+    kinds[is_click & (button == ord('m'))] = EVENT_MIDDLE_CLICK
+    return kinds
+
+def decode_times(mousemove_times):
+    """Decodes move times, skipping entries that are not plain non-negative numbers."""
+    if not isinstance(mousemove_times, str):
+        if len(mousemove_times) == 0:
+            return EMPTY_FLOATS
+        if not isinstance(mousemove_times[0], str):
+            # Phase 2 stores times as JSON numbers
+            return np.asarray(mousemove_times, dtype=np.float64)
+        # Each item must be exactly one time, so an item with an embedded comma is skipped rather than split
+        matches = map(TIME_TOKEN_PATTERN.fullmatch, mousemove_times)
+        values = [match.group(1) for match in matches if match]
+    elif WELL_FORMED_TIMES_PATTERN.fullmatch(mousemove_times):
+        return np.fromstring(mousemove_times, dtype=np.float64, sep=',')
+    else:
+        values = TIME_PATTERN.findall(mousemove_times)
+    return np.array(values, dtype=np.float64) if values else EMPTY_FLOATS
+
+def decode_coords(mousemove_total_behaviour):
+    """Decodes move coordinates into (x, y) integer arrays, skipping malformed entries."""
+    if isinstance(mousemove_total_behaviour, str):
+        if WELL_FORMED_COORDS_PATTERN.fullmatch(mousemove_total_behaviour):
+            xy = np.fromstring(mousemove_total_behaviour[1:-1].replace('][', ','), dtype=np.int64, sep=',').reshape(-1, 2)
+            return xy[:, 0], xy[:, 1]
+        pairs = COORD_STRING_PATTERN.findall(mousemove_total_behaviour)
+    else:
+        if len(mousemove_total_behaviour) == 0:
+            return EMPTY_INTS, EMPTY_INTS
+        if not isinstance(mousemove_total_behaviour[0], str):
+            # Phase 2 stores coordinates as [x, y] pairs
+            xy = np.asarray(mousemove_total_behaviour, dtype=np.int64).reshape(-1, 2)
+            return xy[:, 0], xy[:, 1]
+        matches = map(COORD_LIST_PATTERN.fullmatch, mousemove_total_behaviour)
+        pairs = [match.groups() for match in matches if match]
+    if not pairs:
+        return EMPTY_INTS, EMPTY_INTS
+    xy = np.array(pairs, dtype=np.int64)
+    return xy[:, 0], xy[:, 1]
+
+def decode_mouse_events(mouse_data):
+    """
+    Decodes a mouse movement document (any of the supported formats) into a MouseEvents of typed arrays.
+    Move coordinates come from mousemove_total_behaviour, or from the m(x,y) entries of a packed
+    total_behaviour string when the separate field is absent.
+    """
+    total_behaviour = mouse_data.get('total_behaviour', [])
+    event_kind = decode_event_kinds(total_behaviour)
+
+    mousemove_total_behaviour = mouse_data.get('mousemove_total_behaviour')
+    if mousemove_total_behaviour:
+        x, y = decode_coords(mousemove_total_behaviour)
+    elif isinstance(total_behaviour, str):
+        pairs = MOVE_TOKEN_PATTERN.findall(total_behaviour)
+        xy = np.array(pairs, dtype=np.int64) if pairs else np.empty((0, 2), dtype=np.int64)
+        x, y = xy[:, 0], xy[:, 1]
+    else:
+        x, y = EMPTY_INTS, EMPTY_INTS
+
+    mousemove_times = mouse_data.get('mousemove_times')
+    t = decode_times(mousemove_times) if mousemove_times else EMPTY_FLOATS
+
+    return MouseEvents(event_kind=event_kind, x=x, y=y, t=t)
@@ -0,0 +1,199 @@
+# bot-detector/scripts/distill.py
+
+import os
+import json
+import time
+import pickle
+import argparse
+import itertools
+from datetime import datetime
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, f1_score
+from xgboost import XGBClassifier
+from client import load_partition_splits, feature_cache_key
+from features import ALL_FEATURES
+from evaluate_global_model import model_feature_names
+
+# Distills a trained serving model into smaller students. Every student is an XGBClassifier fitted on the
+# teacher's soft labels: each training row is repeated once per class with that class as label and the
+# teacher's probability for it as sample weight, which is cross-entropy against the teacher's distribution.
+# Students vary the number of trees, their depth and how many of the teacher's most important features they
+# read. Each is scored on the held-out test split and timed the way app.py calls it.
+#
+#   PYTHONPATH=. python scripts/distill.py --teacher model/global_model.joblib
+#   BOT_MODEL_PATH=model/student_model.joblib python app.py
+
+# --- Configuration ---
+TEACHER_PATH = 'model/global_model.joblib'
+STUDENT_OUTPUT_PATH = 'model/student_model.joblib'
+RESULTS_DIR = 'results'
+TRAINING_CLIENT_IDS = ['client_1', 'client_2', 'client_3']
+CACHE_FILENAME = "distill_features_{}.pkl"
+RANDOM_STATE = 42
+
+STUDENT_GRID = {
+    'n_estimators': [10, 25, 50, 100],
+    'max_depth': [2, 3, 4, 5],
+    'top_k_features': [5, 8, None], # None: every teacher feature
+}
+MAX_F1_DROP = 0.01      # The saved student is the fastest one within this macro-F1 of the teacher
+LATENCY_REPEATS = 200   # Single-row predictions timed per model
+BATCH_ROWS = 1000       # Rows per timed batch prediction
+MIN_SOFT_LABEL_WEIGHT = 1e-6 # Floor on soft-label weights, so every teacher class keeps its rows in each student
+
+# --- Data ---
+
+def load_distillation_data(refresh=False):
+    """
+    Returns (X_train, X_test, y_test) for the training clients, reading each client's train and test splits in
+    one pass. The extracted matrices are cached under RESULTS_DIR with the same key as the evaluation cache
+    (see client.feature_cache_key), so they are rebuilt when the partitions, the data or the feature code change.
+    """
+    cache_path = os.path.join(RESULTS_DIR, CACHE_FILENAME.format('_'.join(TRAINING_CLIENT_IDS)))
+    cache_key = feature_cache_key(ALL_FEATURES, TRAINING_CLIENT_IDS)
+    if not refresh and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('key') == cache_key:
+            print(f"Loaded cached features from {cache_path} ({len(cached['X_train'])} train, {len(cached['y_test'])} test sessions).")
+            return cached['X_train'], cached['X_test'], cached['y_test']
+        print(f"Cached features in {cache_path} are out of date, re-extracting.")
+
+    X_train_list, X_test_list, y_test_list = [], [], []
+    for client_id in TRAINING_CLIENT_IDS:
+        splits = load_partition_splits(client_id, ['train', 'test'], ALL_FEATURES)
+        X_client, _, _, _ = splits['train']
+        if not X_client.empty:
+            X_train_list.append(X_client)
+        X_client, y_client, _, _ = splits['test']
+        if not X_client.empty:
+            X_test_list.append(X_client)
+            y_test_list.append(y_client)
+    X_train = pd.concat(X_train_list, ignore_index=True).fillna(0)
+    X_test = pd.concat(X_test_list, ignore_index=True).fillna(0)
+    y_test = pd.concat(y_test_list, ignore_index=True)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(cache_path, 'wb') as f:
+        pickle.dump({'key': cache_key, 'X_train': X_train, 'X_test': X_test, 'y_test': y_test}, f)
+    print(f"Cached features to {cache_path}.")
+    return X_train, X_test, y_test
+
+def feature_ranking(teacher, feature_names):
+    """The teacher's features, most important first (in their original order if it reports no importances)."""
+    importances = getattr(teacher, 'feature_importances_', None)
+    if importances is None:
+        return list(feature_names)
+    return [feature_names[i] for i in np.argsort(-np.asarray(importances), kind='stable')]
+
+# --- Students ---
+
+def fit_student(X_train, soft_labels, n_estimators, max_depth):
+    """
+    Fits a student on the teacher's soft labels. Every (row, class) pair is kept, with zero probabilities
+    clipped to MIN_SOFT_LABEL_WEIGHT: dropping them could remove every row of a class the teacher never
+    predicts, leaving the student with fewer classes and predict_proba columns out of line with the teacher's.
+    """
+    num_rows, num_classes = soft_labels.shape
+    X_repeated = pd.concat([X_train] * num_classes, ignore_index=True)
+    labels = np.repeat(np.arange(num_classes), num_rows)
+    weights = np.maximum(soft_labels.T.reshape(-1), MIN_SOFT_LABEL_WEIGHT)
+    student = XGBClassifier(n_estimators=n_estimators, max_depth=max_depth, learning_rate=0.3 if n_estimators < 50 else 0.1,
+                            eval_metric='mlogloss', random_state=RANDOM_STATE, n_jobs=1)
+    student.fit(X_repeated, labels, sample_weight=weights)
+    return student
+
+def measure_latency(model, X):
+    """Returns (p50 ms for one row called like app.py, microseconds per row in a BATCH_ROWS batch)."""
+    row = [X.iloc[0].tolist()]
+    timings = []
+    for _ in range(LATENCY_REPEATS):
+        start = time.perf_counter()
+        model.predict_proba(row)
+        timings.append((time.perf_counter() - start) * 1000)
+    batch = X.iloc[np.arange(BATCH_ROWS) % len(X)].to_numpy()
+    start = time.perf_counter()
+    model.predict_proba(batch)
+    return float(np.percentile(timings, 50)), (time.perf_counter() - start) * 1e6 / BATCH_ROWS
+
+def score(name, model, X_eval, y_eval, teacher_predictions, config):
+    predictions = model.predict(X_eval.to_numpy())
+    single_row_ms, batch_us_per_row = measure_latency(model, X_eval)
+    return {
+        'model': name,
+        **config,
+        'accuracy': accuracy_score(y_eval, predictions),
+        'f1_macro': f1_score(y_eval, predictions, average='macro', zero_division=0),
+        'teacher_agreement': float(np.mean(predictions == teacher_predictions)),
+        'single_row_ms': single_row_ms,
+        'batch_us_per_row': batch_us_per_row,
+        'model_kb': len(pickle.dumps(model)) / 1024,
+    }
+
+def pareto_front(rows):
+    """Flags the models no other model beats on both macro F1 and single-row latency."""
+    for row in rows:
+        row['pareto'] = not any(
+            other['f1_macro'] >= row['f1_macro'] and other['single_row_ms'] <= row['single_row_ms'] and
+            (other['f1_macro'] > row['f1_macro'] or other['single_row_ms'] < row['single_row_ms'])
+            for other in rows)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill a serving model into smaller, faster students.")
+    parser.add_argument('--teacher', default=TEACHER_PATH, help="Trained model to distill")
+    parser.add_argument('--output', default=STUDENT_OUTPUT_PATH, help="Where the chosen student is saved")
+    parser.add_argument('--max-f1-drop', type=float, default=MAX_F1_DROP, help="Largest macro-F1 loss accepted for the saved student")
+    parser.add_argument('--refresh', action='store_true', help="Re-extract the cached train and test features")
+    args = parser.parse_args()
+
+    teacher = joblib.load(args.teacher)
+    teacher_features = model_feature_names(teacher)
+    print(f"✅ Loaded teacher {type(teacher).__name__} from {args.teacher} ({len(teacher_features)} features).")
+
+    X_train, X_eval, y_eval = load_distillation_data(args.refresh)
+    X_train = X_train.reindex(columns=teacher_features, fill_value=0)
+    X_eval = X_eval.reindex(columns=teacher_features, fill_value=0)
+    y_eval = y_eval.to_numpy()
+
+    soft_labels = teacher.predict_proba(X_train.to_numpy())
+    teacher_predictions = teacher.predict(X_eval.to_numpy())
+    rows = [score('teacher', teacher, X_eval, y_eval, teacher_predictions, {
+        'n_estimators': getattr(teacher, 'n_estimators', None), 'max_depth': getattr(teacher, 'max_depth', None),
+        'top_k_features': len(teacher_features)})]
+    ranking = feature_ranking(teacher, teacher_features)
+
+    students = {}
+    for n_estimators, max_depth, top_k in itertools.product(*STUDENT_GRID.values()):
+        features = ranking[:top_k] if top_k else ranking
+        name = f"student_t{n_estimators}_d{max_depth}_k{len(features)}"
+        if name in students:
+            continue
+        students[name] = fit_student(X_train[features], soft_labels, n_estimators, max_depth)
+        rows.append(score(name, students[name], X_eval[features], y_eval, teacher_predictions,
+                          {'n_estimators': n_estimators, 'max_depth': max_depth, 'top_k_features': len(features)}))
+    print(f"✅ Fitted {len(students)} students on {len(X_train)} sessions of teacher soft labels.")
+
+    table = pd.DataFrame(pareto_front(rows)).sort_values(['f1_macro', 'single_row_ms'], ascending=[False, True])
+    print("\nAccuracy vs. latency (test split):")
+    print(table.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+
+    teacher_f1 = rows[0]['f1_macro']
+    candidates = [row for row in rows[1:] if row['f1_macro'] >= teacher_f1 - args.max_f1_drop]
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    table_path = os.path.join(RESULTS_DIR, f"distill_{timestamp}.csv")
+    table.to_csv(table_path, index=False)
+    if not candidates:
+        print(f"\n⚠️ No student is within {args.max_f1_drop} macro F1 of the teacher ({teacher_f1:.4f}); nothing saved.")
+    else:
+        chosen = min(candidates, key=lambda row: row['single_row_ms'])
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        joblib.dump(students[chosen['model']], args.output)
+        with open(os.path.join(RESULTS_DIR, f"distill_{timestamp}.json"), 'w') as f:
+            json.dump({'teacher': args.teacher, 'student': args.output, 'chosen': chosen}, f, indent=2, default=float)
+        print(f"\n🏆 Saved {chosen['model']} to {args.output}: macro F1 {chosen['f1_macro']:.4f} (teacher {teacher_f1:.4f}), "
+              f"{chosen['single_row_ms']:.3f} ms/request (teacher {rows[0]['single_row_ms']:.3f} ms).")
+        print(f"Serve it with BOT_MODEL_PATH={args.output}")
+    print(f"Results saved to {table_path}")
@@ -1,22 +1,47 @@
 import os
+import re
+import json
+import bisect
+import hashlib
+import argparse
 import pandas as pd
-import random
 import shutil
 import glob
+from concurrent.futures import ProcessPoolExecutor
 
 # --- Configuration ---
 NUM_CLIENTS = 3
+# Sessions are placed on a consistent-hash ring, so going from N to N+1 clients only moves
+# about 1/(N+1) of them. Optional weights scale a client's share of the ring (default 1.0).
+CLIENT_WEIGHTS = {} # e.g. {'client_1': 2.0}
+VIRTUAL_NODES_PER_CLIENT = 200
 BASE_PATH = 'dataset/phase1/'
 OUTPUT_PATH = 'dataset/partition/'
+# Manifest mode: per-client session lists and log byte ranges over the shared BASE_PATH tree
+MANIFEST_PATH = 'dataset/partition_manifest.json'
 SCENARIOS = ['humans_and_moderate_bots', 'humans_and_advanced_bots']
 
-def create_client_directories():
+LOG_SPLIT_WORKERS = os.cpu_count() or 1 # Log files are split in parallel, one file per worker
+LOG_WRITE_BUFFER_BYTES = 1 << 20
+
+# Session ids appear either as a PHPSESSID cookie or, in the phase1 logs, as the bare
+# field between the referer and the user agent.
+PHPSESSID_PATTERN = re.compile(r'PHPSESSID=([^";\s]+)')
+LOG_SESSION_FIELD_PATTERN = re.compile(r'^\S+ \S+ \[[^\]]*\] "[^"]*" \d+ \S+ "[^"]*" (\S+) "')
+
+def get_client_ids():
+    return [f"client_{i+1}" for i in range(NUM_CLIENTS)]
+
+
+def create_client_directories(wipe=True):
     """Creates the full, replicated directory structure for each client."""
-    if os.path.exists(OUTPUT_PATH):
+    if wipe and os.path.exists(OUTPUT_PATH):
         shutil.rmtree(OUTPUT_PATH)
+    # A physical split replaces any virtual partitioning; loaders prefer the manifest when it exists
+    if os.path.exists(MANIFEST_PATH):
+        os.remove(MANIFEST_PATH)
     
-    for i in range(NUM_CLIENTS):
-        client_id = f"client_{i+1}"
+    for client_id in get_client_ids():
         # Create all necessary subdirectories to mirror the original structure
         os.makedirs(os.path.join(OUTPUT_PATH, client_id, 'phase1/annotations/humans_and_moderate_bots'), exist_ok=True)
         os.makedirs(os.path.join(OUTPUT_PATH, client_id, 'phase1/annotations/humans_and_advanced_bots'), exist_ok=True)
@@ -27,10 +52,307 @@ def create_client_directories():
     print("✅ Replicated directory structure created for all clients.")
 
 
-def split_data_with_replication():
+def extract_session_id(line):
+    """Returns the session id a web log line belongs to, or None if the line has none."""
+    match = PHPSESSID_PATTERN.search(line)
+    if match:
+        return match.group(1)
+    match = LOG_SESSION_FIELD_PATTERN.match(line)
+    if match and match.group(1) != '-':
+        return match.group(1)
+    return None
+
+
+def split_log_file(log_file_path, session_to_client):
+    """
+    Splits one web log file across clients in a single pass.
+    Each line's session id is extracted once and looked up in session_to_client; matching lines
+    go through a buffered per-client handle that stays open for the whole file.
+    """
+    log_filename = os.path.basename(log_file_path)
+    subfolder = os.path.basename(os.path.dirname(log_file_path)) # 'bots' or 'humans'
+    client_handles = {}
+    lines_written = 0
+    try:
+        with open(log_file_path, 'r') as f:
+            for line in f:
+                client_id = session_to_client.get(extract_session_id(line))
+                if client_id is None:
+                    continue
+                handle = client_handles.get(client_id)
+                if handle is None:
+                    dest_log_path = os.path.join(OUTPUT_PATH, client_id, 'phase1/data/web_logs', subfolder, log_filename)
+                    handle = open(dest_log_path, 'a', buffering=LOG_WRITE_BUFFER_BYTES)
+                    client_handles[client_id] = handle
+                handle.write(line)
+                lines_written += 1
+    finally:
+        for handle in client_handles.values():
+            handle.close()
+    return log_filename, lines_written
+
+
+def load_scenario_annotations(scenario):
+    """Loads the train and test annotations of one scenario as (train_df, test_df)."""
+    annotations_path = os.path.join(BASE_PATH, 'annotations', scenario)
+    train_df = pd.read_csv(os.path.join(annotations_path, 'train'), sep=' ', header=None, names=['session_id', 'label'])
+    test_df = pd.read_csv(os.path.join(annotations_path, 'test'), sep=' ', header=None, names=['session_id', 'label'])
+    return train_df, test_df
+
+
+def stable_hash(key):
+    """64-bit hash that is identical across runs and machines (unlike the built-in hash())."""
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+def build_hash_ring(client_ids, weights=None):
+    """Returns the sorted ring positions and their owning clients, with virtual nodes scaled by weight."""
+    weights = weights or {}
+    ring = []
+    for client_id in client_ids:
+        num_virtual_nodes = max(1, int(round(VIRTUAL_NODES_PER_CLIENT * weights.get(client_id, 1.0))))
+        for v in range(num_virtual_nodes):
+            ring.append((stable_hash(f"{client_id}#{v}"), client_id))
+    ring.sort()
+    return [position for position, _ in ring], [client_id for _, client_id in ring]
+
+
+def assign_sessions(sessions, client_ids=None, weights=None):
+    """Deterministically assigns each session to the first client clockwise of it on the hash ring."""
+    positions, owners = build_hash_ring(client_ids or get_client_ids(), CLIENT_WEIGHTS if weights is None else weights)
+    session_to_client = {}
+    for session_id in sessions:
+        idx = bisect.bisect(positions, stable_hash(session_id)) % len(positions)
+        session_to_client[session_id] = owners[idx]
+    return session_to_client
+
+
+def load_existing_assignment():
+    """
+    Reconstructs the current physical partitioning (scenario -> {session_id: client_id}) from the
+    annotation files under OUTPUT_PATH. Returns None when there is no partition to update.
+    """
+    if not os.path.isdir(OUTPUT_PATH):
+        return None
+    assignment = {scenario: {} for scenario in SCENARIOS}
+    found_any = False
+    for client_id in sorted(os.listdir(OUTPUT_PATH)):
+        for scenario in SCENARIOS:
+            for split_type in ['train', 'test']:
+                annotation_file = os.path.join(OUTPUT_PATH, client_id, 'phase1/annotations', scenario, split_type)
+                if not os.path.exists(annotation_file):
+                    continue
+                with open(annotation_file, 'r') as f:
+                    for line in f:
+                        session_id = line.strip().split(' ')[0]
+                        if session_id:
+                            assignment[scenario][session_id] = client_id
+                            found_any = True
+    return assignment if found_any else None
+
+
+def write_annotation_splits(scenario, session_to_client, client_ids):
+    """(Re)writes every client's train/test annotation files for one scenario from the assignment."""
+    annotations_path = os.path.join(BASE_PATH, 'annotations', scenario)
+    for split_type in ['train', 'test']:
+        client_lines = {client_id: [] for client_id in client_ids}
+        with open(os.path.join(annotations_path, split_type), 'r') as f:
+            for line in f:
+                session_id = line.strip().split(' ')[0]
+                if session_id in session_to_client:
+                    client_lines[session_to_client[session_id]].append(line)
+        for client_id, lines in client_lines.items():
+            dest_file = os.path.join(OUTPUT_PATH, client_id, 'phase1/annotations', scenario, split_type)
+            if lines:
+                with open(dest_file, 'w') as df:
+                    df.writelines(lines)
+            elif os.path.exists(dest_file):
+                # Loaders skip missing split files but cannot parse empty ones
+                os.remove(dest_file)
+
+
+def remove_sessions_from_client_logs(client_id, session_ids):
+    """Drops the lines of the given sessions from a client's partition log files, in place."""
+    web_log_root = os.path.join(OUTPUT_PATH, client_id, 'phase1/data/web_logs')
+    for log_file_path in glob.glob(os.path.join(web_log_root, '**', '*.log'), recursive=True):
+        tmp_path = log_file_path + '.tmp'
+        with open(log_file_path, 'r') as src, open(tmp_path, 'w', buffering=LOG_WRITE_BUFFER_BYTES) as dst:
+            for line in src:
+                if extract_session_id(line) not in session_ids:
+                    dst.write(line)
+        os.replace(tmp_path, log_file_path)
+
+
+def split_logs_in_parallel(session_to_client):
+    """Appends each source log line owned by a session in session_to_client to that client's copy."""
+    source_log_files = glob.glob(os.path.join(BASE_PATH, 'data/web_logs', '**', '*.log'), recursive=True)
+    # Every source file writes to its own set of destination files, so files can be split in parallel
+    num_workers = max(1, min(LOG_SPLIT_WORKERS, len(source_log_files)))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(split_log_file, path, session_to_client) for path in source_log_files]
+        for future in futures:
+            log_filename, lines_written = future.result()
+            print(f"Processed log file: {log_filename} ({lines_written} lines assigned to clients)")
+
+
+def build_log_ranges(log_file_path, session_to_client):
+    """
+    Scans one web log file and returns, per client, the byte ranges [start, end) of the lines it owns.
+    Consecutive lines of the same client are merged into one range, so the session-sorted runs
+    the logs already contain collapse to a handful of ranges per session.
+    """
+    client_ranges = {}
+    last_client_id = None
+    offset = 0
+    with open(log_file_path, 'rb') as f:
+        for raw_line in f:
+            line_start = offset
+            offset += len(raw_line)
+            client_id = session_to_client.get(extract_session_id(raw_line.decode('utf-8', errors='replace')))
+            if client_id is None:
+                last_client_id = None
+                continue
+            ranges = client_ranges.setdefault(client_id, [])
+            if client_id == last_client_id and ranges and ranges[-1][1] == line_start:
+                ranges[-1][1] = offset
+            else:
+                ranges.append([line_start, offset])
+            last_client_id = client_id
+    return client_ranges
+
+
+def write_partition_manifest():
+    """
+    Creates a virtual partitioning: instead of copying data into dataset/partition/, writes a manifest
+    with each client's annotation rows, mouse-movement session ids and web log byte ranges.
+    Loaders read the shared BASE_PATH tree through it, so a new partitioning costs a few kilobytes.
+    """
+    clients = {}
+    for client_id in get_client_ids():
+        clients[client_id] = {'annotations': {}, 'mouse_movements': {}, 'web_logs': {}}
+
+    master_session_to_client = {}
+    for scenario in SCENARIOS:
+        train_df, test_df = load_scenario_annotations(scenario)
+        all_annotations = pd.concat([train_df, test_df], ignore_index=True)
+        scenario_session_to_client = assign_sessions(all_annotations['session_id'].tolist())
+        master_session_to_client.update(scenario_session_to_client)
+
+        for client in clients.values():
+            client['annotations'][scenario] = {'train': [], 'test': []}
+            client['mouse_movements'][scenario] = []
+        for split_type, split_df in [('train', train_df), ('test', test_df)]:
+            for session_id, label in zip(split_df['session_id'], split_df['label']):
+                client_id = scenario_session_to_client[session_id]
+                clients[client_id]['annotations'][scenario][split_type].append([session_id, label])
+
+        source_mouse_path = os.path.join(BASE_PATH, 'data/mouse_movements', scenario)
+        for session_id, client_id in scenario_session_to_client.items():
+            if os.path.exists(os.path.join(source_mouse_path, session_id)):
+                clients[client_id]['mouse_movements'][scenario].append(session_id)
+        print(f"Assigned {len(scenario_session_to_client)} sessions to clients for {scenario}.")
+
+    source_log_files = glob.glob(os.path.join(BASE_PATH, 'data/web_logs', '**', '*.log'), recursive=True)
+    num_workers = max(1, min(LOG_SPLIT_WORKERS, len(source_log_files)))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {path: executor.submit(build_log_ranges, path, master_session_to_client) for path in source_log_files}
+        for path, future in futures.items():
+            relative_log_path = os.path.relpath(path, os.path.join(BASE_PATH, 'data/web_logs')).replace(os.sep, '/')
+            for client_id, ranges in future.result().items():
+                clients[client_id]['web_logs'][relative_log_path] = ranges
+    print(f"Indexed {len(source_log_files)} web log files.")
+
+    manifest = {'base_path': BASE_PATH, 'num_clients': NUM_CLIENTS, 'clients': clients}
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f)
+    print(f"✅ Partition manifest written to {MANIFEST_PATH} ({os.path.getsize(MANIFEST_PATH)} bytes).")
+
+
+def apply_assignment_difference(previous_assignment):
+    """
+    Updates an existing physical partition in place to match the current hash-ring assignment.
+    Only sessions whose owner changed are touched: their mouse-movement folders are moved between
+    clients, their log lines are removed from the old owner and appended to the new one, and
+    clients that are no longer part of the ring are deleted at the end.
+    """
+    client_ids = get_client_ids()
+    create_client_directories(wipe=False)
+
+    old_master_session_to_client = {}
+    new_master_session_to_client = {}
+    total_sessions = 0
+    total_moved = 0
+
+    for scenario in SCENARIOS:
+        print(f"\n--- Updating scenario: {scenario} ---")
+        train_df, test_df = load_scenario_annotations(scenario)
+        all_annotations = pd.concat([train_df, test_df], ignore_index=True)
+        new_assignment = assign_sessions(all_annotations['session_id'].tolist())
+        old_assignment = previous_assignment.get(scenario, {})
+        old_master_session_to_client.update(old_assignment)
+        new_master_session_to_client.update(new_assignment)
+
+        write_annotation_splits(scenario, new_assignment, client_ids)
+
+        source_mouse_path = os.path.join(BASE_PATH, 'data/mouse_movements', scenario)
+        moved = 0
+        for session_id, client_id in new_assignment.items():
+            old_client_id = old_assignment.get(session_id)
+            if old_client_id == client_id:
+                continue
+            dest_folder = os.path.join(OUTPUT_PATH, client_id, 'phase1/data/mouse_movements', scenario, session_id)
+            old_folder = os.path.join(OUTPUT_PATH, old_client_id, 'phase1/data/mouse_movements', scenario, session_id) if old_client_id else None
+            if os.path.exists(dest_folder):
+                shutil.rmtree(dest_folder)
+            if old_folder and os.path.exists(old_folder):
+                shutil.move(old_folder, dest_folder)
+            elif os.path.exists(os.path.join(source_mouse_path, session_id)):
+                shutil.copytree(os.path.join(source_mouse_path, session_id), dest_folder)
+            moved += 1
+        for session_id, old_client_id in old_assignment.items():
+            if session_id not in new_assignment:
+                shutil.rmtree(os.path.join(OUTPUT_PATH, old_client_id, 'phase1/data/mouse_movements', scenario, session_id), ignore_errors=True)
+
+        total_sessions += len(new_assignment)
+        total_moved += moved
+        print(f"Moved {moved} of {len(new_assignment)} sessions to a new client.")
+
+    # Web logs follow the cross-scenario (master) assignment, as in a full split
+    lost_sessions = {}
+    gained_session_to_client = {}
+    for session_id, old_client_id in old_master_session_to_client.items():
+        if new_master_session_to_client.get(session_id) != old_client_id:
+            lost_sessions.setdefault(old_client_id, set()).add(session_id)
+    for session_id, client_id in new_master_session_to_client.items():
+        if old_master_session_to_client.get(session_id) != client_id:
+            gained_session_to_client[session_id] = client_id
+
+    print("\n--- Updating Web Logs ---")
+    for client_id, session_ids in lost_sessions.items():
+        if client_id in client_ids:
+            remove_sessions_from_client_logs(client_id, session_ids)
+    if gained_session_to_client:
+        split_logs_in_parallel(gained_session_to_client)
+
+    for client_id in os.listdir(OUTPUT_PATH):
+        if client_id not in client_ids and os.path.isdir(os.path.join(OUTPUT_PATH, client_id)):
+            shutil.rmtree(os.path.join(OUTPUT_PATH, client_id))
+            print(f"Removed partition for {client_id}, which is no longer part of the split.")
+
+    print(f"\n🎉 Partition updated: {total_moved} of {total_sessions} scenario sessions changed client.")
+
+
+def split_data_with_replication(rebuild=False):
     """
     Splits all data and replicates the source folder structure for each client.
+    An existing partition is updated in place (only reassigned sessions move) unless rebuild is set.
     """
+    previous_assignment = None if rebuild else load_existing_assignment()
+    if previous_assignment is not None:
+        apply_assignment_difference(previous_assignment)
+        return
+
     create_client_directories()
     
     # This will hold all session assignments across all scenarios
@@ -41,33 +363,15 @@ def split_data_with_replication():
         print(f"\n--- Processing scenario: {scenario} ---")
         
         # 1. Assign sessions for the current scenario
-        annotations_path = os.path.join(BASE_PATH, 'annotations', scenario)
-        train_df = pd.read_csv(os.path.join(annotations_path, 'train'), sep=' ', header=None, names=['session_id', 'label'])
-        test_df = pd.read_csv(os.path.join(annotations_path, 'test'), sep=' ', header=None, names=['session_id', 'label'])
+        train_df, test_df = load_scenario_annotations(scenario)
         all_annotations = pd.concat([train_df, test_df], ignore_index=True)
-        
-        sessions = all_annotations['session_id'].tolist()
-        random.shuffle(sessions)
-        
-        scenario_session_to_client = {}
-        for i, session_id in enumerate(sessions):
-            client_id = f"client_{(i % NUM_CLIENTS) + 1}"
-            scenario_session_to_client[session_id] = client_id
-        
+
+        scenario_session_to_client = assign_sessions(all_annotations['session_id'].tolist())
         master_session_to_client.update(scenario_session_to_client)
-        print(f"Assigned {len(sessions)} sessions to clients for this scenario.")
+        print(f"Assigned {len(scenario_session_to_client)} sessions to clients for this scenario.")
 
         # 2. Split ANNOTATION files
-        for split_type in ['train', 'test']:
-            source_file = os.path.join(annotations_path, split_type)
-            with open(source_file, 'r') as f:
-                for line in f:
-                    session_id = line.strip().split(' ')[0]
-                    if session_id in scenario_session_to_client:
-                        client_id = scenario_session_to_client[session_id]
-                        dest_file = os.path.join(OUTPUT_PATH, client_id, 'phase1/annotations', scenario, split_type)
-                        with open(dest_file, 'a') as df:
-                            df.write(line)
+        write_annotation_splits(scenario, scenario_session_to_client, get_client_ids())
         print(f"Split annotation files for {scenario}.")
 
         # 3. Split MOUSE MOVEMENT data
@@ -81,24 +385,20 @@ def split_data_with_replication():
 
     # 4. Split WEB LOGS (This is a global operation)
     print("\n--- Processing all Web Logs ---")
-    source_log_files = glob.glob(os.path.join(BASE_PATH, 'data/web_logs', '**', '*.log'), recursive=True)
-    
-    for log_file_path in source_log_files:
-        log_filename = os.path.basename(log_file_path)
-        subfolder = os.path.basename(os.path.dirname(log_file_path)) # 'bots' or 'humans'
-        print(f"Processing log file: {log_filename}")
-
-        with open(log_file_path, 'r') as f:
-            for line in f:
-                for session_id, client_id in master_session_to_client.items():
-                    if session_id in line:
-                        dest_log_path = os.path.join(OUTPUT_PATH, client_id, 'phase1/data/web_logs', subfolder, log_filename)
-                        with open(dest_log_path, 'a') as df:
-                            df.write(line)
-                        break
+    split_logs_in_parallel(master_session_to_client)
     print("✅ Web Logs split complete.")
     print("\n🎉 All data has been successfully split with replicated structure!")
 
 
 if __name__ == "__main__":
-    split_data_with_replication()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Split dataset/phase1 across federated clients.")
+    parser.add_argument('--clients', type=int, default=NUM_CLIENTS, help="Number of clients to split across")
+    parser.add_argument('--manifest', action='store_true', help="Write a virtual partition manifest instead of copying data")
+    parser.add_argument('--rebuild', action='store_true', help="Wipe and rebuild dataset/partition/ instead of updating it in place")
+    args = parser.parse_args()
+
+    NUM_CLIENTS = args.clients
+    if args.manifest:
+        write_partition_manifest()
+    else:
+        split_data_with_replication(rebuild=args.rebuild)
\ No newline at end of file
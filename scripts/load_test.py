@@ -0,0 +1,326 @@
+# bot-detector/scripts/load_test.py
+
+import os
+import sys
+import json
+import time
+import random
+import gzip
+import base64
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+
+# --- Configuration ---
+DEFAULT_BASE_URL = 'http://localhost:5000'
+DETECT_ENDPOINT = '/api/detect'
+SAMPLE_DATA_ENDPOINT = '/api/sample-data'
+RESULTS_DIR = 'results'
+
+REQUEST_TIMEOUT = 10.0 # Seconds before a request counts as an error
+LATENCY_PERCENTILES = [50, 95, 99, 99.9]
+
+# A load level is considered saturated when the server can no longer keep up with it
+SATURATION_THROUGHPUT_RATIO = 0.9 # Achieved / offered rate below this means saturated
+SATURATION_ERROR_RATE = 0.01
+SATURATION_P99_SECONDS = 1.0
+
+MOUSE_FIELDS = ['total_behaviour', 'mousemove_times', 'mousemove_total_behaviour']
+
+# Request body encodings: plain JSON, mouse data as a base64 compact payload (mouse_codec.py), and the latter gzipped
+BODY_ENCODINGS = ['json', 'compact', 'compact-gzip']
+REQUEST_HEADERS = {'Content-Type': 'application/json'}
+
+# --- Payload Sources ---
+
+def payload_from_record(record):
+    """Turns one JSON record into an /api/detect request body.
+    Records that already have the request shape are used as-is; raw session records
+    (phase1/phase2 mouse movement documents) are wrapped into 'mouse_movements'."""
+    if 'mouse_movements' in record or 'web_logs' in record:
+        return record
+    return {
+        'mouse_movements': {field: record[field] for field in MOUSE_FIELDS if field in record},
+        'web_logs': record.get('web_logs', [])
+    }
+
+def load_jsonl_payloads(path):
+    """Reads request bodies from a JSON-lines file such as requests.jsonl."""
+    payloads = []
+    with open(path, 'r') as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                payloads.append(payload_from_record(json.loads(line)))
+            except json.JSONDecodeError:
+                print(f"Skipping malformed JSON on line {line_num} of {path}")
+    return payloads
+
+def fetch_sample_payload(base_url):
+    """Fetches the demo payload served by /api/sample-data."""
+    with urllib.request.urlopen(base_url + SAMPLE_DATA_ENDPOINT, timeout=REQUEST_TIMEOUT) as response:
+        return json.loads(response.read())
+
+def generate_synthetic_payload(rng, num_moves):
+    """Builds a random session in the /api/sample-data shape with num_moves mouse moves."""
+    total_behaviour = []
+    mousemove_times = []
+    mousemove_total_behaviour = []
+    x, y, t = rng.randint(0, 1920), rng.randint(0, 1080), 0.0
+    for _ in range(num_moves):
+        x = min(max(x + rng.randint(-40, 40), 0), 1920)
+        y = min(max(y + rng.randint(-40, 40), 0), 1080)
+        t += rng.uniform(0.005, 0.2)
+        total_behaviour.append('m')
+        mousemove_times.append(f"({t:.3f})")
+        mousemove_total_behaviour.append(f"({x},{y})")
+        if rng.random() < 0.05:
+            total_behaviour.append('c(l)')
+
+    session_id = f"synthetic_{rng.getrandbits(64):016x}"
+    web_logs = []
+    for i in range(rng.randint(1, 10)):
+        web_logs.append({
+            'session_id': session_id,
+            'ip_address': '127.0.0.1',
+            'timestamp_str': f"01/Jan/2024:10:{30 + i // 60:02d}:{i % 60:02d} +0000",
+            'method': rng.choice(['GET', 'GET', 'GET', 'POST']),
+            'path': f"/product/{rng.randint(1, 500)}",
+            'status_code': rng.choice([200, 200, 200, 302, 404]),
+            'bytes_sent': rng.randint(200, 5000),
+            'referer': 'https://example.com/',
+            'user_agent': 'Mozilla/5.0 (X11; Linux x86_64)'
+        })
+
+    return {
+        'mouse_movements': {
+            'total_behaviour': total_behaviour,
+            'mousemove_times': mousemove_times,
+            'mousemove_total_behaviour': mousemove_total_behaviour
+        },
+        'web_logs': web_logs
+    }
+
+def compact_payload(payload):
+    """
+    Replaces the payload's mouse_movements string lists with the compact binary encoding, base64 in JSON.
+    A payload whose points and times do not pair up is returned as is.
+    """
+    from mouse_decoder import decode_mouse_events # Repo modules are only needed for compact bodies (PYTHONPATH=.)
+    from mouse_codec import encode_mouse_events
+    events = decode_mouse_events(payload.get('mouse_movements', {}))
+    if len(events.x) != len(events.t):
+        # The compact format pairs every point with a time; sessions with malformed entries stay as string lists
+        return payload
+    payload = dict(payload)
+    del payload['mouse_movements']
+    payload['mouse_events_b64'] = base64.b64encode(encode_mouse_events(events)).decode('ascii')
+    return payload
+
+def load_payloads(source, base_url, num_synthetic=200, synthetic_moves=500, seed=42, encoding='json'):
+    """
+    Resolves a payload source to a list of encoded request bodies.
+    source is 'sample' (the /api/sample-data payload), 'synthetic', or a path to a JSON-lines file.
+    encoding is one of BODY_ENCODINGS.
+    """
+    if source == 'sample':
+        payloads = [fetch_sample_payload(base_url)]
+    elif source == 'synthetic':
+        rng = random.Random(seed)
+        payloads = [generate_synthetic_payload(rng, synthetic_moves) for _ in range(num_synthetic)]
+    else:
+        payloads = load_jsonl_payloads(source)
+
+    if not payloads:
+        raise ValueError(f"No payloads could be loaded from source '{source}'")
+    if encoding != 'json':
+        payloads = [compact_payload(p) for p in payloads]
+    # Encode once up front so the generator measures the server, not json.dumps
+    bodies = [json.dumps(p).encode('utf-8') for p in payloads]
+    if encoding == 'compact-gzip':
+        bodies = [gzip.compress(b) for b in bodies]
+    return bodies
+
+# --- Request Execution ---
+
+def send_request(url, body):
+    """Sends one POST and returns (ok, status_code)."""
+    req = urllib.request.Request(url, data=body, headers=REQUEST_HEADERS, method='POST')
+    try:
+        with urllib.request.urlopen(req, timeout=REQUEST_TIMEOUT) as response:
+            response.read()
+            return True, response.status
+    except urllib.error.HTTPError as e:
+        return False, e.code
+    except Exception:
+        return False, None
+
+def run_open_loop(url, bodies, rate, duration, max_workers=256):
+    """
+    Offers requests at a fixed arrival rate regardless of how fast the server answers.
+    Latency is measured from each request's scheduled send time, so queueing delay caused
+    by a saturated server (or a saturated generator) shows up in the tail instead of being hidden.
+    """
+    interval = 1.0 / rate
+    num_requests = max(1, int(rate * duration))
+    results = []
+    results_lock = threading.Lock()
+
+    def fire(scheduled_at, body):
+        ok, status = send_request(url, body)
+        latency = time.perf_counter() - scheduled_at
+        with results_lock:
+            results.append((latency, ok, status))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for i in range(num_requests):
+            scheduled_at = start + i * interval
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(fire, scheduled_at, bodies[i % len(bodies)])
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+def run_closed_loop(url, bodies, concurrency, duration):
+    """Keeps `concurrency` requests in flight for `duration` seconds."""
+    results = []
+    results_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_idx):
+        i = worker_idx
+        while time.perf_counter() < deadline:
+            sent_at = time.perf_counter()
+            ok, status = send_request(url, bodies[i % len(bodies)])
+            latency = time.perf_counter() - sent_at
+            with results_lock:
+                results.append((latency, ok, status))
+            i += concurrency
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(w,), daemon=True) for w in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+# --- Reporting ---
+
+def summarize_results(results, elapsed, offered_rate=None):
+    """Computes throughput, error rate and latency percentiles (in milliseconds) for one load level."""
+    num_requests = len(results)
+    latencies = np.array([r[0] for r in results]) if results else np.array([0.0])
+    num_errors = sum(1 for r in results if not r[1])
+    successes = num_requests - num_errors
+
+    summary = {
+        'offered_rate': offered_rate,
+        'requests': num_requests,
+        'errors': num_errors,
+        'error_rate': num_errors / num_requests if num_requests else 0.0,
+        'throughput': successes / elapsed if elapsed > 0 else 0.0,
+        'mean_ms': float(np.mean(latencies) * 1000)
+    }
+    for p in LATENCY_PERCENTILES:
+        summary[f"p{p}_ms"] = float(np.percentile(latencies, p) * 1000)
+    return summary
+
+def is_saturated(summary):
+    """A load level is saturated when throughput stalls, errors appear, or p99 blows past the SLO."""
+    if summary['error_rate'] > SATURATION_ERROR_RATE:
+        return True
+    if summary['p99_ms'] > SATURATION_P99_SECONDS * 1000:
+        return True
+    if summary['offered_rate'] and summary['throughput'] < SATURATION_THROUGHPUT_RATIO * summary['offered_rate']:
+        return True
+    return False
+
+def format_summary_table(summaries, level_label):
+    """Renders the per-level summaries as a fixed-width text table."""
+    percentile_cols = [f"p{p}_ms" for p in LATENCY_PERCENTILES]
+    header = f"{level_label:>10} {'reqs':>7} {'err%':>6} {'tput/s':>9} " + ' '.join(f"{c:>10}" for c in percentile_cols)
+    lines = [header, '-' * len(header)]
+    for s in summaries:
+        row = f"{s['level']:>10} {s['requests']:>7} {s['error_rate'] * 100:>6.2f} {s['throughput']:>9.1f} "
+        row += ' '.join(f"{s[c]:>10.1f}" for c in percentile_cols)
+        if s.get('saturated'):
+            row += '  <- saturated'
+        lines.append(row)
+    return '\n'.join(lines)
+
+def run_sweep(url, bodies, mode, levels, duration, stop_at_saturation=True):
+    """Runs each load level in turn and flags the first level at which the server saturates."""
+    summaries = []
+    for level in levels:
+        print(f"Running {mode} load level {level} for {duration}s...")
+        if mode == 'rate':
+            results, elapsed = run_open_loop(url, bodies, level, duration)
+            summary = summarize_results(results, elapsed, offered_rate=level)
+        else:
+            results, elapsed = run_closed_loop(url, bodies, int(level), duration)
+            summary = summarize_results(results, elapsed)
+        summary['level'] = level
+        summary['saturated'] = is_saturated(summary)
+        summaries.append(summary)
+        print(f"  throughput={summary['throughput']:.1f}/s error_rate={summary['error_rate']:.2%} "
+              f"p50={summary['p50_ms']:.1f}ms p99={summary['p99_ms']:.1f}ms")
+        if summary['saturated'] and stop_at_saturation:
+            print(f"Saturation reached at {mode} level {level}. Stopping sweep.")
+            break
+    return summaries
+
+def parse_levels(levels_str):
+    return [float(v) for v in levels_str.split(',') if v.strip()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay session payloads against /api/detect and report tail latency.")
+    parser.add_argument('--url', default=DEFAULT_BASE_URL, help="Base URL of the detection API")
+    parser.add_argument('--source', default='synthetic',
+                        help="'synthetic', 'sample' (/api/sample-data), or a path to a JSON-lines file such as requests.jsonl")
+    parser.add_argument('--mode', choices=['rate', 'concurrency'], default='rate',
+                        help="'rate' offers an open-loop request rate, 'concurrency' keeps N requests in flight")
+    parser.add_argument('--levels', default='10',
+                        help="Comma-separated load levels (requests/s or concurrency), e.g. 10,20,50,100 to sweep")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run each load level")
+    parser.add_argument('--synthetic-sessions', type=int, default=200)
+    parser.add_argument('--synthetic-moves', type=int, default=500, help="Mouse moves per synthetic session")
+    parser.add_argument('--encoding', choices=BODY_ENCODINGS, default='json',
+                        help="Request body format; compact encodings need PYTHONPATH=. for the repo's mouse codec")
+    parser.add_argument('--no-stop', action='store_true', help="Keep sweeping past the saturation point")
+    parser.add_argument('--output', help="Write the summaries as JSON to this path (default: results/load_test_<timestamp>.json)")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/')
+    try:
+        bodies = load_payloads(args.source, base_url, args.synthetic_sessions, args.synthetic_moves, encoding=args.encoding)
+    except (OSError, ValueError, urllib.error.URLError) as e:
+        print(f"Error: could not load payloads from '{args.source}': {e}")
+        sys.exit(1)
+    if args.encoding == 'compact-gzip':
+        REQUEST_HEADERS['Content-Encoding'] = 'gzip'
+    print(f"Loaded {len(bodies)} payloads (avg {np.mean([len(b) for b in bodies]):.0f} bytes, {args.encoding}) from '{args.source}'.")
+
+    summaries = run_sweep(base_url + DETECT_ENDPOINT, bodies, args.mode, parse_levels(args.levels),
+                          args.duration, stop_at_saturation=not args.no_stop)
+
+    print()
+    print(format_summary_table(summaries, 'req/s' if args.mode == 'rate' else 'conc'))
+
+    output_path = args.output
+    if not output_path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = os.path.join(RESULTS_DIR, f"load_test_{timestamp}.json")
+    with open(output_path, 'w') as f:
+        json.dump({'url': base_url, 'source': args.source, 'mode': args.mode, 'encoding': args.encoding, 'levels': summaries}, f, indent=2)
+    print(f"\nLoad test results saved to: {output_path}")
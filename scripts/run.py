@@ -3,12 +3,18 @@
 import os
 import subprocess
 import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import pickle
 import sys
 import joblib
 from sklearn.ensemble import RandomForestClassifier
 import pandas as pd
-from client import load_partition_data
+from datetime import datetime
+from client import load_partition_data, CLIENT_N_JOBS_ENV, CLIENT_CORES_ENV
+from tracing import (span, set_context as set_trace_context, load_spans, export_chrome_trace, export_round_summary,
+                     TRACE_FILE_ENV, TRACES_DIR)
+from secure_agg import SECURE_AGG_ENABLED, MASKED_UPDATE_SUFFIX
 
 # --- Configuration ---
 CLIENT_IDS = ['client_1', 'client_2', 'client_3']
@@ -18,6 +24,88 @@ GLOBAL_MODELS_DIR = 'global_models'
 
 GLOBAL_MODEL_FILENAME_PATTERN = "global_model_params_round_{}.pkl"
 
+# Each run's spans (this process, every client and the server) are collected under TRACES_DIR/fl_<timestamp>/
+TRACE_RUN_DIR = os.path.join(TRACES_DIR, f"fl_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+# --- CPU Budget ---
+# Clients share CPU_BUDGET cores. Each running client gets an equal share (at least MIN_CORES_PER_CLIENT);
+# clients beyond what the budget allows wait in a queue for a share to free up.
+def available_cores():
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+
+CPU_BUDGET = int(os.environ.get('FL_CPU_BUDGET', 0)) or len(available_cores())
+MIN_CORES_PER_CLIENT = 2
+PIN_CLIENT_CORES = os.environ.get('FL_PIN_CLIENT_CORES') == '1' # Pin each client to its cores (it calls sched_setaffinity itself)
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', CLIENT_N_JOBS_ENV]
+
+def plan_core_shares(num_clients, cpu_budget=CPU_BUDGET):
+    """Splits the budget into one disjoint core set per concurrently running client."""
+    cores = available_cores()[:cpu_budget]
+    concurrency = max(1, min(num_clients, len(cores) // MIN_CORES_PER_CLIENT))
+    share = max(1, len(cores) // concurrency)
+    return [cores[i * share:(i + 1) * share] for i in range(concurrency)]
+
+def run_clients_with_budget(client_ids, round_num, python_executable):
+    """
+    Runs the clients' training subprocesses within the CPU budget and returns (client_id, returncode, stdout, stderr)
+    in client order. Each process gets its core share as its xgboost n_jobs and BLAS/OpenMP thread counts.
+    """
+    shares = plan_core_shares(len(client_ids))
+    free_shares = queue.Queue()
+    for cores in shares:
+        free_shares.put(cores)
+    print(f"CPU budget {sum(len(c) for c in shares)} cores: running {len(shares)} clients at a time with {len(shares[0])} cores each"
+          f"{' (pinned)' if PIN_CLIENT_CORES else ''}.")
+
+    def run_client(client_id):
+        cores = free_shares.get() # Blocks while every share is in use, which queues the extra clients
+        try:
+            cmd = [python_executable, "client.py", client_id, str(round_num)]
+            env = dict(os.environ, **{name: str(len(cores)) for name in THREAD_ENV_VARS})
+            env[TRACE_FILE_ENV] = os.path.join(TRACE_RUN_DIR, f"{client_id}_round_{round_num}.jsonl")
+            if PIN_CLIENT_CORES:
+                # Passed to the client rather than applied in a preexec_fn, which is unsafe from these threads
+                env[CLIENT_CORES_ENV] = ','.join(map(str, cores))
+            process = subprocess.run(cmd, capture_output=True, text=True, env=env)
+            return client_id, process.returncode, process.stdout, process.stderr
+        finally:
+            free_shares.put(cores)
+
+    with ThreadPoolExecutor(max_workers=len(shares)) as executor:
+        return list(executor.map(run_client, client_ids))
+
+# --- Secure Aggregation ---
+
+def setup_secure_aggregation_keys(python_executable):
+    """Has every client create and publish its key pair before round 1, so each can mask with all the others."""
+    for client_id in CLIENT_IDS:
+        process = subprocess.run([python_executable, "client.py", client_id, "--setup-keys"], capture_output=True, text=True)
+        print(process.stdout.strip())
+        if process.returncode != 0:
+            print(f"ERROR: Key setup failed for {client_id}:\n{process.stderr}")
+            return False
+    return True
+
+def recover_dropped_clients(round_num, python_executable):
+    """
+    Clients without a masked update this round dropped out; their masks with the survivors do not cancel.
+    Each survivor is asked to reveal those masks so the server can remove them from the sum.
+    """
+    def has_update(client_id):
+        return os.path.exists(os.path.join(CLIENT_UPDATES_DIR, f"client_update_{client_id}_round_{round_num}{MASKED_UPDATE_SUFFIX}"))
+    dropped = [client_id for client_id in CLIENT_IDS if not has_update(client_id)]
+    survivors = [client_id for client_id in CLIENT_IDS if has_update(client_id)]
+    if not dropped or not survivors:
+        return
+    print(f"\n--- Secure aggregation: recovering masks of dropped clients {dropped} ---")
+    with span('recovery', dropped=','.join(dropped)):
+        for client_id in survivors:
+            cmd = [python_executable, "client.py", client_id, str(round_num), "--recover", ','.join(dropped)]
+            process = subprocess.run(cmd, capture_output=True, text=True)
+            print(process.stdout.strip())
+            if process.returncode != 0:
+                print(f"WARNING: {client_id} could not provide recovery masks:\n{process.stderr}")
+
 # NEW: Function to clean up all files from previous runs
 def cleanup_all_previous_runs(num_rounds_to_check, client_ids):
     """Removes all client update and global model files from a potential previous full run."""
@@ -26,7 +114,7 @@ def cleanup_all_previous_runs(num_rounds_to_check, client_ids):
     # Clean up client update files
     if os.path.exists(CLIENT_UPDATES_DIR):
         for f in os.listdir(CLIENT_UPDATES_DIR):
-            if f.endswith('.enc') or f.endswith('.pkl'): # Check for both .enc and old .pkl formats
+            if f.endswith(('.enc', '.pkl', '.npz', '.npy')): # .enc/.pkl updates, secure aggregation masked/recovery updates
                 os.remove(os.path.join(CLIENT_UPDATES_DIR, f))
                 print(f"Removed old client update: {f}")
     
@@ -73,33 +161,34 @@ def run_fl_round(round_num):
 
     # 1. Start Clients: Each client performs local training and saves its update.
     print(f"\n--- Clients starting local training for Round {round_num} ---")
-    client_processes = []
     python_executable = sys.executable 
     
-    for client_id in CLIENT_IDS:
-        cmd = [python_executable, "client.py", client_id, str(round_num)]
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        client_processes.append((client_id, process))
+    with span('clients'):
+        client_outputs = run_clients_with_budget(CLIENT_IDS, round_num, python_executable)
 
-    for client_id, p in client_processes:
-        stdout, stderr = p.communicate()
+    for client_id, returncode, stdout, stderr in client_outputs:
         print(f"\n--- Output for {client_id} (Round {round_num}) ---")
         if stdout:
             print(stdout)
         if stderr:
             print(f"ERROR for {client_id}:\n{stderr}")
-        if p.returncode != 0:
-            print(f"WARNING: {client_id} exited with non-zero code {p.returncode}.")
+        if returncode != 0:
+            print(f"WARNING: {client_id} exited with non-zero code {returncode}.")
 
     print("\n--- All clients finished local training ---")
 
+    if SECURE_AGG_ENABLED:
+        recover_dropped_clients(round_num, python_executable)
+
     time.sleep(2) # Give a moment for files to settle
 
     # 2. Run Server Aggregation: The server collects updates and creates a new global model.
     print(f"\n--- Server starting aggregation for Round {round_num} ---")
     server_cmd = [python_executable, "server.py", str(round_num)] 
     
-    server_process = subprocess.run(server_cmd, capture_output=True, text=True)
+    env = dict(os.environ, **{TRACE_FILE_ENV: os.path.join(TRACE_RUN_DIR, f"server_round_{round_num}.jsonl")})
+    with span('server'):
+        server_process = subprocess.run(server_cmd, capture_output=True, text=True, env=env)
     print(server_process.stdout)
     if server_process.stderr:
         print("Server Errors:\n", server_process.stderr)
@@ -120,9 +209,17 @@ if __name__ == "__main__":
 
     # Perform a comprehensive cleanup of *all* potential old files from previous runs
     cleanup_all_previous_runs(NUM_FL_ROUNDS, CLIENT_IDS) # Pass NUM_FL_ROUNDS to clean up all potential old files
+
+    if SECURE_AGG_ENABLED and not setup_secure_aggregation_keys(sys.executable):
+        sys.exit(1)
+
+    os.makedirs(TRACE_RUN_DIR, exist_ok=True)
+    os.environ[TRACE_FILE_ENV] = os.path.join(TRACE_RUN_DIR, 'run.jsonl')
     
     for i in range(1, NUM_FL_ROUNDS + 1):
-        success = run_fl_round(i)
+        set_trace_context('run', i)
+        with span('round'):
+            success = run_fl_round(i)
         if not success:
             print(f"Federated Learning simulation halted due to an error at Round {i}.")
             break
@@ -133,6 +230,17 @@ if __name__ == "__main__":
     print(f"The final aggregated model parameters can be found in '{GLOBAL_MODELS_DIR}/global_model_params_round_{NUM_FL_ROUNDS}.pkl'.")
     print(f"Individual client updates for each round are saved in the '{CLIENT_UPDATES_DIR}/' folder.")
 
+    # Merge the spans of every process into one timeline and a per-round critical path summary
+    spans = load_spans(TRACE_RUN_DIR)
+    trace_path = os.path.join(TRACE_RUN_DIR, 'trace.json')
+    summary_path = os.path.join(TRACE_RUN_DIR, 'round_summary.csv')
+    export_chrome_trace(spans, trace_path)
+    for row in export_round_summary(spans, summary_path):
+        if 'critical_client' in row:
+            print(f"Round {row['round']}: critical path {row['critical_client']} ({row['critical_client_seconds']:.2f}s, "
+                  f"longest phase '{row['critical_phase']}' {row['critical_phase_seconds']:.2f}s) + server {row['server_seconds']:.2f}s")
+    print(f"Trace saved to '{trace_path}' (open in chrome://tracing or ui.perfetto.dev); round summary saved to '{summary_path}'.")
+
     # Step 1: Decide How to Train the Global Model
     # Since your current FL only aggregates feature importances, you need a way to produce a real, usable model.  
     # **The simplest way:** After FL rounds, collect all client data (if allowed) and train a global model on it.  
@@ -5,12 +5,12 @@ import os
 import pandas as pd
 import numpy as np
 import pickle
-import re
-import json
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report, f1_score, precision_score, recall_score
 from datetime import datetime
-from tqdm import tqdm # Import tqdm for progress bars
+# Client data is located through client.py so evaluation sees the same partitioning (physical or manifest) as training
+from client import load_partition_splits, load_phase2_data_for_evaluation
+from features import ALL_FEATURES
 from sklearn.model_selection import train_test_split # Explicitly import as it's used by load_partition_data locally
 
 
@@ -28,389 +28,15 @@ RESULTS_DIR = 'results'
 EVALUATION_CLIENT_IDS = ['client_1', 'client_2', 'client_3']
 
 
-# --- Helper Functions (These are copied from client.py - they must be identical to client.py's version) ---
-# These functions must be standalone copies within this file for it to run independently.
-# They reference PHASE_FOR_TRAINING_CLIENTS when looking at client-partitioned data.
-
-def parse_web_log_entry(log_entry):
-    """Parses a single Apache-like web log entry to extract relevant features."""
-    match = re.match(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}) - - \[(.*?)\] "(.*?)" (\d+) (\d+) "(.*?)" "(.*?)" "PHPSESSID=(.*?)"', log_entry)
-    if match:
-        ip_address, timestamp_str, request_line, status, bytes_sent, referer, user_agent, session_id = match.groups()
-        method, path, http_version = request_line.split(' ', 2)
-        return {
-            'session_id': session_id,
-            'ip_address': ip_address,
-            'timestamp_str': timestamp_str,
-            'method': method,
-            'path': path,
-            'status_code': int(status),
-            'bytes_sent': int(bytes_sent) if bytes_sent.isdigit() else 0,
-            'referer': referer,
-            'user_agent': user_agent
-        }
-    return None
-
-def extract_mouse_movement_features(mouse_data):
-    """
-    Extracts features from mouse movement JSON data.
-    Adapted to handle differences between Phase 1 and Phase 2 structures.
-    """
-    features = {}
-    
-    mousemove_times = mouse_data.get('mousemove_times', [])
-    mousemove_total_behaviour = mouse_data.get('mousemove_total_behaviour', [])
-    total_behaviour = mouse_data.get('total_behaviour', []) # Phase 1 specific field
-
-    features['num_moves'] = total_behaviour.count('m')
-    features['num_left_clicks'] = total_behaviour.count('c(l)')
-    features['num_right_clicks'] = total_behaviour.count('c(r)')
-    features['num_middle_clicks'] = total_behaviour.count('c(m)')
-    features['total_actions'] = len(total_behaviour)
-
-    times_numeric = []
-    if mousemove_times:
-        try:
-            times_numeric = [float(t) for t in mousemove_times]
-        except (TypeError, ValueError):
-            times_numeric = [float(t.strip('()')) for t in mousemove_times if t.strip('()').replace('.', '', 1).isdigit()]
-
-    if len(times_numeric) > 1:
-        time_diffs = np.diff(times_numeric)
-        features['avg_time_between_moves'] = np.mean(time_diffs)
-        features['std_time_between_moves'] = np.std(time_diffs)
-        features['min_time_between_moves'] = np.min(time_diffs)
-        features['max_time_between_moves'] = np.max(time_diffs)
-        features['total_session_duration'] = times_numeric[-1] - times_numeric[0]
-    else:
-        features['avg_time_between_moves'] = 0
-        features['std_time_between_moves'] = 0
-        features['min_time_between_moves'] = 0
-        features['max_time_between_moves'] = 0
-        features['total_session_duration'] = 0
-
-    coords = []
-    if mousemove_total_behaviour:
-        try:
-            coords = [(c[0], c[1]) for c in mousemove_total_behaviour]
-        except (TypeError, IndexError):
-            for coord_str in mousemove_total_behaviour:
-                try:
-                    x, y = map(int, coord_str.strip('()').split(','))
-                    coords.append((x, y))
-                except ValueError:
-                    continue
-
-    if len(coords) > 1:
-        x_coords = np.array([c[0] for c in coords])
-        y_coords = np.array([c[1] for c in coords])
-
-        x_diffs = np.diff(x_coords)
-        y_diffs = np.diff(y_coords)
-        distances = np.sqrt(x_diffs**2 + y_diffs**2)
-
-        features['total_distance'] = np.sum(distances)
-        features['avg_speed'] = features['total_distance'] / features['total_session_duration'] if features['total_session_duration'] > 0 else 0
-        if len(time_diffs) > 0 and (distances / time_diffs).size > 0:
-            features['std_speed'] = np.std(distances / time_diffs)
-        else:
-            features['std_speed'] = 0
-
-        features['straightness'] = np.sqrt((x_coords[-1] - x_coords[0])**2 + (y_coords[-1] - y_coords[0])**2) / features['total_distance'] if features['total_distance'] > 0 else 0
-
-        features['min_x'] = np.min(x_coords)
-        features['max_x'] = np.max(x_coords)
-        features['min_y'] = np.min(y_coords)
-        features['max_y'] = np.max(y_coords)
-        features['std_x'] = np.std(x_coords)
-        features['std_y'] = np.std(y_coords)
-    else:
-        features['total_distance'] = 0
-        features['avg_speed'] = 0
-        features['std_speed'] = 0
-        features['straightness'] = 0
-        features['min_x'], features['max_x'], features['min_y'], features['max_y'], features['std_x'], features['std_y'] = 0,0,0,0,0,0
-
-    mousemove_client_height_width = mouse_data.get('mousemove_client_height_width', [])
-    if mousemove_client_height_width:
-        heights = [h for h, w in mousemove_client_height_width]
-        widths = [w for h, w in mousemove_client_height_width]
-        features['avg_client_height'] = np.mean(heights) if heights else 0
-        features['avg_client_width'] = np.mean(widths) if widths else 0
-        features['std_client_height'] = np.std(heights) if heights else 0
-        features['std_client_width'] = np.std(widths) if widths else 0
-        features['unique_client_sizes'] = len(set(tuple(hw) for hw in mousemove_client_height_width))
-    else:
-        features['avg_client_height'] = 0
-        features['avg_client_width'] = 0
-        features['std_client_height'] = 0
-        features['std_client_width'] = 0
-        features['unique_client_sizes'] = 0
-
-    mousemove_visited_urls = mouse_data.get('mousemove_visited_urls', [])
-    features['unique_visited_urls_mm'] = len(set(mousemove_visited_urls)) if mousemove_visited_urls else 0
-
-
-    return features
-
-
-def extract_web_log_features(web_logs_list):
-    """Extracts features from a list of parsed web log entries for a session."""
-    features = {}
-    if not web_logs_list:
-        return {
-            'num_requests': 0, 'num_get': 0, 'num_post': 0,
-            'unique_paths': 0, 'avg_status_code': 0, 'avg_bytes_sent': 0,
-            'num_200_ok': 0, 'num_404_not_found': 0, 'num_redirects': 0,
-            'session_duration_web_logs': 0, 'user_agent_diversity': 0
-        }
-
-    num_requests = len(web_logs_list)
-    features['num_requests'] = num_requests
-    features['num_get'] = sum(1 for log in web_logs_list if log['method'] == 'GET')
-    features['num_post'] = sum(1 for log in web_logs_list if log['method'] == 'POST')
-    features['unique_paths'] = len(set(log['path'] for log in web_logs_list))
-    features['avg_status_code'] = np.mean([log['status_code'] for log in web_logs_list])
-    features['avg_bytes_sent'] = np.mean([log['bytes_sent'] for log in web_logs_list])
-    features['num_200_ok'] = sum(1 for log in web_logs_list if log['status_code'] == 200)
-    features['num_404_not_found'] = sum(1 for log in web_logs_list if log['status_code'] == 404)
-    features['num_redirects'] = sum(1 for log in web_logs_list if log['status_code'] >= 300 and log['status_code'] < 400)
-
-    timestamps = []
-    for log in web_logs_list:
-        try:
-            timestamps.append(pd.to_datetime(log['timestamp_str'], format='%d/%b/%Y:%H:%M:%S %z'))
-        except ValueError:
-            pass
-
-    if len(timestamps) > 1:
-        features['session_duration_web_logs'] = (timestamps[-1] - timestamps[0]).total_seconds()
-    else:
-        features['session_duration_web_logs'] = 0
-
-    features['user_agent_diversity'] = len(set(log['user_agent'] for log in web_logs_list))
-
-    return features
+# --- Helper Functions ---
+# Features are computed by the shared registry in features.py; raw client and Phase 2 data are loaded through client.py.
 
 def load_partition_data(client_id, annotation_split_type='train'):
     """
-    Loads and preprocesses data for a single client (from BASE_PARTITION_DIR),
-    based on a specified annotation split type ('train' or 'test') and PHASE_FOR_TRAINING_CLIENTS.
+    Loads one split of a client's data with every feature in ALL_FEATURES, through client.py's single-pass
+    loader (so web logs are ingested incrementally and shared with training).
     """
-    if annotation_split_type not in ['train', 'test']:
-        raise ValueError("annotation_split_type must be 'train' or 'test'")
-
-    client_base_path = os.path.join(BASE_PARTITION_DIR, client_id, PHASE_FOR_TRAINING_CLIENTS) # Correctly uses PHASE_FOR_TRAINING_CLIENTS
-
-    annotations_dfs = []
-    annotation_subfolders = ['humans_and_advanced_bots', 'humans_and_moderate_bots']
-
-    for current_subfolder in annotation_subfolders:
-        annotation_path = os.path.join(client_base_path, 'annotations', current_subfolder, annotation_split_type)
-        if os.path.exists(annotation_path):
-            annotations_dfs.append(pd.read_csv(annotation_path, sep=' ', header=None, names=['session_id', 'label']))
-    
-    if not annotations_dfs:
-        print(f"[{client_id}] No '{annotation_split_type}' annotation files found. Cannot load data.")
-        return pd.DataFrame(), pd.Series(), [], {}
-
-    annotations_df_selected_split = pd.concat(annotations_dfs).drop_duplicates(subset=['session_id'])
-    session_ids_to_process = annotations_df_selected_split['session_id'].tolist()
-
-    print(f"[{client_id}] Loaded {len(session_ids_to_process)} unique sessions from '{annotation_split_type}' annotations.")
-
-    all_web_logs = {}
-    web_log_base_path = os.path.join(client_base_path, 'data', 'web_logs')
-    log_subfolders = ['bots', 'humans']
-    for subfolder in log_subfolders:
-        current_log_path = os.path.join(web_log_base_path, subfolder)
-        if os.path.exists(current_log_path):
-            log_files = [f for f in os.listdir(current_log_path) if f.endswith('.log')]
-            for log_file in tqdm(log_files, desc=f"[{client_id}] Reading {subfolder} Web Logs"):
-                file_path = os.path.join(current_log_path, log_file)
-                with open(file_path, 'r') as f:
-                    for line in f:
-                        parsed_log = parse_web_log_entry(line.strip())
-                        if parsed_log and parsed_log['session_id'] in session_ids_to_process:
-                            if parsed_log['session_id'] not in all_web_logs:
-                                all_web_logs[parsed_log['session_id']] = []
-                            all_web_logs[parsed_log['session_id']].append(parsed_log)
-        else:
-            print(f"[{client_id}] Web logs directory not found: {current_log_path}")
-
-    all_mouse_movements = {}
-    mouse_movement_data_base_path = os.path.join(client_base_path, 'data', 'mouse_movements')
-    for current_mm_type in annotation_subfolders:
-        mouse_movement_path = os.path.join(mouse_movement_data_base_path, current_mm_type)
-        if os.path.exists(mouse_movement_path):
-            session_folders = [d for d in os.listdir(mouse_movement_path) if os.path.isdir(os.path.join(mouse_movement_path, d))]
-            for session_folder in tqdm(session_folders, desc=f"[{client_id}] Reading {current_mm_type} Mouse Movements"):
-                session_id = session_folder
-                if session_id in session_ids_to_process:
-                    json_file_path = os.path.join(mouse_movement_path, session_folder, 'mouse_movements.json')
-                    if os.path.exists(json_file_path):
-                        with open(json_file_path, 'r') as f:
-                            try:
-                                mouse_data = json.load(f)
-                                all_mouse_movements[session_id] = mouse_data
-                            except json.JSONDecodeError:
-                                print(f"[{client_id}] Error decoding JSON for session {session_id} in {current_mm_type}")
-                    else:
-                        print(f"[{client_id}] Warning: mouse_movements.json not found for session {session_id} in {current_mm_type}")
-        else:
-            print(f"[{client_id}] Mouse movements directory not found: {mouse_movement_path}")
-
-    features_list = []
-    labels_list = []
-
-    print(f"[{client_id}] Extracting features for '{annotation_split_type}' sessions...")
-    for session_id in tqdm(list(session_ids_to_process), desc=f"[{client_id}] Extracting Features"):
-        mouse_feats = extract_mouse_movement_features(all_mouse_movements.get(session_id, {}))
-        web_log_feats = extract_web_log_features(all_web_logs.get(session_id, []))
-
-        label_row = annotations_df_selected_split[annotations_df_selected_split['session_id'] == session_id]
-        if label_row.empty:
-            continue
-
-        label = label_row['label'].iloc[0]
-
-        combined_features = {'session_id': session_id}
-        combined_features.update(mouse_feats)
-        combined_features.update(web_log_feats)
-
-        features_list.append(combined_features)
-        labels_list.append(label)
-
-    client_data_df = pd.DataFrame(features_list)
-    client_data_df['label'] = labels_list
-
-    label_mapping = {'human': 0, 'moderate_bot': 1, 'advanced_bot': 2}
-    client_data_df['label_encoded'] = client_data_df['label'].map(label_mapping)
-
-    X = client_data_df.drop(columns=['session_id', 'label', 'label_encoded'])
-    y = client_data_df['label_encoded']
-
-    X = X.fillna(0)
-    for col in X.columns:
-        if X[col].dtype == 'object':
-            try:
-                X[col] = pd.to_numeric(X[col])
-            except ValueError:
-                X = X.drop(columns=[col])
-
-    return X, y, list(X.columns), label_mapping
-
-# NEW FUNCTION: load_phase2_data_for_evaluation
-# This function is specifically for Phase 2 data which has a different structure than client-partitioned data.
-def load_phase2_data_for_evaluation(phase_type='phase2'):
-    """
-    Loads and preprocesses the entire Phase 2 dataset for global evaluation.
-    This assumes Phase 2 data is directly under dataset/phase2/ (not client-partitioned).
-    It loads ALL annotations and corresponding raw data from Phase 2 evaluation phases.
-    """
-    base_path = os.path.join('dataset', phase_type)
-
-    all_annotations_dfs = []
-    session_ids_to_process = set()
-
-    # Phase 2 annotations have different subfolders and file naming:
-    # 'humans_and_advanced_bots' and 'humans_and_moderate_and_advanced_bots'
-    annotation_subfolders = ['humans_and_advanced_bots', 'humans_and_moderate_and_advanced_bots']
-
-    for current_subfolder in annotation_subfolders:
-        # Phase 2 annotation files are directly named after the subfolder, not 'train'/'test'
-        annotation_path = os.path.join(base_path, 'annotations', current_subfolder, current_subfolder)
-        if os.path.exists(annotation_path):
-            all_annotations_dfs.append(pd.read_csv(annotation_path, sep=' ', header=None, names=['session_id', 'label']))
-    
-    if not all_annotations_dfs:
-        print(f"No annotations found for {phase_type}. Cannot load data.")
-        return pd.DataFrame(), pd.Series(), [], {}
-
-    annotations_df_all_phase2 = pd.concat(all_annotations_dfs).drop_duplicates(subset=['session_id'])
-    session_ids_to_process.update(annotations_df_all_phase2['session_id'].tolist())
-
-    print(f"Loaded {len(session_ids_to_process)} unique sessions from {phase_type} annotations.")
-
-    all_web_logs = {}
-    web_log_base_path = os.path.join(base_path, 'data', 'web_logs')
-    log_subfolders = ['bots', 'humans']
-    for subfolder in log_subfolders:
-        current_log_path = os.path.join(web_log_base_path, subfolder)
-        if os.path.exists(current_log_path):
-            log_files = [f for f in os.listdir(current_log_path) if f.endswith('.log')]
-            for log_file in tqdm(log_files, desc=f"Reading {phase_type} {subfolder} Web Logs"):
-                file_path = os.path.join(current_log_path, log_file)
-                with open(file_path, 'r') as f:
-                    for line in f:
-                        parsed_log = parse_web_log_entry(line.strip())
-                        if parsed_log and parsed_log['session_id'] in session_ids_to_process:
-                            if parsed_log['session_id'] not in all_web_logs:
-                                all_web_logs[parsed_log['session_id']] = []
-                            all_web_logs[parsed_log['session_id']].append(parsed_log)
-        else:
-            print(f"Web logs directory not found for {phase_type}: {current_log_path}")
-
-    all_mouse_movements = {}
-    mouse_movement_data_base_path = os.path.join(base_path, 'data', 'mouse_movements')
-    mm_subfolders = ['bots', 'humans']
-    for subfolder in mm_subfolders:
-        current_mm_path = os.path.join(mouse_movement_data_base_path, subfolder)
-        if os.path.exists(current_mm_path):
-            json_files = [f for f in os.listdir(current_mm_path) if f.endswith('.json')]
-            for json_file in tqdm(json_files, desc=f"Reading {phase_type} {subfolder} Mouse Movements"):
-                file_path = os.path.join(current_mm_path, json_file)
-                try:
-                    with open(file_path, 'r') as f:
-                        data_list = json.load(f)
-                        for item in data_list:
-                            session_id = item.get('session_id')
-                            if session_id and session_id in session_ids_to_process:
-                                all_mouse_movements[session_id] = item
-                except json.JSONDecodeError:
-                    print(f"Error decoding JSON for {file_path}")
-        else:
-            print(f"Mouse movements directory not found for {phase_type}: {current_mm_path}")
-
-    features_list = []
-    labels_list = []
-
-    print(f"Extracting features for {phase_type} sessions...")
-    for session_id in tqdm(list(session_ids_to_process), desc=f"Extracting {phase_type} Features"):
-        mouse_feats = extract_mouse_movement_features(all_mouse_movements.get(session_id, {}))
-        web_log_feats = extract_web_log_features(all_web_logs.get(session_id, []))
-
-        label_row = annotations_df_all_phase2[annotations_df_all_phase2['session_id'] == session_id]
-        if label_row.empty:
-            continue
-
-        label = label_row['label'].iloc[0]
-
-        combined_features = {'session_id': session_id}
-        combined_features.update(mouse_feats)
-        combined_features.update(web_log_feats)
-
-        features_list.append(combined_features)
-        labels_list.append(label)
-
-    client_data_df = pd.DataFrame(features_list)
-    client_data_df['label'] = labels_list
-
-    label_mapping = {'human': 0, 'moderate_bot': 1, 'advanced_bot': 2}
-    client_data_df['label_encoded'] = client_data_df['label'].map(label_mapping)
-
-    X = client_data_df.drop(columns=['session_id', 'label', 'label_encoded'])
-    y = client_data_df['label_encoded']
-
-    X = X.fillna(0)
-    for col in X.columns:
-        if X[col].dtype == 'object':
-            try:
-                X[col] = pd.to_numeric(X[col])
-            except ValueError:
-                X = X.drop(columns=[col])
-
-    return X, y, list(X.columns), label_mapping
+    return load_partition_splits(client_id, [annotation_split_type], ALL_FEATURES)[annotation_split_type]
 
 if __name__ == "__main__":
     LAST_ROUND = 20 # Assuming your simulation ran for 20 rounds
@@ -440,16 +66,23 @@ if __name__ == "__main__":
         # --- Prepare the Global Test Set from Phase 1 Client Test Data ---
         all_test_data_frames_X = []
         all_test_data_frames_y = []
-        
-        for client_id_eval in EVALUATION_CLIENT_IDS:
-            # Use load_partition_data for Phase 1 client-partitioned data
-            # Specify 'test' to load only the test annotations for each client
-            X_client_test, y_client_test, _, label_mapping = load_partition_data(client_id=client_id_eval, annotation_split_type='test')
-            if not X_client_test.empty:
-                all_test_data_frames_X.append(X_client_test)
-                all_test_data_frames_y.append(y_client_test)
-            else:
-                output_lines.append(f"Warning: No test data found for client {client_id_eval}. Skipping this client in evaluation.")
+
+        if PHASE_FOR_EVALUATION == 'phase2':
+            # The whole Phase 2 dataset, loaded the same way evaluate_global_model.py loads it
+            X_phase2, y_phase2, _, label_mapping = load_phase2_data_for_evaluation(phase_type=PHASE_FOR_EVALUATION)
+            if not X_phase2.empty:
+                all_test_data_frames_X.append(X_phase2)
+                all_test_data_frames_y.append(y_phase2)
+        else:
+            for client_id_eval in EVALUATION_CLIENT_IDS:
+                # Use load_partition_data for Phase 1 client-partitioned data
+                # Specify 'test' to load only the test annotations for each client
+                X_client_test, y_client_test, _, label_mapping = load_partition_data(client_id=client_id_eval, annotation_split_type='test')
+                if not X_client_test.empty:
+                    all_test_data_frames_X.append(X_client_test)
+                    all_test_data_frames_y.append(y_client_test)
+                else:
+                    output_lines.append(f"Warning: No test data found for client {client_id_eval}. Skipping this client in evaluation.")
 
         if not all_test_data_frames_X:
             output_content = "Error: No test data found across all evaluation clients. Cannot perform global evaluation."
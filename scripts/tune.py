@@ -0,0 +1,240 @@
+# bot-detector/scripts/tune.py
+
+import os
+import json
+import time
+import random
+import pickle
+import argparse
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import accuracy_score
+from client import load_partition_data
+
+# --- Configuration ---
+CLIENT_IDS = ['client_1', 'client_2', 'client_3']
+GLOBAL_PARAMS_PATH = 'global_models/global_model_params_round_20.pkl'
+RESULTS_DIR = 'results'
+
+NUM_CLASSES = 3
+VALIDATION_SIZE = 0.2
+RANDOM_STATE = 42
+MAX_BIN = 256
+EARLY_STOPPING_ROUNDS = 10
+
+# Successive halving: every config starts with MIN_ROUNDS boosting rounds; after each rung the best
+# 1/HALVING_RATE of the configs survive and get HALVING_RATE times more rounds, up to MAX_ROUNDS.
+NUM_CONFIGS = 27
+MIN_ROUNDS = 25
+MAX_ROUNDS = 400
+HALVING_RATE = 3
+
+SEARCH_SPACE = {
+    'max_depth': [3, 4, 5, 6, 8],
+    'learning_rate': [0.03, 0.1, 0.3],
+    'min_child_weight': [1, 3, 5],
+    'subsample': [0.7, 0.85, 1.0],
+    'colsample_bytree': [0.7, 0.85, 1.0],
+}
+
+LATENCY_REPEATS = 200 # Single-session predictions timed per finished trial
+RSS_SAMPLE_SECONDS = 0.005 # Resident memory sampling interval while a trial trains (single worker only)
+
+# --- Data ---
+
+def load_training_data():
+    """Extracts all clients' training features once, aligned to the global FL feature set when it exists."""
+    X_list, y_list = [], []
+    for client_id in CLIENT_IDS:
+        Xc, yc, _, _ = load_partition_data(client_id, 'train')
+        if not Xc.empty:
+            X_list.append(Xc)
+            y_list.append(yc)
+    X = pd.concat(X_list, ignore_index=True).fillna(0)
+    y = pd.concat(y_list, ignore_index=True)
+    if os.path.exists(GLOBAL_PARAMS_PATH):
+        with open(GLOBAL_PARAMS_PATH, 'rb') as f:
+            X = X.reindex(columns=pickle.load(f)['feature_names'], fill_value=0)
+    return X, y
+
+def build_shared_matrices(X, y):
+    """Quantizes the training fold once; every trial trains on the same QuantileDMatrix."""
+    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=VALIDATION_SIZE, random_state=RANDOM_STATE, stratify=y)
+    dtrain = xgb.QuantileDMatrix(X_train, label=y_train, max_bin=MAX_BIN)
+    dval = xgb.QuantileDMatrix(X_val, label=y_val, max_bin=MAX_BIN, ref=dtrain)
+    return dtrain, dval, X_val, y_val
+
+# --- Measurement ---
+
+def current_rss_mb():
+    """This process's resident memory right now (unlike ru_maxrss, which only ever grows), or None off Linux."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        return None
+
+class TrialMemory:
+    """Samples resident memory on a background thread while a trial runs; peak_mb is its growth over the start."""
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, current_rss_mb())
+
+    def __enter__(self):
+        self._start = current_rss_mb()
+        if self._start is not None:
+            self._peak = self._start
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_mb = max(self._peak, current_rss_mb()) - self._start
+        return False
+
+def measure_latency(booster, X_val):
+    """Returns (p50, p99) milliseconds for scoring one session with the trees up to the best iteration, the way /api/detect does."""
+    row = X_val.iloc[[0]].to_numpy(dtype=np.float32)
+    iteration_range = (0, booster.best_iteration + 1)
+    timings = []
+    for _ in range(LATENCY_REPEATS):
+        start = time.perf_counter()
+        booster.inplace_predict(row, iteration_range=iteration_range)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 99))
+
+# --- Search ---
+
+def sample_configs(num_configs, seed):
+    rng = random.Random(seed)
+    configs, seen = [], set()
+    while len(configs) < num_configs and len(seen) < np.prod([len(v) for v in SEARCH_SPACE.values()]):
+        config = {name: rng.choice(values) for name, values in SEARCH_SPACE.items()}
+        key = tuple(sorted(config.items()))
+        if key not in seen:
+            seen.add(key)
+            configs.append(config)
+    return configs
+
+def run_trial(config, num_rounds, dtrain, dval, X_val, y_val, nthread, measure_memory):
+    """
+    Trains one config for up to num_rounds with early stopping on the validation fold and records its cost.
+    With measure_memory (one trial at a time) the trial's peak resident memory growth is recorded; with
+    concurrent trials it cannot be attributed to one of them and is left empty.
+    """
+    params = {
+        'objective': 'multi:softprob', 'num_class': NUM_CLASSES, 'tree_method': 'hist', 'max_bin': MAX_BIN,
+        'eval_metric': 'mlogloss', 'seed': RANDOM_STATE, 'nthread': nthread, **config
+    }
+    evals_result = {}
+    memory = TrialMemory()
+    start = time.perf_counter()
+    with memory if measure_memory else nullcontext():
+        booster = xgb.train(params, dtrain, num_boost_round=num_rounds, evals=[(dval, 'val')],
+                            early_stopping_rounds=EARLY_STOPPING_ROUNDS, evals_result=evals_result, verbose_eval=False)
+    train_seconds = time.perf_counter() - start
+
+    best_iteration = booster.best_iteration
+    probabilities = booster.predict(dval, iteration_range=(0, best_iteration + 1))
+    return {
+        **config,
+        'budget_rounds': num_rounds,
+        'best_rounds': best_iteration + 1,
+        'val_mlogloss': evals_result['val']['mlogloss'][best_iteration],
+        'val_accuracy': accuracy_score(y_val, probabilities.argmax(axis=1)),
+        'train_seconds': train_seconds,
+        'trial_rss_mb': memory.peak_mb,
+        'model_kb': len(booster.save_raw('ubj')) / 1024,
+        'booster': booster, # Kept until latency is measured, outside the parallel rungs
+    }
+
+def successive_halving(configs, dtrain, dval, X_val, y_val, workers):
+    """Runs the halving rungs and returns every trial result (the last rung's results are the finalists)."""
+    nthread = max(1, (os.cpu_count() or 1) // workers)
+    trials = []
+    survivors = configs
+    num_rounds = MIN_ROUNDS
+    rung = 0
+    while survivors:
+        print(f"Rung {rung}: {len(survivors)} configs x {num_rounds} rounds...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda c: run_trial(c, num_rounds, dtrain, dval, X_val, y_val, nthread, workers == 1), survivors))
+        for result in results:
+            result['rung'] = rung
+        trials.extend(results)
+
+        if len(survivors) == 1 or num_rounds >= MAX_ROUNDS:
+            break
+        ranked = sorted(results, key=lambda r: r['val_mlogloss'])
+        keep = max(1, len(ranked) // HALVING_RATE)
+        survivors = [{name: r[name] for name in SEARCH_SPACE} for r in ranked[:keep]]
+        num_rounds = min(MAX_ROUNDS, num_rounds * HALVING_RATE)
+        rung += 1
+    return trials
+
+def pareto_front(trials):
+    """Marks the final results no other result beats on both validation loss and p50 latency."""
+    for trial in trials:
+        trial['pareto'] = not any(
+            other['val_mlogloss'] <= trial['val_mlogloss'] and other['latency_p50_ms'] <= trial['latency_p50_ms'] and
+            (other['val_mlogloss'] < trial['val_mlogloss'] or other['latency_p50_ms'] < trial['latency_p50_ms'])
+            for other in trials)
+    return trials
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Successive-halving XGBoost hyperparameter search over one shared quantized matrix.")
+    parser.add_argument('--configs', type=int, default=NUM_CONFIGS, help="Number of sampled configurations in the first rung")
+    parser.add_argument('--workers', type=int, default=4, help="Trials trained in parallel (per-trial memory is only measured with 1)")
+    parser.add_argument('--seed', type=int, default=RANDOM_STATE, help="Seed for configuration sampling")
+    args = parser.parse_args()
+
+    X, y = load_training_data()
+    print(f"Loaded {len(X)} training sessions with {X.shape[1]} features.")
+    dtrain, dval, X_val, y_val = build_shared_matrices(X, y)
+
+    start = time.perf_counter()
+    trials = successive_halving(sample_configs(args.configs, args.seed), dtrain, dval, X_val, y_val, args.workers)
+    print(f"✅ Ran {len(trials)} trials in {time.perf_counter() - start:.1f}s.")
+
+    # Every config is reported at the highest rung it reached. Latency is timed one model at a time,
+    # so concurrent trials do not distort it.
+    final = {}
+    for trial in trials:
+        final[tuple(trial[name] for name in SEARCH_SPACE)] = trial
+    for trial in final.values():
+        trial['latency_p50_ms'], trial['latency_p99_ms'] = measure_latency(trial['booster'], X_val)
+    for trial in trials:
+        del trial['booster']
+    table = pd.DataFrame(pareto_front(list(final.values()))).sort_values(['val_mlogloss', 'latency_p50_ms'])
+    best = table.iloc[0]
+    best_config = {name: best[name].item() if hasattr(best[name], 'item') else best[name] for name in SEARCH_SPACE}
+    best_config['n_estimators'] = int(best['best_rounds'])
+
+    columns = list(SEARCH_SPACE) + ['rung', 'best_rounds', 'val_accuracy', 'val_mlogloss', 'latency_p50_ms',
+                                    'latency_p99_ms', 'model_kb', 'train_seconds', 'trial_rss_mb', 'pareto']
+    print("\nLatency vs. accuracy (each config at the last rung it reached):")
+    print(table[columns].to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    print(f"\n🏆 Best configuration: {best_config}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    table_path = os.path.join(RESULTS_DIR, f"tune_{timestamp}.csv")
+    table[columns].to_csv(table_path, index=False)
+    with open(os.path.join(RESULTS_DIR, f"tune_{timestamp}.json"), 'w') as f:
+        json.dump({'best_config': best_config, 'trials': trials}, f, indent=2, default=float)
+    print(f"Results saved to {table_path} and {os.path.join(RESULTS_DIR, f'tune_{timestamp}.json')}")
@@ -0,0 +1,117 @@
+# bot-detector/secure_agg.py
+
+import os
+import glob
+import numpy as np
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# Pairwise-mask secure aggregation. Every pair of clients derives a shared seed from an X25519 key
+# exchange; one adds the PRG mask expanded from that seed to its update and the other subtracts it,
+# so the masks cancel in the sum and the server only ever learns the total. Updates are fixed-point
+# encoded into uint64, where addition wraps modulo 2**64 and the masks cancel exactly.
+#
+# The vector a client uploads is [importance_1 * num_samples, ..., importance_k * num_samples, num_samples],
+# so the summed vector directly gives the sample-weighted average of the importances.
+#
+# If a client drops out, its partners' masks with it are left in the sum. Each surviving client then
+# reveals the sum of just those masks (a recovery vector), which the server subtracts. This simple scheme
+# has no self-masks: an update that arrives after its sender was declared dropped must be discarded.
+
+# --- Configuration ---
+SECURE_AGG_ENV = 'FL_SECURE_AGG'
+SECURE_AGG_ENABLED = os.environ.get(SECURE_AGG_ENV) == '1'
+KEYS_DIR = 'secure_agg_keys'      # <client_id>.key (private, client only) and <client_id>.pub (shared)
+FIXED_POINT_BITS = 20              # Fractional bits of the fixed-point encoding
+MASKED_UPDATE_SUFFIX = '.masked.npz'
+RECOVERY_SUFFIX = '.recovery.npy'
+
+# --- Keys ---
+
+def create_keypair(client_id, keys_dir=KEYS_DIR):
+    """Creates the client's X25519 key pair unless it already exists, and publishes the public key."""
+    os.makedirs(keys_dir, exist_ok=True)
+    private_path = os.path.join(keys_dir, f"{client_id}.key")
+    if not os.path.exists(private_path):
+        private_key = X25519PrivateKey.generate()
+        with open(os.open(private_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(private_key.private_bytes_raw())
+        with open(os.path.join(keys_dir, f"{client_id}.pub"), 'wb') as f:
+            f.write(private_key.public_key().public_bytes_raw())
+    return private_path
+
+def load_private_key(client_id, keys_dir=KEYS_DIR):
+    with open(os.path.join(keys_dir, f"{client_id}.key"), 'rb') as f:
+        return X25519PrivateKey.from_private_bytes(f.read())
+
+def load_public_keys(keys_dir=KEYS_DIR):
+    """Returns {client_id: public key} for every client that has published one (the masking cohort)."""
+    public_keys = {}
+    for path in sorted(glob.glob(os.path.join(keys_dir, '*.pub'))):
+        with open(path, 'rb') as f:
+            public_keys[os.path.basename(path)[:-len('.pub')]] = X25519PublicKey.from_public_bytes(f.read())
+    return public_keys
+
+# --- Fixed-Point Encoding ---
+
+def encode_fixed_point(values):
+    """Encodes floats as two's-complement fixed-point uint64 (negative values, e.g. from DP noise, wrap around)."""
+    return np.round(np.asarray(values, dtype=np.float64) * (1 << FIXED_POINT_BITS)).astype(np.int64).view(np.uint64)
+
+def decode_fixed_point(encoded):
+    return np.asarray(encoded, dtype=np.uint64).view(np.int64) / (1 << FIXED_POINT_BITS)
+
+# --- Masks ---
+
+def pair_mask(private_key, client_id, peer_id, peer_public_key, round_num, length):
+    """
+    The mask client_id shares with peer_id for this round, signed so the pair cancels: the client whose id
+    sorts first adds it, the other subtracts it (modulo 2**64). Both sides derive the same seed.
+    """
+    shared_secret = private_key.exchange(peer_public_key)
+    first, second = sorted([client_id, peer_id])
+    seed = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                info=f"fl-mask|round {round_num}|{first}|{second}".encode()).derive(shared_secret)
+    mask = np.random.PCG64(int.from_bytes(seed, 'little')).random_raw(length).astype(np.uint64)
+    return mask if client_id == first else np.uint64(0) - mask
+
+def combined_mask(client_id, peer_ids, round_num, length, keys_dir=KEYS_DIR):
+    """Sum of the client's signed pair masks with each of peer_ids."""
+    private_key = load_private_key(client_id, keys_dir)
+    public_keys = load_public_keys(keys_dir)
+    total = np.zeros(length, dtype=np.uint64)
+    for peer_id in peer_ids:
+        if peer_id != client_id:
+            total += pair_mask(private_key, client_id, peer_id, public_keys[peer_id], round_num, length)
+    return total
+
+# --- Client Side ---
+
+def mask_update(client_id, round_num, feature_importances, num_samples, keys_dir=KEYS_DIR):
+    """Returns the client's fixed-point update vector masked with every other client in the cohort."""
+    vector = encode_fixed_point(np.append(np.asarray(feature_importances) * num_samples, num_samples))
+    cohort = load_public_keys(keys_dir)
+    if client_id not in cohort:
+        raise ValueError(f"{client_id} has no published key in {keys_dir}; run the key setup first")
+    return vector + combined_mask(client_id, cohort, round_num, len(vector), keys_dir)
+
+def save_masked_update(path, masked_vector, feature_names):
+    np.savez(path, masked=masked_vector, feature_names=np.array(feature_names))
+
+def recovery_vector(client_id, round_num, dropped_ids, length, keys_dir=KEYS_DIR):
+    """The masks this surviving client shares with the dropped clients, for the server to remove from the sum."""
+    return combined_mask(client_id, dropped_ids, round_num, length, keys_dir)
+
+# --- Server Side ---
+
+def unmask_sum(masked_vectors, recovery_vectors=()):
+    """
+    Sums the masked updates in one vectorized pass, removes the dropped clients' leftover masks and decodes
+    the result. Returns (weighted importance sum, total samples).
+    """
+    total = np.stack(masked_vectors).sum(axis=0, dtype=np.uint64)
+    if len(recovery_vectors):
+        total -= np.stack(recovery_vectors).sum(axis=0, dtype=np.uint64)
+    decoded = decode_fixed_point(total)
+    return decoded[:-1], decoded[-1]
@@ -5,6 +5,8 @@ import pickle
 import numpy as np
 import pandas as pd
 from cryptography.fernet import Fernet # For symmetric encryption
+from tracing import span, set_context as set_trace_context
+from secure_agg import SECURE_AGG_ENABLED, MASKED_UPDATE_SUFFIX, RECOVERY_SUFFIX, load_public_keys, unmask_sum
 
 # --- Configuration ---
 CLIENT_IDS = ['client_1', 'client_2', 'client_3']
@@ -66,12 +68,58 @@ def aggregate_models(client_updates):
     print(f"Aggregation complete. Aggregated data from {len(client_updates)} clients.")
     return aggregated_importances.tolist(), sorted_feature_names
 
+def aggregate_masked_updates(round_num):
+    """
+    Secure aggregation mode: sums the clients' masked update vectors in one pass without seeing any of them
+    individually. Dropped clients' leftover masks are removed with the survivors' recovery vectors.
+    """
+    cohort = sorted(load_public_keys())
+    masked_vectors, feature_names, survivors = [], None, []
+    with span('collect'):
+        for client_id in cohort:
+            update_filename = os.path.join(CLIENT_UPDATES_DIR, f"{UPDATE_PREFIX}{client_id}_round_{round_num}{MASKED_UPDATE_SUFFIX}")
+            if not os.path.exists(update_filename):
+                continue
+            with np.load(update_filename) as update:
+                client_feature_names = update['feature_names'].tolist()
+                if feature_names is not None and client_feature_names != feature_names:
+                    print(f"ERROR: {client_id} masked a different feature layout. Cannot aggregate.")
+                    return None, []
+                feature_names = client_feature_names
+                masked_vectors.append(update['masked'])
+            survivors.append(client_id)
+    dropped = [client_id for client_id in cohort if client_id not in survivors]
+    print(f"Received masked updates from {len(survivors)} of {len(cohort)} clients" + (f"; dropped: {dropped}" if dropped else "."))
+    if not survivors:
+        return None, []
+
+    recovery_vectors = []
+    if dropped:
+        for client_id in survivors:
+            recovery_filename = os.path.join(CLIENT_UPDATES_DIR, f"{UPDATE_PREFIX}{client_id}_round_{round_num}{RECOVERY_SUFFIX}")
+            if not os.path.exists(recovery_filename):
+                print(f"ERROR: No recovery masks from {client_id} for the dropped clients. Cannot unmask the sum.")
+                return None, feature_names
+            recovery_vectors.append(np.load(recovery_filename))
+
+    with span('aggregate', num_updates=len(survivors)):
+        weighted_importances, total_samples = unmask_sum(masked_vectors, recovery_vectors)
+    if total_samples <= 0:
+        print("Total samples is zero, cannot aggregate.")
+        return None, feature_names
+    print(f"Aggregation complete. Aggregated data from {len(survivors)} clients.")
+    return (weighted_importances / total_samples).tolist(), feature_names
+
 def run_server_aggregation(round_num):
     """
     Main function to run a single server aggregation round.
     """
     print(f"\n--- Federated Learning Server (Round {round_num}) ---")
 
+    if SECURE_AGG_ENABLED:
+        global_feature_importances, global_feature_names = aggregate_masked_updates(round_num)
+        return save_global_model(global_feature_importances, global_feature_names, round_num)
+
     received_updates = []
     print(f"Collecting and decrypting client updates for round {round_num}...")
     for client_id in CLIENT_IDS:
@@ -79,10 +127,11 @@ def run_server_aggregation(round_num):
         update_filename = os.path.join(CLIENT_UPDATES_DIR, f"{UPDATE_PREFIX}{client_id}_round_{round_num}.enc")
         if os.path.exists(update_filename):
             try:
-                with open(update_filename, 'rb') as f:
-                    encrypted_data = f.read()
-                
-                decrypted_update = decrypt_data(encrypted_data, ENCRYPTION_KEY)
+                with span('decrypt', client_id=client_id):
+                    with open(update_filename, 'rb') as f:
+                        encrypted_data = f.read()
+
+                    decrypted_update = decrypt_data(encrypted_data, ENCRYPTION_KEY)
                 received_updates.append(decrypted_update)
                 print(f"Successfully decrypted and received update from {client_id} for round {round_num}")
                 
@@ -100,8 +149,11 @@ def run_server_aggregation(round_num):
     if len(received_updates) != len(CLIENT_IDS):
         print("WARNING: Not all clients provided valid updates. Aggregating with available updates.")
 
-    global_feature_importances, global_feature_names = aggregate_models(received_updates)
+    with span('aggregate', num_updates=len(received_updates)):
+        global_feature_importances, global_feature_names = aggregate_models(received_updates)
+    return save_global_model(global_feature_importances, global_feature_names, round_num)
 
+def save_global_model(global_feature_importances, global_feature_names, round_num):
     if global_feature_importances is not None:
         global_model_params = {
             'feature_importances': global_feature_importances,
@@ -111,7 +163,7 @@ def run_server_aggregation(round_num):
         # Modified: Save global model to the new global_models directory
         os.makedirs(GLOBAL_MODELS_DIR, exist_ok=True) # Ensure directory exists
         global_model_filename = os.path.join(GLOBAL_MODELS_DIR, GLOBAL_MODEL_FILENAME_PATTERN.format(round_num))
-        with open(global_model_filename, 'wb') as f:
+        with span('save'), open(global_model_filename, 'wb') as f:
             pickle.dump(global_model_params, f)
         print(f"Global model for round {round_num} saved to {global_model_filename} for distribution.")
         return global_model_params
@@ -122,4 +174,5 @@ def run_server_aggregation(round_num):
 if __name__ == "__main__":
     import sys
     round_num = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    set_trace_context('server', round_num)
     run_server_aggregation(round_num)
\ No newline at end of file
@@ -0,0 +1,299 @@
+# bot-detector/session_store.py
+
+import os
+import json
+import time
+import mmap
+import struct
+import hashlib
+import tempfile
+import threading
+try:
+    import fcntl
+except ImportError: # Windows: no byte-range locks, so the store cannot be shared (see open_session_store)
+    fcntl = None
+
+# Per-session state shared by every API worker process on the host: a fixed-size open-addressing hash
+# table in a memory-mapped file. The table is split into NUM_STRIPES stripes that each own a contiguous
+# range of slots; a key always lives in its stripe, so an update locks only that stripe (an fcntl byte-range
+# lock on the stripe's slots for other processes, plus a thread lock for threads of the same process).
+# Records expire after their TTL; expired slots are reused, and a full stripe evicts its soonest-to-expire record.
+# Deleted and expired slots ("dead" slots) are reused by inserts but still lengthen the probes that pass them:
+# a delete right before an empty slot empties it (and the dead slots before it), and a probe that passes more
+# than REHASH_DEAD_SLOTS dead slots rebuilds its stripe with only the live records.
+
+# --- Configuration ---
+SESSION_STORE_PATH = os.environ.get('BOT_SESSION_STORE', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'bot_detector_sessions.bin'))
+NUM_SLOTS = 65536         # Records in the table (16 MiB at RECORD_SIZE bytes each)
+NUM_STRIPES = 64          # Independently locked slot ranges
+DEFAULT_TTL = 1800.0      # Seconds a record lives after its last write
+REHASH_DEAD_SLOTS = 128   # Dead slots one probe may pass before its stripe is rehashed
+
+STORE_MAGIC = b'BOTSESS1'
+HEADER = struct.Struct('<8sII')        # magic, num_slots, num_stripes
+HEADER_SIZE = 64
+RECORD = struct.Struct('<BBHQdd')      # state, key length, value length, key hash, expires_at, updated_at
+RECORD_SIZE = 256
+KEY_BYTES = 64
+VALUE_BYTES = RECORD_SIZE - RECORD.size - KEY_BYTES # JSON-encoded value, up to 164 bytes
+
+SLOT_EMPTY, SLOT_USED, SLOT_DELETED = 0, 1, 2
+
+def key_hash(key):
+    # Python's hash() is salted per process, so every worker must use the same explicit hash
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+class SessionStore:
+    """Shared-memory session state table. Values are small JSON-serializable dicts of at most VALUE_BYTES."""
+
+    def __init__(self, path=SESSION_STORE_PATH, num_slots=NUM_SLOTS, num_stripes=NUM_STRIPES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER_SIZE, 0) # The first process to get here initializes the file
+        try:
+            if os.fstat(self._fd).st_size < HEADER_SIZE:
+                os.ftruncate(self._fd, HEADER_SIZE + num_slots * RECORD_SIZE)
+                os.pwrite(self._fd, HEADER.pack(STORE_MAGIC, num_slots, num_stripes), 0)
+            magic, self.num_slots, self.num_stripes = HEADER.unpack(os.pread(self._fd, HEADER.size, 0))
+            if magic != STORE_MAGIC:
+                raise ValueError(f"{path} is not a session store")
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+        self.slots_per_stripe = self.num_slots // self.num_stripes
+        self._mmap = mmap.mmap(self._fd, HEADER_SIZE + self.num_slots * RECORD_SIZE)
+        self._thread_locks = [threading.Lock() for _ in range(self.num_stripes)]
+
+    # --- Locking ---
+
+    def _stripe_range(self, stripe):
+        return HEADER_SIZE + stripe * self.slots_per_stripe * RECORD_SIZE, self.slots_per_stripe * RECORD_SIZE
+
+    def _lock(self, stripe):
+        self._thread_locks[stripe].acquire()
+        start, length = self._stripe_range(stripe)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+
+    def _unlock(self, stripe):
+        start, length = self._stripe_range(stripe)
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+        self._thread_locks[stripe].release()
+
+    # --- Records ---
+
+    def _offset(self, stripe, index):
+        return HEADER_SIZE + (stripe * self.slots_per_stripe + index) * RECORD_SIZE
+
+    def _probe(self, key, hashed, now):
+        """Returns (offset of the key's live record or None, offset to insert at, dead slots passed)."""
+        stripe = hashed % self.num_stripes
+        start = (hashed // self.num_stripes) % self.slots_per_stripe
+        insert_at = None
+        soonest_expiry = None
+        dead = 0
+        for probe in range(self.slots_per_stripe):
+            offset = self._offset(stripe, (start + probe) % self.slots_per_stripe)
+            state, key_length, _, record_hash, expires_at, _ = RECORD.unpack_from(self._mmap, offset)
+            if state == SLOT_EMPTY:
+                return None, insert_at if insert_at is not None else offset, dead
+            if state == SLOT_USED and expires_at > now:
+                if record_hash == hashed and self._mmap[offset + RECORD.size:offset + RECORD.size + key_length] == key:
+                    return offset, offset, dead
+                if soonest_expiry is None or expires_at < soonest_expiry[0]:
+                    soonest_expiry = (expires_at, offset)
+            else:
+                dead += 1
+                if insert_at is None:
+                    insert_at = offset # Deleted or expired: reusable, but the key may still be further along
+        if insert_at is None:
+            insert_at = soonest_expiry[1] # Stripe full of live records: evict the one closest to expiring
+        return None, insert_at, dead
+
+    def _find(self, key, hashed, now):
+        """
+        Probes the key's stripe, rehashing it first if the probe passed too many dead slots. Returns (offset of
+        the key's live record or None, offset to insert at). Must be called with the stripe locked.
+        """
+        found, insert_at, dead = self._probe(key, hashed, now)
+        if dead > REHASH_DEAD_SLOTS:
+            self._rehash(hashed % self.num_stripes, now)
+            found, insert_at, _ = self._probe(key, hashed, now)
+        return found, insert_at
+
+    def _rehash(self, stripe, now):
+        """Rebuilds a stripe from its live records, turning every dead slot back into an empty one."""
+        live = []
+        for index in range(self.slots_per_stripe):
+            offset = self._offset(stripe, index)
+            state, _, _, record_hash, expires_at, _ = RECORD.unpack_from(self._mmap, offset)
+            if state == SLOT_USED and expires_at > now:
+                live.append((record_hash, self._mmap[offset:offset + RECORD_SIZE]))
+        start, length = self._stripe_range(stripe)
+        self._mmap[start:start + length] = bytes(length)
+        for record_hash, record in live:
+            index = (record_hash // self.num_stripes) % self.slots_per_stripe
+            while self._mmap[self._offset(stripe, index)] != SLOT_EMPTY:
+                index = (index + 1) % self.slots_per_stripe
+            offset = self._offset(stripe, index)
+            self._mmap[offset:offset + RECORD_SIZE] = record
+
+    def _release(self, offset, hashed, now):
+        """Deletes the record at offset. Probes stop at an empty slot, so a slot followed by one can be emptied too."""
+        stripe = hashed % self.num_stripes
+        index = (offset - self._offset(stripe, 0)) // RECORD_SIZE
+        self._mmap[offset] = SLOT_DELETED
+        if self._mmap[self._offset(stripe, (index + 1) % self.slots_per_stripe)] != SLOT_EMPTY:
+            return
+        # Empty this slot and the run of dead slots before it; no probe needs to pass them any more
+        for _ in range(self.slots_per_stripe):
+            offset = self._offset(stripe, index)
+            state, _, _, _, expires_at, _ = RECORD.unpack_from(self._mmap, offset)
+            if state == SLOT_EMPTY or (state == SLOT_USED and expires_at > now):
+                break
+            self._mmap[offset] = SLOT_EMPTY
+            index = (index - 1) % self.slots_per_stripe
+
+    def _read_value(self, offset):
+        value_length = RECORD.unpack_from(self._mmap, offset)[2]
+        start = offset + RECORD.size + KEY_BYTES
+        return json.loads(self._mmap[start:start + value_length])
+
+    def _write(self, offset, key, hashed, value, ttl, now):
+        encoded = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        if len(encoded) > VALUE_BYTES:
+            raise ValueError(f"Session value is {len(encoded)} bytes, the store holds at most {VALUE_BYTES}")
+        RECORD.pack_into(self._mmap, offset, SLOT_USED, len(key), len(encoded), hashed, now + (self.ttl if ttl is None else ttl), now)
+        self._mmap[offset + RECORD.size:offset + RECORD.size + len(key)] = key
+        self._mmap[offset + RECORD.size + KEY_BYTES:offset + RECORD.size + KEY_BYTES + len(encoded)] = encoded
+
+    def _encode_key(self, session_id):
+        key = session_id.encode('utf-8')
+        if not key:
+            raise ValueError("Session ids must not be empty")
+        if len(key) > KEY_BYTES:
+            key = b'#' + hashlib.blake2b(key, digest_size=24).hexdigest().encode('ascii') # Longer ids are stored by digest
+        return key
+
+    # --- Public API ---
+
+    def update(self, session_id, fn, ttl=None):
+        """
+        Atomically replaces the session's value with fn(current value or None) and returns the new value.
+        Returning None from fn deletes the session. The record's TTL restarts on every write.
+        """
+        key = self._encode_key(session_id)
+        hashed = key_hash(key)
+        stripe = hashed % self.num_stripes
+        self._lock(stripe)
+        try:
+            now = time.time()
+            found, insert_at = self._find(key, hashed, now)
+            value = fn(self._read_value(found) if found is not None else None)
+            if value is None:
+                if found is not None:
+                    self._release(found, hashed, now)
+            else:
+                self._write(insert_at, key, hashed, value, ttl, now)
+            return value
+        finally:
+            self._unlock(stripe)
+
+    def get(self, session_id):
+        """Returns the session's value, or None if it is missing or expired."""
+        key = self._encode_key(session_id)
+        hashed = key_hash(key)
+        stripe = hashed % self.num_stripes
+        self._lock(stripe)
+        try:
+            found, _ = self._find(key, hashed, time.time())
+            return self._read_value(found) if found is not None else None
+        finally:
+            self._unlock(stripe)
+
+    def put(self, session_id, value, ttl=None):
+        return self.update(session_id, lambda _: value, ttl)
+
+    def delete(self, session_id):
+        self.update(session_id, lambda _: None)
+
+    def stats(self):
+        """Counts live and expired records (a lock-free snapshot)."""
+        now = time.time()
+        live = expired = 0
+        for slot in range(self.num_slots):
+            state, _, _, _, expires_at, _ = RECORD.unpack_from(self._mmap, HEADER_SIZE + slot * RECORD_SIZE)
+            if state == SLOT_USED:
+                if expires_at > now:
+                    live += 1
+                else:
+                    expired += 1
+        return {'path': self.path, 'slots': self.num_slots, 'stripes': self.num_stripes, 'live': live, 'expired': expired}
+
+class LocalSessionStore:
+    """
+    Process-local fallback with the same interface, used where fcntl is unavailable (Windows). State is not
+    shared between worker processes, so run a single worker there.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._records = {} # session id -> (value, expires_at, updated_at)
+        self._lock = threading.Lock()
+
+    def update(self, session_id, fn, ttl=None):
+        if not session_id:
+            raise ValueError("Session ids must not be empty")
+        with self._lock:
+            now = time.time()
+            record = self._records.get(session_id)
+            value = fn(record[0] if record is not None and record[1] > now else None)
+            if value is None:
+                self._records.pop(session_id, None)
+            else:
+                encoded = json.dumps(value, separators=(',', ':')).encode('utf-8')
+                if len(encoded) > VALUE_BYTES:
+                    raise ValueError(f"Session value is {len(encoded)} bytes, the store holds at most {VALUE_BYTES}")
+                if session_id not in self._records and len(self._records) >= NUM_SLOTS:
+                    self._evict(now)
+                self._records[session_id] = (json.loads(encoded), now + (self.ttl if ttl is None else ttl), now)
+            return value
+
+    def _evict(self, now):
+        """Bounds the dict like the shared table: drops expired records, or else the one closest to expiring."""
+        self._records = {key: record for key, record in self._records.items() if record[1] > now}
+        if len(self._records) >= NUM_SLOTS:
+            del self._records[min(self._records, key=lambda key: self._records[key][1])]
+
+    def get(self, session_id):
+        with self._lock:
+            record = self._records.get(session_id)
+            return record[0] if record is not None and record[1] > time.time() else None
+
+    def put(self, session_id, value, ttl=None):
+        return self.update(session_id, lambda _: value, ttl)
+
+    def delete(self, session_id):
+        self.update(session_id, lambda _: None)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            live = sum(1 for _, expires_at, _ in self._records.values() if expires_at > now)
+            expired = len(self._records) - live
+        return {'path': None, 'slots': None, 'stripes': None, 'live': live, 'expired': expired}
+
+_open_stores = {}
+
+def open_session_store(path=SESSION_STORE_PATH):
+    """
+    Returns this process's SessionStore for path, creating the shared file on first use. Without fcntl
+    (Windows) it returns a process-local LocalSessionStore instead.
+    """
+    if path not in _open_stores:
+        if fcntl is None:
+            print("⚠️ fcntl is unavailable: session state is kept per process, run a single API worker.")
+            _open_stores[path] = LocalSessionStore()
+        else:
+            _open_stores[path] = SessionStore(path)
+    return _open_stores[path]
@@ -0,0 +1,114 @@
+// bot-detector/static/collector.js
+//
+// Streams the page's mouse activity to /api/collect in small delta-encoded chunks (see event_collector.py).
+// Mousemove is sampled at most every SAMPLE_INTERVAL_MS and points closer than MIN_DISTANCE_PX to the last
+// kept one are dropped. Buffered events are flushed every FLUSH_INTERVAL_MS, when MAX_CHUNK_EVENTS are
+// waiting, and with sendBeacon when the page is hidden or unloaded. The session id is exposed as
+// window.botCollector.sessionId so /api/detect can be asked about this session.
+
+(function () {
+    const ENDPOINT = '/api/collect';
+    const SAMPLE_INTERVAL_MS = 50;
+    const MIN_DISTANCE_PX = 3;
+    const FLUSH_INTERVAL_MS = 5000;
+    const MAX_CHUNK_EVENTS = 500;
+
+    // Event kinds, as in mouse_decoder.py
+    const EVENT_MOVE = 0;
+    const EVENT_CLICKS = {0: 1, 2: 2, 1: 3}; // MouseEvent.button -> left, right, middle click
+    const EVENT_SCROLL = 4;
+
+    function sessionValue(key, create) {
+        try {
+            let value = sessionStorage.getItem(key);
+            if (value === null) {
+                value = String(create());
+                sessionStorage.setItem(key, value);
+            }
+            return value;
+        } catch (e) {
+            return String(create()); // Storage disabled: the session lasts as long as the page
+        }
+    }
+
+    const sessionId = sessionValue('botCollector.sessionId', () =>
+        (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : Date.now().toString(36) + Math.random().toString(36).slice(2));
+    const sessionStart = Number(sessionValue('botCollector.start', () => Date.now()));
+    let sequence = Number(sessionValue('botCollector.sequence', () => 0));
+
+    let kinds = [];
+    let moves = [];
+    let lastX = 0, lastY = 0, lastT = 0; // Previous move in the current chunk
+    let lastSampleT = -Infinity;
+
+    function now() {
+        return Date.now() - sessionStart;
+    }
+
+    function onMove(e) {
+        const t = now();
+        if (t - lastSampleT < SAMPLE_INTERVAL_MS) {
+            return;
+        }
+        const x = Math.round(e.pageX), y = Math.round(e.pageY);
+        if (moves.length && Math.abs(x - lastX) < MIN_DISTANCE_PX && Math.abs(y - lastY) < MIN_DISTANCE_PX) {
+            return;
+        }
+        lastSampleT = t;
+        kinds.push(EVENT_MOVE);
+        moves.push(x - lastX, y - lastY, t - lastT);
+        lastX = x; lastY = y; lastT = t;
+        if (kinds.length >= MAX_CHUNK_EVENTS) {
+            flush(false);
+        }
+    }
+
+    function onClick(e) {
+        if (e.button in EVENT_CLICKS) {
+            kinds.push(EVENT_CLICKS[e.button]);
+        }
+    }
+
+    let lastScrollT = -Infinity;
+    function onScroll() {
+        const t = now();
+        if (t - lastScrollT >= SAMPLE_INTERVAL_MS) {
+            lastScrollT = t;
+            kinds.push(EVENT_SCROLL);
+        }
+    }
+
+    // Returns a promise settled once the chunk has been delivered (or given up on)
+    function flush(useBeacon) {
+        if (!kinds.length) {
+            return Promise.resolve();
+        }
+        const body = JSON.stringify({s: sessionId, q: sequence, k: kinds, m: moves});
+        sequence += 1;
+        try {
+            sessionStorage.setItem('botCollector.sequence', String(sequence));
+        } catch (e) { /* storage disabled */ }
+        kinds = [];
+        moves = [];
+        lastX = lastY = lastT = 0; // Every chunk starts its deltas from 0
+
+        if (useBeacon && navigator.sendBeacon && navigator.sendBeacon(ENDPOINT, body)) {
+            return Promise.resolve();
+        }
+        return fetch(ENDPOINT, {method: 'POST', body: body, keepalive: true, headers: {'Content-Type': 'application/json'}})
+            .catch(() => {}); // Chunks are best effort; a lost one leaves a gap, not corrupt data
+    }
+
+    document.addEventListener('mousemove', onMove, {passive: true});
+    document.addEventListener('mousedown', onClick, {passive: true});
+    document.addEventListener('wheel', onScroll, {passive: true});
+    setInterval(() => flush(false), FLUSH_INTERVAL_MS);
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') {
+            flush(true);
+        }
+    });
+    window.addEventListener('pagehide', () => flush(true));
+
+    window.botCollector = {sessionId: sessionId, flush: flush};
+})();
@@ -0,0 +1,133 @@
+# bot-detector/tracing.py
+
+import os
+import csv
+import glob
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Lightweight span tracing for federated rounds. Every process (run.py, each client, the server)
+# appends finished spans as JSON lines to the file named by TRACE_FILE_ENV; run.py then merges the
+# files of a run into a Chrome/Perfetto trace and a per-round summary. Without the variable set,
+# spans are timed but not recorded.
+
+# --- Configuration ---
+TRACE_FILE_ENV = 'FL_TRACE_FILE'
+TRACES_DIR = 'traces'
+SERVER_PHASES = ('decrypt', 'collect', 'aggregate', 'save') # 'collect' replaces 'decrypt' under secure aggregation
+
+_context = {'process': 'main', 'round': None}
+_write_lock = threading.Lock()
+
+def set_context(process, round_num=None):
+    """Labels the spans recorded by this process (e.g. 'client_1', 'server') and the round they belong to."""
+    _context['process'] = process
+    _context['round'] = round_num
+
+def record_span(name, start_us, duration_us, **args):
+    trace_file = os.environ.get(TRACE_FILE_ENV)
+    if not trace_file:
+        return
+    record = {
+        'name': name,
+        'process': _context['process'],
+        'round': _context['round'],
+        'ts': start_us,
+        'dur': duration_us,
+        'tid': threading.get_ident(),
+        'args': args
+    }
+    with _write_lock:
+        with open(trace_file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+@contextmanager
+def span(name, **args):
+    """Times the enclosed block and records it as a span named name (extra keyword args are attached to it)."""
+    start_us = time.time_ns() // 1000 # Wall clock, so spans from different processes line up
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, start_us, int((time.perf_counter() - start) * 1e6), **args)
+
+# --- Merging and Export ---
+
+def load_spans(trace_dir):
+    spans = []
+    for path in sorted(glob.glob(os.path.join(trace_dir, '*.jsonl'))):
+        with open(path, 'r') as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
+
+def export_chrome_trace(spans, output_path):
+    """Writes spans as a Chrome trace (chrome://tracing, ui.perfetto.dev) with one track per process label."""
+    process_ids = {}
+    events = []
+    for s in sorted(spans, key=lambda s: s['ts']):
+        pid = process_ids.setdefault(s['process'], len(process_ids) + 1)
+        args = dict(s['args'])
+        if s['round'] is not None:
+            args['round'] = s['round']
+        events.append({'name': s['name'], 'cat': s['process'], 'ph': 'X', 'ts': s['ts'], 'dur': s['dur'],
+                       'pid': pid, 'tid': s['tid'] % 100000, 'args': args})
+    for process, pid in process_ids.items():
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': process}})
+        events.append({'name': 'process_sort_index', 'ph': 'M', 'pid': pid, 'args': {'sort_index': pid}})
+    with open(output_path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+def summarize_rounds(spans):
+    """
+    Returns one summary row per round. Clients run in parallel and the server runs after the last of them,
+    so the critical path of a round is the client that finished last followed by the server; the row names
+    that client and its longest phase.
+    """
+    rows = []
+    for round_num in sorted({s['round'] for s in spans if s['round'] is not None}):
+        round_spans = [s for s in spans if s['round'] == round_num]
+        phase_names = sorted({s['name'] for s in round_spans if s['process'] not in ('run', 'server')})
+        row = {'round': round_num}
+
+        round_span = next((s for s in round_spans if s['process'] == 'run' and s['name'] == 'round'), None)
+        row['round_seconds'] = round_span['dur'] / 1e6 if round_span else None
+        # Process-level spans from run.py include interpreter start-up and imports, which the phase spans do not
+        for name in ('clients', 'server'):
+            process_span = next((s for s in round_spans if s['process'] == 'run' and s['name'] == name), None)
+            row[f'{name}_process_seconds'] = process_span['dur'] / 1e6 if process_span else None
+
+        client_spans = {}
+        for s in round_spans:
+            if s['process'] not in ('run', 'server'):
+                client_spans.setdefault(s['process'], []).append(s)
+        if client_spans:
+            client_end = {client: max(s['ts'] + s['dur'] for s in items) for client, items in client_spans.items()}
+            critical_client = max(client_end, key=client_end.get)
+            critical_phase = max(client_spans[critical_client], key=lambda s: s['dur'])
+            client_start = min(s['ts'] for items in client_spans.values() for s in items)
+            row['critical_client'] = critical_client
+            row['critical_client_seconds'] = (client_end[critical_client] - client_start) / 1e6
+            row['critical_phase'] = critical_phase['name']
+            row['critical_phase_seconds'] = critical_phase['dur'] / 1e6
+        for phase in phase_names:
+            row[f'{phase}_max_seconds'] = max((s['dur'] for s in round_spans if s['name'] == phase and s['process'] not in ('run', 'server')), default=0) / 1e6
+
+        server_spans = [s for s in round_spans if s['process'] == 'server']
+        row['server_seconds'] = sum(s['dur'] for s in server_spans if s['name'] in SERVER_PHASES) / 1e6
+        for phase in SERVER_PHASES:
+            row[f'server_{phase}_seconds'] = sum(s['dur'] for s in server_spans if s['name'] == phase) / 1e6
+        rows.append(row)
+    return rows
+
+def export_round_summary(spans, output_path):
+    rows = summarize_rounds(spans)
+    fieldnames = []
+    for row in rows:
+        fieldnames.extend(k for k in row if k not in fieldnames)
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
@@ -1,40 +1,193 @@
 import os
+import glob
+import shutil
 import pickle
+import argparse
+import tempfile
 import joblib
+import numpy as np
 import pandas as pd
+import xgboost as xgb
 from sklearn.ensemble import RandomForestClassifier
-from client import load_partition_data
+from client import load_partition_data, iter_partition_rows
+from features import FEATURES
 from xgboost import XGBClassifier
+from drift_monitor import build_drift_reference, save_drift_reference, DRIFT_REFERENCE_PATH
 
-# --- Step 1: Load global feature names from FL round 20 ---
-with open('global_models/global_model_params_round_20.pkl', 'rb') as f:
-    global_params = pickle.load(f)
-
-feature_names = global_params['feature_names']
-print(f"✅ Loaded {len(feature_names)} global features from round 20.")
-
-# --- Step 2: Load training data from a client (e.g., client_1) ---
-clients = ['client_1', 'client_2', 'client_3']
-X_list, y_list = [], []
-for client in clients:
-    Xc, yc, _, _ = load_partition_data(client, 'train')
-    X_list.append(Xc)
-    y_list.append(yc)
-X = pd.concat(X_list, ignore_index=True)
-y = pd.concat(y_list, ignore_index=True)
-
-print("Train shape:", X.shape, y.shape)
-print("First 10 train session IDs:", X.index[:10])
-
-# --- Step 3: Align features ---
-X = X[feature_names]  # Keep only global FL features
-
-# --- Step 4: Train classifier ---
-model = XGBClassifier(n_estimators=100, learning_rate=0.1, max_depth=5, use_label_encoder=False, eval_metric='mlogloss', random_state=42)
-model.fit(X, y)
-print(f"✅ Trained XGBClassifier on {X.shape[0]} samples.")
-
-# --- Step 5: Save model to disk ---
-os.makedirs('model', exist_ok=True)  # Ensure model/ directory exists
-joblib.dump(model, 'model/global_model.joblib')
-print("✅ Final model saved to 'model/global_model.joblib' for use in Flask API.")
+# --- Configuration ---
+GLOBAL_PARAMS_PATH = 'global_models/global_model_params_round_20.pkl'
+MODEL_OUTPUT_PATH = 'model/global_model.joblib'
+CLIENTS = ['client_1', 'client_2', 'client_3']
+
+# Model settings shared by both training modes
+N_ESTIMATORS = 100
+LEARNING_RATE = 0.1
+MAX_DEPTH = 5
+NUM_CLASSES = 3
+RANDOM_STATE = 42
+
+# External-memory mode: feature batches are spilled here and streamed back through an xgboost DataIter
+BATCH_DIR = 'dataset/train_batches'
+BATCH_ROWS = 50000 # Rows per on-disk batch; peak memory while training scales with this, not the dataset
+MAX_BIN = 256      # Histogram bins per feature in the quantized matrix
+
+# --- Drift Reference ---
+
+def write_drift_reference(batches, feature_names):
+    """Saves the training features' reference histograms, which app.py compares live traffic against."""
+    save_drift_reference(build_drift_reference(batches, feature_names))
+    print(f"✅ Drift reference for {len(feature_names)} features saved to '{DRIFT_REFERENCE_PATH}'.")
+
+# --- External-Memory Training ---
+
+def write_feature_batches(clients, feature_names, batch_dir=BATCH_DIR, batch_rows=BATCH_ROWS):
+    """
+    Streams every client's training sessions from raw data into batch_dir as fixed-size .npy batches: each
+    session's feature row goes straight into the current batch, which is written out once full, so at most one
+    batch of rows is in memory however large a client is. Returns the number of rows written.
+    """
+    if os.path.exists(batch_dir):
+        shutil.rmtree(batch_dir)
+    os.makedirs(batch_dir)
+
+    # Features with no extractor are left at 0, as reindexing a loaded frame did
+    computed_names = [name for name in feature_names if name in FEATURES]
+    X_batch = np.zeros((batch_rows, len(feature_names)), dtype=np.float32)
+    y_batch = np.zeros(batch_rows, dtype=np.int32)
+    filled = 0
+    num_rows = 0
+    batch_index = 0
+
+    def flush():
+        nonlocal filled, batch_index
+        np.save(os.path.join(batch_dir, f"X_{batch_index:05d}.npy"), np.nan_to_num(X_batch[:filled], nan=0.0))
+        np.save(os.path.join(batch_dir, f"y_{batch_index:05d}.npy"), y_batch[:filled])
+        X_batch[:] = 0
+        filled = 0
+        batch_index += 1
+
+    for client in clients:
+        skipped = 0
+        for _, features, label in iter_partition_rows(client, 'train', computed_names):
+            if label is None:
+                skipped += 1
+                continue
+            X_batch[filled] = [features.get(name, 0) for name in feature_names]
+            y_batch[filled] = label
+            filled += 1
+            num_rows += 1
+            if filled == batch_rows:
+                flush()
+        if skipped:
+            print(f"[{client}] Skipped {skipped} sessions with an unknown label.")
+    if filled:
+        flush()
+    return num_rows
+
+class BatchIterator(xgb.DataIter):
+    """Feeds the on-disk feature batches to xgboost one at a time (memory-mapped, never concatenated)."""
+
+    def __init__(self, batch_dir, feature_names, cache_prefix):
+        self.x_paths = sorted(glob.glob(os.path.join(batch_dir, 'X_*.npy')))
+        self.y_paths = sorted(glob.glob(os.path.join(batch_dir, 'y_*.npy')))
+        self.feature_names = feature_names
+        self._index = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._index == len(self.x_paths):
+            return False
+        input_data(data=np.load(self.x_paths[self._index], mmap_mode='r'),
+                   label=np.load(self.y_paths[self._index], mmap_mode='r'),
+                   feature_names=self.feature_names)
+        self._index += 1
+        return True
+
+    def reset(self):
+        self._index = 0
+
+def train_external_memory(clients, feature_names, batch_dir=BATCH_DIR, batch_rows=BATCH_ROWS):
+    """
+    Trains the final model with xgboost's external-memory interface: batches are quantized into an on-disk
+    gradient-index cache with the hist method, so peak memory is bounded by one batch plus the quantile sketch.
+    The booster is returned as an XGBClassifier so the saved model is a drop-in for app.py.
+    """
+    num_rows = write_feature_batches(clients, feature_names, batch_dir, batch_rows)
+    print(f"✅ Spilled {num_rows} training rows to {batch_dir} in batches of up to {batch_rows}.")
+    write_drift_reference([np.load(path, mmap_mode='r') for path in sorted(glob.glob(os.path.join(batch_dir, 'X_*.npy')))], feature_names)
+
+    params = {
+        'objective': 'multi:softprob',
+        'num_class': NUM_CLASSES,
+        'tree_method': 'hist',
+        'max_bin': MAX_BIN,
+        'max_depth': MAX_DEPTH,
+        'learning_rate': LEARNING_RATE,
+        'eval_metric': 'mlogloss',
+        'seed': RANDOM_STATE
+    }
+    with tempfile.TemporaryDirectory(dir=batch_dir) as cache_dir:
+        iterator = BatchIterator(batch_dir, feature_names, cache_prefix=os.path.join(cache_dir, 'cache'))
+        if hasattr(xgb, 'ExtMemQuantileDMatrix'):
+            dtrain = xgb.ExtMemQuantileDMatrix(iterator, max_bin=MAX_BIN)
+        else:
+            dtrain = xgb.DMatrix(iterator) # xgboost < 3.0: page-based external memory
+        booster = xgb.train(params, dtrain, num_boost_round=N_ESTIMATORS)
+
+        # Round-trip through the model file so the result is an XGBClassifier like the in-memory path produces
+        model_file = os.path.join(cache_dir, 'booster.json')
+        booster.save_model(model_file)
+        model = XGBClassifier()
+        model.load_model(model_file)
+        # Release the matrix and its iterator while their cache files still exist
+        del dtrain, iterator, booster
+    print(f"✅ Trained XGBClassifier on {num_rows} samples (external memory).")
+    return model
+
+# --- In-Memory Training ---
+
+def train_in_memory(clients, feature_names):
+    X_list, y_list = [], []
+    for client in clients:
+        Xc, yc, _, _ = load_partition_data(client, 'train')
+        X_list.append(Xc)
+        y_list.append(yc)
+    X = pd.concat(X_list, ignore_index=True)
+    y = pd.concat(y_list, ignore_index=True)
+
+    print("Train shape:", X.shape, y.shape)
+    print("First 10 train session IDs:", X.index[:10])
+
+    # --- Align features ---
+    X = X[feature_names]  # Keep only global FL features
+    write_drift_reference([X.to_numpy(dtype=np.float64)], feature_names)
+
+    model = XGBClassifier(n_estimators=N_ESTIMATORS, learning_rate=LEARNING_RATE, max_depth=MAX_DEPTH, use_label_encoder=False, eval_metric='mlogloss', random_state=RANDOM_STATE)
+    model.fit(X, y)
+    print(f"✅ Trained XGBClassifier on {X.shape[0]} samples.")
+    return model
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the final global model served by app.py.")
+    parser.add_argument('--external-memory', action='store_true',
+                        help="Stream feature batches from disk instead of concatenating all clients in memory")
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS, help="Rows per on-disk batch in external-memory mode")
+    args = parser.parse_args()
+
+    # --- Step 1: Load global feature names from FL round 20 ---
+    with open(GLOBAL_PARAMS_PATH, 'rb') as f:
+        global_params = pickle.load(f)
+
+    feature_names = global_params['feature_names']
+    print(f"✅ Loaded {len(feature_names)} global features from round 20.")
+
+    # --- Step 2: Train classifier on all clients' training data ---
+    if args.external_memory:
+        model = train_external_memory(CLIENTS, feature_names, batch_rows=args.batch_rows)
+    else:
+        model = train_in_memory(CLIENTS, feature_names)
+
+    # --- Step 3: Save model to disk ---
+    os.makedirs('model', exist_ok=True)  # Ensure model/ directory exists
+    joblib.dump(model, MODEL_OUTPUT_PATH)
+    print(f"✅ Final model saved to '{MODEL_OUTPUT_PATH}' for use in Flask API.")
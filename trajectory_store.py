@@ -0,0 +1,209 @@
+# bot-detector/trajectory_store.py
+
+import os
+import sys
+import json
+import glob
+import shutil
+import tempfile
+from collections import namedtuple
+import numpy as np
+from mouse_decoder import decode_mouse_events
+
+# --- Configuration ---
+DEFAULT_SOURCE_DIR = 'dataset/phase1/data/mouse_movements'
+DEFAULT_STORE_PATH = 'dataset/phase1_trajectories.bin'
+
+STORE_MAGIC = b'BOTTRAJ1'
+# Bumped whenever the stored arrays would decode differently; version 1 stores were written by a converter
+# with its own parser, so their features could differ from the JSON path's and they must be rebuilt
+STORE_VERSION = 2
+ARRAY_ALIGNMENT = 64 # Every array starts on a 64-byte boundary so memory-mapped views are aligned
+
+# Per-event arrays and the offsets index that slices them per session.
+# Coordinates and times are indexed separately because malformed entries are skipped independently.
+STORE_ARRAYS = {
+    'event_kind': np.int32,
+    'x': np.int32,
+    'y': np.int32,
+    't': np.float64, # Milliseconds (or the source's time unit) relative to the session's first move time
+    'event_offsets': np.int64,
+    'xy_offsets': np.int64,
+    't_offsets': np.int64,
+    't0': np.float64, # Absolute time of each session's first move
+}
+
+# A session's trajectory as zero-copy views into the memory-mapped store
+Trajectory = namedtuple('Trajectory', ['session_id', 'event_kind', 'x', 'y', 't', 't0'])
+
+# --- Writing ---
+
+def align_offset(offset):
+    return -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+def find_session_files(source_dir=DEFAULT_SOURCE_DIR):
+    """
+    Yields (session_id, json_paths) for every session with a mouse_movements.json under source_dir, once per
+    session. A session found under several scenario folders lists every copy, in the order the JSON loader reads them.
+    """
+    copies = {}
+    for json_path in sorted(glob.glob(os.path.join(source_dir, '**', 'mouse_movements.json'), recursive=True)):
+        copies.setdefault(os.path.basename(os.path.dirname(json_path)), []).append(json_path)
+    yield from copies.items()
+
+def read_last_copy(session_id, json_paths):
+    """Returns the mouse data of the session's last readable copy, as the JSON loader keeps, or None."""
+    for json_path in reversed(json_paths):
+        try:
+            with open(json_path, 'r') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON for session {session_id} in {json_path}, skipping.")
+    return None
+
+def build_trajectory_store(session_files, output_path=DEFAULT_STORE_PATH):
+    """
+    Packs per-session mouse_movements.json files (as listed by find_session_files) into a single store file.
+    Arrays are streamed to temporary files while parsing, so conversion memory is bounded by one session.
+    Returns the number of sessions written.
+    """
+    session_ids = []
+    lengths = {'event_kind': 0, 'x': 0, 'y': 0, 't': 0}
+    offsets = {'event_offsets': [0], 'xy_offsets': [0], 't_offsets': [0]}
+    t0_values = []
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(output_path) or '.') as tmp_dir:
+        spill = {name: open(os.path.join(tmp_dir, name), 'wb') for name in lengths}
+        try:
+            for session_id, json_paths in session_files:
+                mouse_data = read_last_copy(session_id, json_paths)
+                if mouse_data is None:
+                    continue
+
+                event_kind, x, y, t = decode_mouse_events(mouse_data)
+                t0 = float(t[0]) if len(t) else 0.0
+                columns = {
+                    'event_kind': event_kind.astype(np.int32),
+                    'x': x.astype(np.int32),
+                    'y': y.astype(np.int32),
+                    't': (t - t0).astype(np.float64)
+                }
+                for name, values in columns.items():
+                    spill[name].write(values.tobytes())
+                    lengths[name] += len(values)
+
+                session_ids.append(session_id)
+                t0_values.append(t0)
+                offsets['event_offsets'].append(lengths['event_kind'])
+                offsets['xy_offsets'].append(lengths['x'])
+                offsets['t_offsets'].append(lengths['t'])
+        finally:
+            for f in spill.values():
+                f.close()
+
+        index_arrays = {name: np.array(values, dtype=np.int64) for name, values in offsets.items()}
+        index_arrays['t0'] = np.array(t0_values, dtype=np.float64)
+
+        # Lay out the arrays after the header, each on an aligned boundary.
+        # Offsets are relative to the start of the data section, which follows the header.
+        array_layout = {}
+        position = 0
+        for name, dtype in STORE_ARRAYS.items():
+            length = lengths[name] if name in lengths else len(index_arrays[name])
+            array_layout[name] = {'dtype': np.dtype(dtype).str, 'length': int(length), 'offset': position}
+            position = align_offset(position + length * np.dtype(dtype).itemsize)
+
+        header = {'version': STORE_VERSION, 'session_ids': session_ids, 'arrays': array_layout}
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = align_offset(len(STORE_MAGIC) + 8 + len(header_bytes))
+
+        tmp_output = output_path + '.tmp'
+        with open(tmp_output, 'wb') as out:
+            out.write(STORE_MAGIC)
+            out.write(len(header_bytes).to_bytes(8, 'little'))
+            out.write(header_bytes)
+            for name in STORE_ARRAYS:
+                out.write(b'\0' * (data_start + array_layout[name]['offset'] - out.tell()))
+                if name in spill:
+                    with open(os.path.join(tmp_dir, name), 'rb') as f:
+                        shutil.copyfileobj(f, out)
+                else:
+                    out.write(index_arrays[name].tobytes())
+        os.replace(tmp_output, output_path)
+
+    return len(session_ids)
+
+# --- Reading ---
+
+class TrajectoryStore:
+    """
+    Read-only view of a packed trajectory store. The file is memory-mapped once and every
+    session is handed out as slices of the shared arrays, so nothing is parsed or copied per session.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(STORE_MAGIC)) != STORE_MAGIC:
+                raise ValueError(f"{path} is not a trajectory store")
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length))
+        data_start = align_offset(len(STORE_MAGIC) + 8 + header_length)
+        if header['version'] != STORE_VERSION:
+            raise ValueError(f"Unsupported trajectory store version {header['version']} in {path}")
+
+        self._mmap = np.memmap(path, dtype=np.uint8, mode='r')
+        self.arrays = {}
+        for name, layout in header['arrays'].items():
+            self.arrays[name] = np.frombuffer(self._mmap, dtype=np.dtype(layout['dtype']), count=layout['length'], offset=data_start + layout['offset'])
+        self.session_ids = header['session_ids']
+        self._index = {session_id: i for i, session_id in enumerate(self.session_ids)}
+
+    def __len__(self):
+        return len(self.session_ids)
+
+    def __contains__(self, session_id):
+        return session_id in self._index
+
+    def get(self, session_id):
+        """Returns the session's Trajectory, or None if the store does not contain it."""
+        i = self._index.get(session_id)
+        if i is None:
+            return None
+        a = self.arrays
+        ev_start, ev_end = a['event_offsets'][i], a['event_offsets'][i + 1]
+        xy_start, xy_end = a['xy_offsets'][i], a['xy_offsets'][i + 1]
+        t_start, t_end = a['t_offsets'][i], a['t_offsets'][i + 1]
+        return Trajectory(
+            session_id=session_id,
+            event_kind=a['event_kind'][ev_start:ev_end],
+            x=a['x'][xy_start:xy_end],
+            y=a['y'][xy_start:xy_end],
+            t=a['t'][t_start:t_end],
+            t0=float(a['t0'][i])
+        )
+
+_open_stores = {}
+
+def open_trajectory_store(path=DEFAULT_STORE_PATH):
+    """
+    Returns a shared TrajectoryStore for path, or None if no store has been built there or it was built by
+    another version (callers then read the per-session JSON files, which decode the same way).
+    """
+    if not os.path.exists(path):
+        return None
+    if path not in _open_stores:
+        try:
+            _open_stores[path] = TrajectoryStore(path)
+        except ValueError as e:
+            print(f"⚠️ Ignoring trajectory store: {e}. Rebuild it with `python trajectory_store.py`.")
+            return None
+    return _open_stores[path]
+
+if __name__ == "__main__":
+    # Usage: python trajectory_store.py [source_dir] [output_path]
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SOURCE_DIR
+    output_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_STORE_PATH
+
+    num_sessions = build_trajectory_store(find_session_files(source_dir), output_path)
+    print(f"✅ Packed {num_sessions} sessions from {source_dir} into {output_path} ({os.path.getsize(output_path)} bytes).")
@@ -0,0 +1,161 @@
+# bot-detector/verdict_log.py
+
+import os
+import json
+import gzip
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+
+# Write-behind sink for detection verdicts. The request path only puts the verdict on a bounded in-memory
+# queue; a background thread serializes batches to rolling gzip NDJSON files and fsyncs once per batch.
+# Every batch ends in a gzip sync flush, so a file cut short by a crash still decompresses up to its last batch.
+# When the queue is full, verdicts are dropped (default) or the request waits, depending on FULL_POLICY.
+
+# --- Configuration ---
+VERDICT_LOG_ENABLED = os.environ.get('BOT_VERDICT_LOG') == '1'
+VERDICT_LOG_DIR = os.environ.get('BOT_VERDICT_LOG_DIR', 'verdicts')
+FULL_POLICY = os.environ.get('BOT_VERDICT_LOG_POLICY', 'drop') # 'drop' or 'block'
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500          # Records written per fsync at most
+FLUSH_INTERVAL = 1.0      # Seconds a partial batch waits before it is written anyway
+ROLL_BYTES = 64 * 1024 * 1024 # Uncompressed bytes per file before rolling to a new one
+ROLL_SECONDS = 3600.0     # Age after which a file is rolled even if small
+
+class VerdictLog:
+    """Bounded queue of verdict records drained into rolling compressed NDJSON files by a daemon thread."""
+
+    def __init__(self, log_dir=VERDICT_LOG_DIR, full_policy=FULL_POLICY, queue_size=QUEUE_SIZE):
+        if full_policy not in ('drop', 'block'):
+            raise ValueError("full_policy must be 'drop' or 'block'")
+        self.log_dir = log_dir
+        self.full_policy = full_policy
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._gzip = None
+        self._file_bytes = 0
+        self._file_opened = 0.0
+        self._closed = False
+        self.metrics = {'submitted': 0, 'dropped': 0, 'written': 0, 'batches': 0, 'files': 0,
+                        'last_lag_ms': 0.0, 'max_lag_ms': 0.0, 'last_write_ms': 0.0, 'errors': 0}
+        self._metrics_lock = threading.Lock() # Request threads and the writer thread both update metrics
+        os.makedirs(log_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._drain, name='verdict-log', daemon=True)
+        self._thread.start()
+
+    # --- Request Path ---
+
+    def submit(self, record):
+        """Queues a verdict record (a JSON-serializable dict); returns False if it was dropped."""
+        self._count('submitted')
+        item = (time.monotonic(), record)
+        if self.full_policy == 'block':
+            self._queue.put(item)
+            return True
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self._count('dropped')
+            return False
+
+    def stats(self):
+        """Queue depth and lag: lag is the time from submit() until the record's batch was fsynced."""
+        with self._queue.mutex: # The writer thread may take the oldest item between a size check and the peek
+            oldest = self._queue.queue[0][0] if self._queue.queue else None
+            queue_depth = len(self._queue.queue)
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        return {
+            **metrics,
+            'queue_depth': queue_depth,
+            'queue_capacity': self._queue.maxsize,
+            'oldest_queued_ms': (time.monotonic() - oldest) * 1000 if oldest is not None else 0.0,
+            'full_policy': self.full_policy,
+            'current_file': self._file.name if self._file else None
+        }
+
+    def _count(self, name, amount=1):
+        with self._metrics_lock:
+            self.metrics[name] += amount
+
+    # --- Writer Thread ---
+
+    def _open_file(self):
+        self._close_file()
+        path = os.path.join(self.log_dir, f"verdicts_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.ndjson.gz")
+        self._file = open(path, 'ab')
+        self._gzip = gzip.GzipFile(fileobj=self._file, mode='ab')
+        self._file_bytes = 0
+        self._file_opened = time.monotonic()
+        self._count('files')
+
+    def _close_file(self):
+        if self._gzip is not None:
+            self._gzip.close()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._gzip = self._file = None
+
+    def _write_batch(self, batch):
+        start = time.monotonic()
+        if self._gzip is None or self._file_bytes >= ROLL_BYTES or start - self._file_opened >= ROLL_SECONDS:
+            self._open_file()
+        data = ''.join(json.dumps(record, default=float) + '\n' for _, record in batch).encode('utf-8')
+        self._gzip.write(data)
+        self._gzip.flush() # zlib sync flush: the batch is a complete, decodable block
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file_bytes += len(data)
+
+        done = time.monotonic()
+        lag_ms = (done - batch[0][0]) * 1000
+        with self._metrics_lock:
+            self.metrics['written'] += len(batch)
+            self.metrics['batches'] += 1
+            self.metrics['last_lag_ms'] = lag_ms
+            self.metrics['max_lag_ms'] = max(self.metrics['max_lag_ms'], lag_ms)
+            self.metrics['last_write_ms'] = (done - start) * 1000
+
+    def _drain(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                if self._closed:
+                    break
+                continue
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # Any failure (a full disk, a record json cannot serialize) loses this batch but never the
+                # thread: with the 'block' policy a dead writer would stall every request once the queue fills
+                self._count('errors')
+                print(f"⚠️ Verdict log write failed, {len(batch)} verdicts lost: {e!r}")
+        self._close_file()
+
+    def close(self):
+        """Writes out everything queued so far and closes the current file."""
+        self._closed = True
+        self._thread.join()
+
+_verdict_log = None
+
+def open_verdict_log():
+    """Returns this process's VerdictLog (started on first use and flushed at exit), or None when disabled."""
+    global _verdict_log
+    if not VERDICT_LOG_ENABLED:
+        return None
+    if _verdict_log is None:
+        _verdict_log = VerdictLog()
+        atexit.register(_verdict_log.close)
+    return _verdict_log